@@ -7,11 +7,40 @@ BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 RESOURCES_DIR = os.path.join(BASE_DIR, "resources")
 IMAGES_DIR = os.path.join(RESOURCES_DIR, "images")
 KNOWLEDGE_PATH = os.path.join(RESOURCES_DIR, "knowledge.json")
+LEARNED_PATH = os.path.join(RESOURCES_DIR, "learned.json")  # 用户教的内容
 # 数据路径
 DATA_DIR = os.path.join(BASE_DIR, "data")
-CHAT_HISTORY_PATH = os.path.join(DATA_DIR, "chat_history.json")
+CHAT_HISTORY_PATH = os.path.join(DATA_DIR, "chat_history.json")  # 旧版整文件JSON数组，仅用于迁移
+CHAT_LOG_PATH = os.path.join(DATA_DIR, "chat_history.jsonl")  # 单文件JSONL聊天记录，仅用于迁移
+CHAT_LOG_DIR = os.path.join(DATA_DIR, "chat_history")  # 按天分段的聊天记录目录
 RATING_RECORD_PATH = os.path.join(DATA_DIR, "rating_record.json")
+RATING_RECORD_LOG_PATH = os.path.join(DATA_DIR, "rating_record.jsonl")  # 评分增量日志，启动时合并进 rating_record.json
 DIALOG_WEIGHTS_PATH = os.path.join(DATA_DIR, "dialog_weights.json")
+DIALOG_WEIGHTS_LOG_PATH = os.path.join(DATA_DIR, "dialog_weights.jsonl")  # 权重增量日志，启动时合并进 dialog_weights.json
+STORAGE_DB_PATH = os.path.join(DATA_DIR, "pet_data.db")  # SQLite存储后端的数据库文件
+ARCHIVE_DIR = os.path.join(DATA_DIR, "archive")  # 冷数据压缩归档分段
+MEMORY_ARCHIVE_PATH = os.path.join(DATA_DIR, "memory_archive.json")  # 归档清单
+JOURNAL_PATH = os.path.join(DATA_DIR, "journal.wal")  # 预写变更日志，启动时重放
+INDEX_CACHE_PATH = os.path.join(DATA_DIR, "match_index.cache")  # 构建好的匹配索引，按源文件内容摘要校验
+KNOWLEDGE_PAGES_DIR = os.path.join(DATA_DIR, "knowledge_pages")  # 按学习类别拆分的知识库分页
+
+# 数据保留策略默认值（条数上限 / 天数上限 / 字节预算，0表示不限制）
+RETENTION_DEFAULTS = {
+    "chat_max_records": 50000,  # 热聊天记录条数上限
+    "chat_max_bytes": 64 * 1024 * 1024,  # 热聊天记录分段总字节预算
+    "chat_max_days": 0,  # 聊天记录保留天数（超期的通常已被归档）
+    "rating_max_records": 20000,
+    "rating_max_bytes": 8 * 1024 * 1024,  # rating_record.json 字节预算
+    "rating_max_days": 365,
+    "exploration_max_records": 2000,  # exploration_history.json 中 explorations 列表
+    "exploration_max_bytes": 8 * 1024 * 1024,
+    "exploration_max_days": 365,
+    "user_responses_max_records": 500,  # exploration_history.json 中 user_responses 字典
+    "timeline_max_records": 5000,  # 记忆时间线
+    "timeline_max_bytes": 4 * 1024 * 1024,
+    "gc_orphan_weights": True,  # 清理对应内容已不存在的权重
+    "archive_evicted": True,  # 超出上限/预算的数据先移入冷数据归档再从热数据删除
+}
 
 # 桌宠窗口配置
 PET_WIDTH = 100  # 桌宠宽度
@@ -35,6 +64,7 @@ EXPLORATION_HISTORY_PATH = os.path.join(DATA_DIR, "exploration_history.json")
 EXPLORATION_CONFIG_PATH = os.path.join(DATA_DIR, "exploration_config.json")
 USER_INTERESTS_PATH = os.path.join(DATA_DIR, "user_interests.json")
 EXPLORATION_MEMORY_PATH = os.path.join(DATA_DIR, "exploration_memory.json")
+EXPLORATION_MEMORY_LOG_PATH = os.path.join(DATA_DIR, "exploration_memory.jsonl")  # 记忆增量日志（新增/覆盖），启动时合并进 exploration_memory.json
 
 # 探索参数
 EXPLORATION_INTERVAL = 10  # 探索间隔（秒），默认5分钟
@@ -71,6 +101,26 @@ def load_settings():
         "active_push_interval": 3600,
         "enable_active_push": True,
 
+        # 匹配设置
+        "fuzzy_match": True,  # 精确匹配失败时用字符n-gram TF-IDF模糊匹配兜底
+        "fuzzy_threshold": 0.35,  # 模糊匹配的最低余弦相似度
+        "fuzzy_top_k": 5,  # 模糊匹配返回的候选数
+        "response_cache_size": 512,  # 回复候选缓存的条目数，0表示不缓存
+        "knowledge_reload_interval": 2.0,  # 检查知识文件是否被修改的间隔（秒），0表示不热重载
+        "segmenter_cache_size": 1024,  # 分词结果缓存的条目数，0表示不缓存
+        "dictionary_types": ["单词"],  # 按词典模式编译（支持"查 app"精确/前缀查询）的学习类别
+        "dictionary_max_results": 10,  # 词典查询最多返回的词条数
+        "knowledge_pack": "",  # 预编译的知识包（相对 resources 目录），为空时读 knowledge.json
+        "index_cache": True,  # 把构建好的匹配索引缓存到 data 目录，启动时直接读取
+        "study_page_cache": 8,  # 学习类别分页常驻内存的页数，0表示不分页（整个知识库常驻）
+
+        # 存储设置
+        "storage_backend": "json",  # json / sqlite
+        "write_behind_delay": 0.5,  # 延迟写入的合并窗口（秒）
+        "archive_after_days": 90,  # 超过多少天的聊天/评分/记忆移入压缩归档，0表示不归档
+        "archive_compression": "gzip",  # gzip / lzma
+        "retention": dict(RETENTION_DEFAULTS),  # 数据保留策略，见 RETENTION_DEFAULTS
+
         # 界面设置
         "pet_size": 100,
         "default_position_x": 500,
@@ -0,0 +1,184 @@
+"""
+闲聊问题索引：把学习内容和知识库里的全部问题编译成一个 Aho-Corasick 多模式自动机
+一次扫描用户输入即可找出所有出现在输入中的问题，不再逐条做子串查找
+同时维护一份字符n-gram TF-IDF模糊索引，精确匹配失败时兜底
+"""
+from collections import deque
+
+from core.knowledge.learned_groups import LearnedGroups
+
+try:
+    from core.knowledge.fuzzy_index import FuzzyIndex
+    FUZZY_IMPORT_ERROR = None
+except ImportError as e:  # 没有安装NumPy时不提供模糊匹配（开启了模糊匹配时提示一次）
+    FuzzyIndex = None
+    FUZZY_IMPORT_ERROR = e
+
+_fuzzy_warned = False
+
+
+def _warn_fuzzy_unavailable():
+    """开启了模糊匹配但依赖不可用时提示一次，而不是悄悄退回精确匹配"""
+    global _fuzzy_warned
+    if not _fuzzy_warned:
+        _fuzzy_warned = True
+        print(f"⚠️ 模糊匹配不可用，只做精确匹配（请安装 requirements.txt 中的 numpy）：{FUZZY_IMPORT_ERROR}")
+
+
+class AhoCorasick:
+    """多模式匹配自动机；新增模式只插入字典树，失配链接在下次查询前统一补建"""
+
+    def __init__(self):
+        self.goto = [{}]  # 节点 -> {字符: 子节点}
+        self.fail = [0]
+        self.own = [[]]  # 以该节点结尾的模式所带的数据
+        self.out = [[]]  # 沿失配链接合并后的全部输出
+        self._dirty = False
+
+    def add(self, pattern, payload):
+        """插入一个模式（空模式忽略）"""
+        if not pattern:
+            return
+        node = 0
+        for ch in pattern:
+            nxt = self.goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto[node][ch] = nxt
+                self.goto.append({})
+                self.fail.append(0)
+                self.own.append([])
+                self.out.append([])
+            node = nxt
+        self.own[node].append(payload)
+        self._dirty = True
+
+    def build(self):
+        """按层（BFS）重建失配链接和输出表"""
+        queue = deque()
+        for child in self.goto[0].values():
+            self.fail[child] = 0
+            self.out[child] = list(self.own[child])
+            queue.append(child)
+        while queue:
+            node = queue.popleft()
+            for ch, child in self.goto[node].items():
+                state = self.fail[node]
+                while state and ch not in self.goto[state]:
+                    state = self.fail[state]
+                self.fail[child] = self.goto[state].get(ch, 0)
+                self.out[child] = self.own[child] + self.out[self.fail[child]]
+                queue.append(child)
+        self._dirty = False
+
+    def iter_matches(self, text):
+        """扫描一遍文本，逐个产出 (结束位置, 数据)"""
+        if self._dirty:
+            self.build()
+        node = 0
+        for end, ch in enumerate(text):
+            while node and ch not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(ch, 0)
+            for payload in self.out[node]:
+                yield end, payload
+
+    def find_all(self, text):
+        """扫描一遍文本，返回所有命中模式的数据（去重，按首次命中顺序）"""
+        if self._dirty:
+            self.build()
+        found = {}
+        node = 0
+        for ch in text:
+            while node and ch not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(ch, 0)
+            for payload in self.out[node]:
+                found.setdefault(payload, None)
+        return list(found)
+
+
+class ChatIndex:
+    """学习内容 + 知识库闲聊的问题索引，匹配优先级与原逻辑一致：先学习内容，再知识库"""
+
+    def __init__(self, learned_chat, knowledge_chat, fuzzy=True, packed=None):
+        self.automaton = AhoCorasick()
+        # 知识包：知识库问题用包里预编译的自动机匹配，条目按需解码，模糊索引只覆盖学习内容
+        self.packed = packed
+        self.knowledge = knowledge_chat if packed is not None else list(knowledge_chat)
+        # 学习内容按规范问题合并：每个问题只有一个模式，命中后带出它的全部回答
+        self.groups = LearnedGroups()
+        self.learned = []  # 去重后的全部学习条目
+        self.source_count = 0  # 已读入的原始条目数（含被合并掉的重复条目）
+        entries = []
+        for i, item in enumerate(self.knowledge if packed is None else ()):
+            for q in item.get("question", []):
+                self.automaton.add(str(q).lower(), ("knowledge", i))
+                entries.append((str(q), ("knowledge", i)))
+        for item in learned_chat:
+            self.source_count += 1
+            group, is_new_group = self._add_to_group(item)
+            if is_new_group:
+                entries.append((self.groups.questions[group], ("learned", group)))
+        if fuzzy and FuzzyIndex is None:
+            _warn_fuzzy_unavailable()
+        self.fuzzy = FuzzyIndex(entries) if fuzzy and FuzzyIndex is not None else None
+
+    def _add_to_group(self, item):
+        """加入分组，返回 (组下标, 是否是新问题)；新问题同时加入自动机"""
+        groups_before = len(self.groups)
+        group, added = self.groups.add(item)
+        if added:
+            self.learned.append(item)
+        is_new_group = len(self.groups) > groups_before
+        if is_new_group:
+            self.automaton.add(self.groups.questions[group], ("learned", group))
+        return group, is_new_group
+
+    def weight_ids(self, item):
+        """学习条目的权重ID（含合并进它的重复条目）"""
+        return self.groups.weight_ids(item)
+
+    def has_learned(self, question, answer):
+        """同一问题（规范化后）下是否已经有相同的回答"""
+        return self.groups.find(question, answer) is not None
+
+    def add_learned(self, item):
+        """增量加入一条学习内容（learn_from_user 调用）；与已有条目重复时合并掉"""
+        self.source_count += 1
+        group, is_new_group = self._add_to_group(item)
+        if is_new_group and self.fuzzy is not None:
+            self.fuzzy.add(self.groups.questions[group], ("learned", group))
+
+    def match(self, text):
+        """返回 (命中的学习内容列表（按问题首次学习的顺序）, 第一个命中的知识库条目或None)"""
+        learned, knowledge = [], []
+        for kind, i in self.automaton.find_all(text):
+            (learned if kind == "learned" else knowledge).append(i)
+        first = min(knowledge) if knowledge else None
+        if self.packed is not None:
+            first = self.packed.first_chat_match(text)
+        return ([item for group in sorted(learned) for item in self.groups.group(group)],
+                self.knowledge[first] if first is not None else None)
+
+    def _expand(self, hits):
+        """模糊命中 -> [(来源, 条目, 分数)]；命中一个学习问题时带出它的全部回答"""
+        results = []
+        for (kind, i), score in hits:
+            if kind == "learned":
+                results.extend(("learned", item, score) for item in self.groups.group(i))
+            else:
+                results.append(("knowledge", self.knowledge[i], score))
+        return results
+
+    def fuzzy_match(self, text, top_k=5, threshold=0.35):
+        """模糊匹配：返回按相似度从高到低的 [(来源, 条目, 分数)]，没有模糊索引时返回空列表"""
+        if self.fuzzy is None:
+            return []
+        return self._expand(self.fuzzy.search(text, top_k, threshold))
+
+    def fuzzy_match_many(self, texts, top_k=5, threshold=0.35):
+        """批量模糊匹配，返回与texts一一对应的候选列表"""
+        if self.fuzzy is None:
+            return [[] for _ in texts]
+        return [self._expand(hits) for hits in self.fuzzy.search_many(texts, top_k, threshold)]
@@ -0,0 +1,174 @@
+"""
+闲聊回复决策：根据问题索引和权重决定回复什么，不写聊天记录、不改任何状态
+match_chat（单条，写聊天记录）和 match_chat_many（批量离线评估/回放）共用这一套逻辑
+- collect_candidates：找出每条输入的候选（精确命中的学习内容 / 知识库条目，或模糊匹配的候选）
+- choose_reply：从候选中选出回复（学习内容按权重用别名表抽样）
+"""
+import random
+from concurrent.futures import ProcessPoolExecutor
+
+from core.config import DEFAULT_WEIGHT
+from core.knowledge.weighted_sampler import WeightedSampler
+from core.knowledge.learned_groups import canonical_question
+
+# 权重不高于此值的学习内容不参与选择
+MIN_REPLY_WEIGHT = 0.5
+
+
+def collect_candidates(chat_index, inputs, weight_of, fuzzy=True, top_k=5, threshold=0.35):
+    """找出每条（已规范化的）输入的候选，返回 [{"match": 匹配方式, "candidates": [...]}]
+    匹配方式：learned（命中学习内容）、knowledge（命中知识库）、fuzzy（模糊匹配）、none"""
+    results = [None] * len(inputs)
+    pending = []
+    for i, text in enumerate(inputs):
+        learned_hits, knowledge_item = chat_index.match(text)
+        # 没有dialog_id的学习内容跳过
+        learned = [item for item in learned_hits if item.get("dialog_id", "")]
+        if learned:
+            results[i] = {"match": "learned",
+                          "candidates": [{"source": "learned", "item": item, "score": 1.0,
+                                          "weight_ids": chat_index.weight_ids(item)} for item in learned]}
+        elif knowledge_item is not None:
+            results[i] = {"match": "knowledge",
+                          "candidates": [{"source": "knowledge", "item": knowledge_item, "score": 1.0}]}
+        else:
+            pending.append(i)
+
+    # 精确匹配失败的输入一起做模糊匹配
+    if fuzzy and pending:
+        fuzzy_hits = chat_index.fuzzy_match_many([inputs[i] for i in pending], top_k, threshold)
+    else:
+        fuzzy_hits = [[] for _ in pending]
+    for i, hits in zip(pending, fuzzy_hits):
+        candidates = [{"source": source, "item": item, "score": score} for source, item, score in hits]
+        for candidate in candidates:
+            if candidate["source"] == "learned" and candidate["item"].get("dialog_id"):
+                candidate["weight_ids"] = chat_index.weight_ids(candidate["item"])
+        results[i] = {"match": "fuzzy" if candidates else "none", "candidates": candidates}
+
+    # 所有学习内容候选的权重一次批量获取
+    return fill_weights(results, weight_of)
+
+
+def candidate_weight_ids(candidate):
+    """学习内容候选的权重ID：它的dialog_id和合并进它的重复条目的dialog_id"""
+    return candidate.get("weight_ids") or [candidate["item"].get("dialog_id")]
+
+
+def fill_weights(results, weight_of):
+    """按当前权重给学习内容候选填上 weight（缓存命中的候选也用它刷新权重）
+    合并了重复条目的回答取这几个dialog_id权重的平均值"""
+    learned_ids = [weight_id for entry in results for c in entry["candidates"]
+                   if c["source"] == "learned" and c["item"].get("dialog_id")
+                   for weight_id in candidate_weight_ids(c)]
+    weights = dict(zip(learned_ids, weight_of(learned_ids))) if learned_ids else {}
+    for entry in results:
+        for candidate in entry["candidates"]:
+            if candidate["source"] == "learned":
+                values = [weights.get(weight_id, 0.0) for weight_id in candidate_weight_ids(candidate)]
+                candidate["weight"] = sum(values) / len(values)
+    return results
+
+
+def chat_group_key(item):
+    """学习内容所在的问题组（规范化后同一问题的全部回答）"""
+    return ("chat", canonical_question(item.get("q", "")))
+
+
+def reply_weight(weight):
+    """抽样用的权重：不高于 MIN_REPLY_WEIGHT 的回答记为0（留在表里但不会被抽中）"""
+    return weight if weight > MIN_REPLY_WEIGHT else 0.0
+
+
+def has_reply(candidates):
+    """候选中是否有可以用来回复的学习内容"""
+    return any(reply_weight(c["weight"]) > 0 for c in candidates)
+
+
+def choose_weighted(candidates, sampler=None, rng=random):
+    """按权重在学习内容候选中抽一条；同一问题组共用一张缓存的别名表
+    candidates 须是完整的问题组（低权重的回答也要传入），这样组里任何一个回答的权重变化都能让表失效；
+    调用前用 has_reply 确认至少有一条可用"""
+    groups = {}
+    for candidate in candidates:
+        groups.setdefault(chat_group_key(candidate["item"]), []).append(candidate)
+    sampler = sampler if sampler is not None else WeightedSampler()
+    return sampler.choose_grouped([
+        (key, [c["item"] for c in group], [weight_id for c in group for weight_id in candidate_weight_ids(c)],
+         [reply_weight(c["weight"]) for c in group])
+        for key, group in groups.items()
+    ], rng)
+
+
+def choose_reply(entry, default_answers, rng=random, sampler=None):
+    """从候选中选出回复，返回 (回复, 关联的学习内容dialog_id, 来源, 分数)"""
+    candidates = entry["candidates"]
+    if entry["match"] == "learned":
+        if has_reply(candidates):
+            # 权重越高越容易被选中（2.0的回答被选中的概率是1.0的两倍）
+            item = choose_weighted(candidates, sampler, rng)
+            return item["a"], item["dialog_id"], "learned", 1.0
+        # 所有匹配的都是低权重，返回默认回复
+        return rng.choice(default_answers), "", "default", 0.0
+    if entry["match"] == "knowledge":
+        return rng.choice(candidates[0]["item"].get("answer", [])), "", "knowledge", 1.0
+    # 模糊匹配：按相似度取第一个可用的候选（学习问题在它的回答里按权重抽）
+    for candidate in candidates:
+        item = candidate["item"]
+        if candidate["source"] == "learned":
+            key = chat_group_key(item)
+            group = [c for c in candidates if c["source"] == "learned" and chat_group_key(c["item"]) == key
+                     and c["item"].get("dialog_id")]
+            if has_reply(group):
+                item = choose_weighted(group, sampler, rng)
+                return item["a"], item["dialog_id"], "fuzzy", candidate["score"]
+        elif item.get("answer"):
+            return rng.choice(item["answer"]), "", "fuzzy", candidate["score"]
+    return rng.choice(default_answers), "", "default", 0.0
+
+
+def resolve_chats(chat_index, inputs, weight_of, default_answers, fuzzy=True, top_k=5, threshold=0.35,
+                  rng=random, sampler=None):
+    """批量决定回复，返回与inputs一一对应的结果字典"""
+    sampler = sampler if sampler is not None else WeightedSampler()
+    results = []
+    for text, entry in zip(inputs, collect_candidates(chat_index, inputs, weight_of, fuzzy, top_k, threshold)):
+        reply, related_dialog_id, source, score = choose_reply(entry, default_answers, rng, sampler)
+        results.append({
+            "input": text,
+            "reply": reply,
+            "related_dialog_id": related_dialog_id,
+            "source": source,
+            "score": score,
+            "candidates": entry["candidates"]
+        })
+    return results
+
+
+# ---------- 进程池 ----------
+_worker_state = None
+
+
+def _init_worker(state):
+    global _worker_state
+    _worker_state = state
+
+
+def _resolve_chunk(args):
+    chunk, seed = args
+    chat_index, weights, default_answers, options = _worker_state
+    return resolve_chats(chat_index, chunk, lambda ids: [weights.get(i, DEFAULT_WEIGHT) for i in ids],
+                         default_answers, rng=random.Random(seed), **options)
+
+
+def resolve_chats_parallel(chat_index, inputs, weights, default_answers, processes, chunk_size,
+                           seed=None, **options):
+    """用进程池分块处理大批量输入；weights 是学习内容 dialog_id -> 权重 的快照"""
+    chunks = [inputs[i:i + chunk_size] for i in range(0, len(inputs), chunk_size)]
+    seeds = [None if seed is None else seed + n for n in range(len(chunks))]
+    state = (chat_index, weights, default_answers, options)
+    with ProcessPoolExecutor(processes, initializer=_init_worker, initargs=(state,)) as pool:
+        results = []
+        for part in pool.map(_resolve_chunk, zip(chunks, seeds)):
+            results.extend(part)
+    return results
@@ -5,25 +5,40 @@ import random
 import json
 import time
 from collections import defaultdict
-from utils.file_helper import load_json, save_json
+from utils.file_helper import load_json
 from core.config import (
     KNOWLEDGE_PATH,
     EXPLORATION_HISTORY_PATH,
     EXPLORATION_CONFIG_PATH,
-    CHAT_HISTORY_PATH  # 添加这个导入
+    USER_INTERESTS_PATH,
 )
+from core.storage.store import get_store
+from core.storage.retention import load_policy, trim_exploration_history
+from core.storage.archive import get_archive
+from core.knowledge.segmenter import get_segmenter
+from utils.id_allocator import new_id
+
+# 缺口分析只看最近这么多条聊天记录
+GAP_ANALYSIS_WINDOW = 500
 
 
 class ExplorationEngine:
-    def __init__(self):
-        # 加载知识库
-        self.knowledge = load_json(KNOWLEDGE_PATH, {})
+    def __init__(self, knowledge=None):
+        # 加载知识库（匹配引擎已加载时直接共用，知识包不再重复解析）
+        self.knowledge = knowledge if knowledge is not None else load_json(KNOWLEDGE_PATH, {})
+
+        # 存储后端
+        self.store = get_store()
 
         # 加载探索历史
         self.exploration_history = self._load_exploration_history()
 
         # 加载设置
         self.settings = self._load_settings()
+        self.retention_policy = load_policy(self.settings)
+        # 探索历史只由探索引擎整体写回，启动时的保留策略裁剪也在这里做（而不是在后台压缩里）
+        if self._trim_history()["records"]:
+            self.store.save_document(EXPLORATION_HISTORY_PATH, self.exploration_history)
 
         # 初始化状态
         self.user_interests = defaultdict(int)  # 用户兴趣模型
@@ -71,7 +86,12 @@ class ExplorationEngine:
             "success_rate": 0.5,
             "last_exploration": None
         }
-        return load_json(EXPLORATION_HISTORY_PATH, default_history)
+        return self.store.load_document(EXPLORATION_HISTORY_PATH, default_history)
+
+    def _trim_history(self):
+        """按保留策略淘汰最旧的探索记录（淘汰的先移入归档），返回回收统计"""
+        archive = get_archive() if self.retention_policy.get("archive_evicted") else None
+        return trim_exploration_history(self.exploration_history, self.retention_policy, archive)
 
     def generate_exploration_question(self, context=""):
         """
@@ -97,9 +117,8 @@ class ExplorationEngine:
             question = self._interest_exploration()
             question_type = "interest_deep"
 
-        # 添加探索标记 - 确保ID唯一
-        import uuid
-        exploration_id = f"exp_{uuid.uuid4().hex[:8]}_{int(time.time() * 1000)}"
+        # 添加探索标记 - 时间有序且唯一
+        exploration_id = new_id("exp")
 
         return {
             "question": question,
@@ -138,15 +157,15 @@ class ExplorationEngine:
 
     def _gap_exploration(self):
         """基于学习缺口的探索"""
-        # 分析聊天历史，找出不熟悉的领域
-        chat_history = load_json(CHAT_HISTORY_PATH, [])
+        # 分析最近的聊天历史，找出不熟悉的领域（只读取最新的分段）
+        recent_chats = self.store.tail_chats(GAP_ANALYSIS_WINDOW)
 
-        if not chat_history:
+        if not recent_chats:
             return self._random_exploration()
 
         # 统计话题出现频率
         topic_freq = defaultdict(int)
-        for chat in chat_history:
+        for chat in recent_chats:
             content = chat.get("user_input", "") + chat.get("pet_reply", "")
             for topic in self.knowledge.get("study", {}).keys():
                 if topic in content:
@@ -201,6 +220,11 @@ class ExplorationEngine:
         }
 
         self.exploration_history.setdefault("explorations", []).append(result)
+        # 按保留策略淘汰最旧的探索记录，历史不会无限增长；超出上限一成后再成批淘汰，
+        # 淘汰的记录一次移入归档，不为每条新记录写一个归档分段（天数/字节预算在启动时裁剪）
+        max_records = self.retention_policy.get("exploration_max_records")
+        if max_records and len(self.exploration_history["explorations"]) > max_records + max(1, max_records // 10):
+            self._trim_history()
 
         # 更新成功率
         explorations = self.exploration_history.get("explorations", [])
@@ -214,7 +238,7 @@ class ExplorationEngine:
         self._update_user_interests(user_response)
 
         # 保存历史
-        save_json(EXPLORATION_HISTORY_PATH, self.exploration_history)
+        self.store.save_document(EXPLORATION_HISTORY_PATH, self.exploration_history)
 
         # 记录发现
         if is_successful and "新知识" in user_response:
@@ -225,7 +249,7 @@ class ExplorationEngine:
 
     def _update_user_interests(self, user_response):
         """更新用户兴趣模型"""
-        # 简单关键词匹配（可升级为NLP模型）
+        # 话题关键词匹配
         for topic in self.knowledge.get("study", {}).keys():
             if topic in user_response:
                 self.user_interests[topic] += 1
@@ -234,8 +258,8 @@ class ExplorationEngine:
         learning_keywords = ["学", "教", "想学", "了解", "知道", "告诉"]
         for keyword in learning_keywords:
             if keyword in user_response:
-                # 提取可能的主题
-                words = user_response.split()
+                # 提取可能的主题（中文没有空格，用词典分词）
+                words = get_segmenter().segment(user_response)
                 for word in words:
                     if len(word) > 1 and not word in learning_keywords:
                         self.user_interests[word] += 0.5
@@ -245,7 +269,7 @@ class ExplorationEngine:
             "interests": dict(self.user_interests),
             "last_updated": time.time()
         }
-        save_json("data/user_interests.json", interests_data)
+        self.store.save_document(USER_INTERESTS_PATH, interests_data)
 
     def get_exploration_stats(self):
         """获取探索统计"""
@@ -0,0 +1,155 @@
+"""
+模糊匹配索引：字符 bigram/trigram 的 TF-IDF 稀疏向量，按余弦相似度给问题打分
+- 倒排表按词项连续存放在 NumPy 数组里（类似CSR），查询时只取输入中出现的词项的倒排段累加
+- 学习新问答时先放进小的增量区直接计算，增量区满了再整体重建
+精确子串匹配失败时作为兜底，处理"早上好呀呀"、"你叫啥名字"这类近似说法
+"""
+import math
+from collections import Counter
+from itertools import chain
+
+import numpy as np
+
+NGRAM_SIZES = (2, 3)
+# 增量区超过这么多条时整体重建倒排表
+REBUILD_EXTRA = 256
+
+
+def char_ngrams(text):
+    """文本的字符n-gram（去掉空白、转小写）；不够最短n-gram长度时用整段文本"""
+    text = "".join(str(text).lower().split())
+    if len(text) < min(NGRAM_SIZES):
+        return [text] if text else []
+    return [text[i:i + n] for n in NGRAM_SIZES for i in range(len(text) - n + 1)]
+
+
+class FuzzyIndex:
+    """字符n-gram TF-IDF 倒排索引"""
+
+    def __init__(self, entries=()):
+        self.texts = []
+        self.payloads = []
+        for text, payload in entries:
+            self.texts.append(text)
+            self.payloads.append(payload)
+        self._build()
+
+    def __len__(self):
+        return len(self.texts)
+
+    def _build(self):
+        """从全部文本重建词表、IDF和倒排表"""
+        doc_grams = [Counter(char_ngrams(text)) for text in self.texts]
+        df = Counter()
+        for counts in doc_grams:
+            df.update(counts.keys())
+        n_docs = len(doc_grams)
+        self.vocab = {gram: i for i, gram in enumerate(df)}
+        self.idf = np.array([math.log((1 + n_docs) / (1 + df[gram])) + 1 for gram in df], dtype=np.float32)
+        self.max_idf = math.log(1 + n_docs) + 1  # 词表外词项的IDF
+
+        postings = [[] for _ in self.vocab]
+        values = [[] for _ in self.vocab]
+        for doc, counts in enumerate(doc_grams):
+            for term, weight in self._vectorize(counts).items():
+                postings[term].append(doc)
+                values[term].append(weight)
+
+        self.indptr = np.zeros(len(self.vocab) + 1, dtype=np.int64)
+        np.cumsum([len(p) for p in postings], out=self.indptr[1:])
+        total = int(self.indptr[-1])
+        self.doc_ids = np.fromiter(chain.from_iterable(postings), dtype=np.int32, count=total)
+        self.values = np.fromiter(chain.from_iterable(values), dtype=np.float32, count=total)
+        self.n_indexed = n_docs
+        self.extra = []  # 建完倒排表后新增的文档：(文档号, {词项: 权重})
+
+    def _vectorize(self, counts):
+        """n-gram计数 -> L2归一化的 {词项: TF-IDF权重}；词表外的词项用字符串作键"""
+        weights = {}
+        for gram, count in counts.items():
+            term = self.vocab.get(gram, gram)
+            idf = self.idf[term] if isinstance(term, int) else self.max_idf
+            weights[term] = (1 + math.log(count)) * float(idf)
+        norm = math.sqrt(sum(w * w for w in weights.values())) or 1.0
+        return {term: w / norm for term, w in weights.items()}
+
+    def add(self, text, payload):
+        """增量加入一条文本"""
+        self.texts.append(text)
+        self.payloads.append(payload)
+        if len(self.texts) - self.n_indexed > REBUILD_EXTRA:
+            self._build()
+        else:
+            self.extra.append((len(self.texts) - 1, self._vectorize(Counter(char_ngrams(text)))))
+
+    def search(self, text, top_k=5, threshold=0.0):
+        """返回相似度不低于threshold的前top_k个 (payload, 分数)，同一payload只保留最高分"""
+        query = self._vectorize(Counter(char_ngrams(text)))
+        if not query:
+            return []
+
+        hits = {}
+        terms = [t for t in query if isinstance(t, int)]
+        if terms and self.n_indexed:
+            starts, ends = self.indptr[terms], self.indptr[np.array(terms) + 1]
+            docs = np.concatenate([self.doc_ids[s:e] for s, e in zip(starts, ends)])
+            weights = np.concatenate([self.values[s:e] * query[t] for t, s, e in zip(terms, starts, ends)])
+            scores = np.bincount(docs, weights=weights, minlength=self.n_indexed)
+            candidates = np.flatnonzero(scores >= max(threshold, 1e-9))
+            if len(candidates) > top_k * 4:
+                # 同一payload可能有多个问题，多取一些再去重
+                candidates = candidates[np.argpartition(scores[candidates], -top_k * 4)[-top_k * 4:]]
+            for doc in candidates:
+                hits[int(doc)] = float(scores[doc])
+        self._score_extra(query, max(threshold, 1e-9), hits)
+        return self._top(hits, top_k)
+
+    def search_many(self, texts, top_k=5, threshold=0.0):
+        """批量查询：所有输入的倒排段一次拼接、一次累加，返回与texts一一对应的结果列表"""
+        floor = max(threshold, 1e-9)
+        queries = [self._vectorize(Counter(char_ngrams(text))) for text in texts]
+        hits = [{} for _ in texts]
+
+        rows, terms, query_weights = [], [], []
+        for row, query in enumerate(queries):
+            for term, weight in query.items():
+                if isinstance(term, int):
+                    rows.append(row)
+                    terms.append(term)
+                    query_weights.append(weight)
+        if terms and self.n_indexed:
+            terms = np.array(terms, dtype=np.int64)
+            starts = self.indptr[terms]
+            lengths = self.indptr[terms + 1] - starts
+            # 把每个 (输入, 词项) 的倒排段展开成一个下标数组
+            offsets = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths) + np.arange(lengths.sum())
+            keys = np.repeat(np.array(rows, dtype=np.int64), lengths) * self.n_indexed + self.doc_ids[offsets]
+            weights = self.values[offsets] * np.repeat(np.array(query_weights, dtype=np.float32), lengths)
+            # (输入, 文档) 组合键去重后累加，得到稀疏的相似度矩阵
+            keys, inverse = np.unique(keys, return_inverse=True)
+            scores = np.bincount(inverse, weights=weights)
+            keep = scores >= floor
+            for key, score in zip(keys[keep].tolist(), scores[keep].tolist()):
+                hits[key // self.n_indexed][key % self.n_indexed] = score
+
+        results = []
+        for query, row_hits in zip(queries, hits):
+            self._score_extra(query, floor, row_hits)
+            results.append(self._top(row_hits, top_k))
+        return results
+
+    def _score_extra(self, query, floor, hits):
+        """给增量区的文档打分"""
+        for doc, vector in self.extra:
+            score = sum(w * vector.get(term, 0.0) for term, w in query.items())
+            if score >= floor:
+                hits[doc] = score
+
+    def _top(self, hits, top_k):
+        """{文档号: 分数} -> 按分数排序的前top_k个 (payload, 分数)，同一payload只保留最高分"""
+        best = {}
+        for doc, score in hits.items():
+            payload = self.payloads[doc]
+            if score > best.get(payload, -1.0):
+                best[payload] = score
+        return sorted(best.items(), key=lambda x: -x[1])[:top_k]
@@ -0,0 +1,69 @@
+"""
+匹配索引缓存：把构建好的知识状态（问题自动机、模糊索引、类别表、回复查找表）序列化到 data 目录
+- 缓存键由源文件的内容摘要（knowledge.json 或知识包、learned.json）、影响构建结果的设置和格式版本组成
+- 启动时键一致直接读取，不用重新解析、重新建索引
+- 只有 learned.json 变了（用户教了新内容）时，启动时把新追加的学习内容直接补进缓存的索引，
+  第一句回复就能用上，缓存在后台重写
+- 其他情况键不一致时仍先用缓存里的旧索引提供服务，同时在后台重建，建好后替换并重写缓存
+"""
+import hashlib
+import os
+import pickle
+
+from core.config import KNOWLEDGE_PATH, LEARNED_PATH, INDEX_CACHE_PATH
+from core.knowledge.knowledge_pack import KnowledgePack
+
+# 缓存格式版本，索引结构变化时+1让旧缓存失效
+CACHE_VERSION = 3
+
+
+def file_digest(path):
+    """文件内容的SHA-1，文件不存在返回None"""
+    sha = hashlib.sha1()
+    try:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                sha.update(chunk)
+    except FileNotFoundError:
+        return None
+    return sha.hexdigest()
+
+
+def source_key(fuzzy=True, pack_path=None, paged=False):
+    """当前源文件对应的缓存键（知识包直接用文件头里记录的源文件摘要，不读整个包）"""
+    knowledge = KnowledgePack.read_digest(pack_path) if pack_path else file_digest(KNOWLEDGE_PATH)
+    return CACHE_VERSION, bool(fuzzy), pack_path or "", bool(paged), knowledge, file_digest(LEARNED_PATH)
+
+
+def same_knowledge(key, other):
+    """两个缓存键是否只有 learned.json 的摘要不同（键的最后一项）"""
+    return key is not None and other is not None and key[:-1] == other[:-1]
+
+
+def load_index_cache(path=INDEX_CACHE_PATH):
+    """读取缓存，返回 (缓存键, 知识状态)；没有缓存或读取失败返回 (None, None)"""
+    try:
+        with open(path, "rb") as f:
+            key, state = pickle.load(f)
+        if not isinstance(key, tuple) or not key or key[0] != CACHE_VERSION:
+            # 索引结构已变，旧缓存即使作为过期索引也不能用
+            return None, None
+        return key, state
+    except FileNotFoundError:
+        return None, None
+    except Exception as e:
+        print(f"读取匹配索引缓存失败，重新构建：{e}")
+        return None, None
+
+
+def save_index_cache(state, key, path=INDEX_CACHE_PATH):
+    """写入缓存（先写临时文件再改名），返回是否成功"""
+    tmp_path = f"{path}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            pickle.dump((key, state), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        return True
+    except Exception as e:
+        print(f"保存匹配索引缓存失败：{e}")
+        return False
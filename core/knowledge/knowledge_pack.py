@@ -0,0 +1,364 @@
+"""
+知识包：把 knowledge.json 编译成一个二进制文件，运行时用 mmap 打开、按需解码
+- 字符串表：全部问题、回答、知识点、类别名去重后连续存放，条目里只存字符串编号
+- 闲聊、学习类别、默认回复都是编号数组 + 偏移数组（类似CSR），取第几条时才解码
+- 预编译的匹配索引：
+  * 闲聊问题的 Aho-Corasick 自动机（边按字符排序，查询时二分），每个节点预先算好
+    沿失配链接能命中的最小条目下标，匹配时扫描一遍输入即可
+  * 知识点权重ID（stu_xxx）的有序表，主动推送/权重清理时二分查找
+  * 词典模式类别（如单词）的词头/释义有序键数组，直接在包上 bisect
+打开知识包只读文件头和目录，启动时间和常驻内存与包的大小无关
+
+编译：python -m core.knowledge.knowledge_pack resources/knowledge.json resources/knowledge.pack
+"""
+import argparse
+import bisect
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from collections.abc import Mapping, Sequence
+
+from core.knowledge.study_dictionary import StudyDictionary, parse_entry
+
+MAGIC = b"PETKPACK"
+VERSION = 1
+# 文件头：魔数、版本、目录项数、源文件摘要
+_HEADER = struct.Struct("<8sII20s")
+# 目录项：段名、类型码、偏移、字节数
+_ENTRY = struct.Struct("<16s1s7xQQ")
+# 段按8字节对齐，数组视图可以直接从 mmap 上 cast
+_ALIGN = 8
+# 自动机里表示"没有命中"的下标
+NO_MATCH = 0xFFFFFFFF
+# 默认按词典模式编译的学习类别
+DEFAULT_DICTIONARY_TYPES = ("单词",)
+
+
+def _weight_key(weight_id):
+    """stu_ + 16位十六进制 -> 64位整数"""
+    return int(weight_id[4:], 16)
+
+
+class _PackWriter:
+    """收集字符串和各个段，最后一次写出"""
+
+    def __init__(self):
+        self.strings = {}
+        self.string_list = []
+        self.sections = []  # (段名, 类型码, 字节)
+
+    def string_id(self, text):
+        text = str(text)
+        sid = self.strings.get(text)
+        if sid is None:
+            sid = self.strings[text] = len(self.string_list)
+            self.string_list.append(text)
+        return sid
+
+    def add(self, name, typecode, values):
+        self.sections.append((name, typecode, array(typecode, values).tobytes()))
+
+    def write(self, path, digest):
+        offsets = array("Q", [0])
+        blob = bytearray()
+        for text in self.string_list:
+            blob += text.encode("utf-8")
+            offsets.append(len(blob))
+        sections = [("str.data", "B", bytes(blob)), ("str.off", "Q", offsets.tobytes())] + self.sections
+
+        position = _HEADER.size + _ENTRY.size * len(sections)
+        directory, chunks = [], []
+        for name, typecode, data in sections:
+            padding = -position % _ALIGN
+            chunks.append(b"\0" * padding + data)
+            position += padding
+            directory.append(_ENTRY.pack(name.encode("ascii"), typecode.encode("ascii"), position, len(data)))
+            position += len(data)
+
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(_HEADER.pack(MAGIC, VERSION, len(sections), digest))
+            for entry in directory:
+                f.write(entry)
+            for chunk in chunks:
+                f.write(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+
+def compile_pack(knowledge, path, dictionary_types=DEFAULT_DICTIONARY_TYPES, digest=None):
+    """把知识库（已解析的dict）编译成知识包，返回各部分的条目数"""
+    from core.knowledge.chat_index import AhoCorasick
+    from core.knowledge.weight_manager import study_weight_id
+
+    writer = _PackWriter()
+    if digest is None:
+        digest = hashlib.sha1(json.dumps(knowledge, ensure_ascii=False, sort_keys=True).encode("utf-8")).digest()
+
+    # 闲聊：问题、回答各一组 CSR
+    chat = knowledge.get("chat", [])
+    automaton = AhoCorasick()
+    q_off, q_ids, a_off, a_ids = [0], [], [0], []
+    for i, item in enumerate(chat):
+        for q in item.get("question", []):
+            q_ids.append(writer.string_id(q))
+            automaton.add(str(q).lower(), i)
+        for a in item.get("answer", []):
+            a_ids.append(writer.string_id(a))
+        q_off.append(len(q_ids))
+        a_off.append(len(a_ids))
+    writer.add("chat.q_off", "I", q_off)
+    writer.add("chat.q", "I", q_ids)
+    writer.add("chat.a_off", "I", a_off)
+    writer.add("chat.a", "I", a_ids)
+
+    # 闲聊问题自动机：边按 (节点, 字符) 排序存放，best 为沿失配链接可命中的最小条目下标
+    automaton.build()
+    edge_off, edge_chr, edge_to, best = [0], [], [], []
+    for node, edges in enumerate(automaton.goto):
+        for ch, child in sorted(edges.items(), key=lambda e: ord(e[0])):
+            edge_chr.append(ord(ch))
+            edge_to.append(child)
+        edge_off.append(len(edge_chr))
+        best.append(min(automaton.out[node], default=NO_MATCH))
+    writer.add("ac.edge_off", "I", edge_off)
+    writer.add("ac.edge_chr", "I", edge_chr)
+    writer.add("ac.edge_to", "I", edge_to)
+    writer.add("ac.fail", "I", automaton.fail)
+    writer.add("ac.best", "I", best)
+
+    # 学习类别：类别名 + 知识点 CSR，以及知识点权重ID有序表
+    study = knowledge.get("study", {})
+    types, study_off, study_ids, weights = [], [0], [], []
+    for study_type, items in study.items():
+        types.append(writer.string_id(study_type))
+        for item in items:
+            weights.append((_weight_key(study_weight_id(study_type, item)), len(study_ids)))
+            study_ids.append(writer.string_id(item))
+        study_off.append(len(study_ids))
+    weights.sort()
+    writer.add("study.types", "I", types)
+    writer.add("study.off", "I", study_off)
+    writer.add("study.items", "I", study_ids)
+    writer.add("wid.keys", "Q", [key for key, _ in weights])
+    writer.add("wid.items", "I", [row for _, row in weights])
+
+    writer.add("default", "I", [writer.string_id(a) for a in knowledge.get("default_answer", [])])
+
+    # 词典模式类别：词头/释义键按字符串排序后存字符串编号
+    dict_types = [t for t in dictionary_types if t in study]
+    writer.add("dict.types", "I", [writer.string_id(t) for t in dict_types])
+    for k, study_type in enumerate(dict_types):
+        dictionary = StudyDictionary(study[study_type])
+        # 词典里的词条下标 -> 类别里的知识点下标（不可解析的知识点不进词典）
+        rows = [i for i, item in enumerate(study[study_type]) if parse_entry(item) is not None]
+        writer.add(f"d{k}.hkey", "I", [writer.string_id(key) for key in dictionary.head_keys])
+        writer.add(f"d{k}.hrow", "I", [rows[row] for row in dictionary.head_rows])
+        writer.add(f"d{k}.gkey", "I", [writer.string_id(key) for key in dictionary.gloss_keys])
+        writer.add(f"d{k}.grow", "I", [rows[row] for row in dictionary.gloss_rows])
+
+    writer.write(path, digest)
+    return {
+        "chat": len(chat),
+        "study": len(study_ids),
+        "strings": len(writer.string_list),
+        "automaton_nodes": len(automaton.goto),
+        "dictionaries": len(dict_types)
+    }
+
+
+class PackStrings(Sequence):
+    """知识包里的一段字符串编号，取第几条时才解码"""
+
+    def __init__(self, pack, section, start=0, stop=None):
+        self.pack = pack
+        self.section = section
+        self.start = start
+        self.stop = len(pack.arrays[section]) if stop is None else stop
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return self.pack.string(self.pack.arrays[self.section][self.start + index])
+
+
+class PackChat(Sequence):
+    """知识包里的闲聊条目，取出时解码成 {"question": [...], "answer": [...]}"""
+
+    def __init__(self, pack):
+        self.pack = pack
+
+    def __len__(self):
+        return len(self.pack.arrays["chat.q_off"]) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        arrays = self.pack.arrays
+        q_off, a_off = arrays["chat.q_off"], arrays["chat.a_off"]
+        return {"question": list(PackStrings(self.pack, "chat.q", q_off[index], q_off[index + 1])),
+                "answer": list(PackStrings(self.pack, "chat.a", a_off[index], a_off[index + 1]))}
+
+
+class PackStudy(Mapping):
+    """知识包里的学习类别：类别名 -> 知识点序列"""
+
+    def __init__(self, pack):
+        self.pack = pack
+        self.positions = {pack.string(sid): k for k, sid in enumerate(pack.arrays["study.types"])}
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __iter__(self):
+        return iter(self.positions)
+
+    def __getitem__(self, study_type):
+        k = self.positions[study_type]
+        study_off = self.pack.arrays["study.off"]
+        return PackStrings(self.pack, "study.items", study_off[k], study_off[k + 1])
+
+    def study_item(self, weight_id):
+        return self.pack.study_item(weight_id)
+
+    def has_weight_id(self, weight_id):
+        return self.pack.has_weight_id(weight_id)
+
+
+class KnowledgePack(Mapping):
+    """只读知识包，对外表现得像 knowledge.json 解析出来的dict（chat / study / default_answer）"""
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        with open(self.path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count, self.digest = _HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            self._mm.close()
+            raise ValueError(f"{self.path} 不是有效的知识包（版本 {version}）")
+        view = memoryview(self._mm)
+        self.arrays = {}
+        for k in range(count):
+            name, typecode, offset, length = _ENTRY.unpack_from(self._mm, _HEADER.size + k * _ENTRY.size)
+            section = view[offset:offset + length]
+            typecode = typecode.decode("ascii")
+            self.arrays[name.rstrip(b"\0").decode("ascii")] = section if typecode == "B" else section.cast(typecode)
+        self.sections = {
+            "chat": PackChat(self),
+            "study": PackStudy(self),
+            "default_answer": PackStrings(self, "default"),
+        }
+
+    @staticmethod
+    def read_digest(path):
+        """只读文件头里记录的源文件摘要（十六进制），不是有效知识包时返回None"""
+        try:
+            with open(path, "rb") as f:
+                magic, version, _, digest = _HEADER.unpack(f.read(_HEADER.size))
+        except (OSError, struct.error):
+            return None
+        return digest.hex() if magic == MAGIC and version == VERSION else None
+
+    def __reduce__(self):
+        # 进程池传参时按路径重新打开，不复制映射的内容
+        return KnowledgePack, (self.path,)
+
+    def __len__(self):
+        return len(self.sections)
+
+    def __iter__(self):
+        return iter(self.sections)
+
+    def __getitem__(self, key):
+        return self.sections[key]
+
+    def string(self, sid):
+        off = self.arrays["str.off"]
+        return bytes(self.arrays["str.data"][off[sid]:off[sid + 1]]).decode("utf-8")
+
+    def first_chat_match(self, text):
+        """用预编译的自动机扫描一遍文本，返回命中的最小闲聊条目下标，没有命中返回None"""
+        arrays = self.arrays
+        edge_off, edge_chr, edge_to = arrays["ac.edge_off"], arrays["ac.edge_chr"], arrays["ac.edge_to"]
+        fail, best_of = arrays["ac.fail"], arrays["ac.best"]
+        node, best = 0, NO_MATCH
+        for ch in text:
+            code = ord(ch)
+            while True:
+                lo, hi = edge_off[node], edge_off[node + 1]
+                i = bisect.bisect_left(edge_chr, code, lo, hi)
+                if i < hi and edge_chr[i] == code:
+                    node = edge_to[i]
+                    break
+                if not node:
+                    break
+                node = fail[node]
+            if best_of[node] < best:
+                best = best_of[node]
+        return None if best == NO_MATCH else best
+
+    def study_item(self, weight_id):
+        """知识点权重ID对应的知识点内容，不在包里返回None"""
+        if not str(weight_id).startswith("stu_"):
+            return None
+        try:
+            key = _weight_key(weight_id)
+        except ValueError:
+            return None
+        keys = self.arrays["wid.keys"]
+        i = bisect.bisect_left(keys, key)
+        if i < len(keys) and keys[i] == key:
+            return self.string(self.arrays["study.items"][self.arrays["wid.items"][i]])
+        return None
+
+    def has_weight_id(self, weight_id):
+        return self.study_item(weight_id) is not None
+
+    def dictionary(self, study_type):
+        """预编译的词典（直接在包上二分），该类别没有编译词典时返回None"""
+        for k, sid in enumerate(self.arrays["dict.types"]):
+            if self.string(sid) == study_type:
+                return StudyDictionary.from_arrays(
+                    self["study"][study_type],
+                    PackStrings(self, f"d{k}.hkey"), self.arrays[f"d{k}.hrow"],
+                    PackStrings(self, f"d{k}.gkey"), self.arrays[f"d{k}.grow"])
+        return None
+
+
+def main(argv=None):
+    """命令行：编译知识包"""
+    parser = argparse.ArgumentParser(description="把知识库JSON编译成二进制知识包")
+    parser.add_argument("source", help="knowledge.json 路径")
+    parser.add_argument("output", help="输出的知识包路径")
+    parser.add_argument("--dictionary", action="append", default=None,
+                        help="按词典模式编译的学习类别，可重复，默认：单词")
+    args = parser.parse_args(argv)
+
+    with open(args.source, "rb") as f:
+        raw = f.read()
+    knowledge = json.loads(raw.decode("utf-8"))
+    dictionary_types = args.dictionary if args.dictionary is not None else DEFAULT_DICTIONARY_TYPES
+    counts = compile_pack(knowledge, args.output, dictionary_types, hashlib.sha1(raw).digest())
+    print(f"✅ 已生成知识包 {args.output}（{os.path.getsize(args.output) / 1024:.1f} KB）：" +
+          "，".join(f"{key} {value}" for key, value in counts.items()))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,153 @@
+"""
+知识状态：一次加载得到的知识库、用户学习内容，以及由它们构建的全部匹配索引
+热重载时在后台线程里完整构建一份新的状态，再一次性替换引用，
+正在进行的匹配要么用旧状态、要么用新状态，不会看到构建到一半的索引
+"""
+import os
+
+from core.config import KNOWLEDGE_PATH, LEARNED_PATH
+from utils.file_helper import load_json
+from core.knowledge.chat_index import ChatIndex, AhoCorasick
+from core.knowledge.weighted_sampler import WeightedSampler
+from core.knowledge.weight_manager import study_weight_id
+from core.knowledge.study_dictionary import StudyDictionary, cache_path_for
+from core.knowledge.knowledge_pack import KnowledgePack
+from core.knowledge.study_pages import load_paged_knowledge, is_lazy_study
+
+
+def load_learned():
+    """读取用户学习内容（兼容文件不存在的情况）"""
+    learned_data = load_json(LEARNED_PATH, {"new_chat": [], "new_study": {}})
+    learned_data.setdefault("new_chat", [])
+    learned_data.setdefault("new_study", {})
+    return learned_data
+
+
+def load_knowledge(pack_path=None, max_pages=0):
+    """读取知识库：配置了知识包时用 mmap 打开；max_pages 大于0时学习类别分页读取，否则整个解析 knowledge.json
+    读不到时抛出 FileNotFoundError"""
+    if pack_path:
+        if not os.path.exists(pack_path):
+            raise FileNotFoundError(f"知识包 {pack_path} 不存在，请先编译或检查设置项 knowledge_pack")
+        return KnowledgePack(pack_path)
+    knowledge = load_paged_knowledge(max_pages) if max_pages else load_json(KNOWLEDGE_PATH)
+    if not knowledge:
+        raise FileNotFoundError(f"知识库文件 {KNOWLEDGE_PATH} 不存在或无法解析，请检查路径")
+    return knowledge
+
+
+class KnowledgeState:
+    """知识库 + 学习内容 + 匹配索引 + 抽样表"""
+
+    # 索引缓存里必须有的字段：新增字段时忘了改 CACHE_VERSION，旧缓存也会被当作读取失败而重建
+    CACHED_FIELDS = ("knowledge", "learned_chat", "learned_study", "packed", "lazy_study",
+                     "chat_index", "study_triggers", "reply_lookup")
+
+    def __init__(self, knowledge, learned_data, fuzzy=True, dictionary_types=()):
+        self.knowledge = knowledge
+        self.learned_chat = learned_data.get("new_chat", [])
+        self.learned_study = learned_data.get("new_study", {})
+        # 知识包按需解码，下面只为学习内容建表，知识库部分直接查包里的预编译索引
+        self.packed = isinstance(knowledge, KnowledgePack)
+        # 学习类别按需读取（分页或知识包）时不为全部知识点建表，按权重ID查询时再定位
+        self.lazy_study = is_lazy_study(knowledge.get("study", {}))
+
+        # 全部闲聊问题编译成一个多模式自动机，匹配时只扫描一遍输入；另建模糊匹配索引兜底
+        self.chat_index = ChatIndex(self.learned_chat, knowledge.get("chat", []), fuzzy,
+                                    knowledge if self.packed else None)
+
+        # 学习触发关键词：知识库和学习内容的类别名编译成一个自动机
+        self.study_triggers = AhoCorasick()
+        for study_type in list(knowledge.get("study", {})) + list(self.learned_study):
+            self.add_study_trigger(study_type)
+
+        # 回复按权重抽样：别名表按问题组/学习类别缓存
+        self.sampler = WeightedSampler()
+
+        # 权重ID -> 回复内容（学习内容、知识点），主动推送时直接查表
+        self.reply_lookup = {item["dialog_id"]: item.get("a", "")
+                             for item in self.learned_chat if item.get("dialog_id")}
+        for study in ((self.learned_study,) if self.lazy_study else (knowledge.get("study", {}), self.learned_study)):
+            for study_type, items in study.items():
+                for item in items:
+                    self.reply_lookup[study_weight_id(study_type, item)] = item
+
+        self.dictionaries = {}
+        self.load_dictionaries(dictionary_types)
+
+    def load_dictionaries(self, dictionary_types):
+        """词典模式的学习类别（如单词）：知识库词表的编译结果缓存在知识文件旁边（或直接用知识包里的）"""
+        self.dictionaries = {}
+        for study_type in dictionary_types:
+            dictionary = self.knowledge.dictionary(study_type) if self.packed else None
+            if dictionary is None:
+                source = self.knowledge.path if self.packed else KNOWLEDGE_PATH
+                dictionary = StudyDictionary.load(self.knowledge.get("study", {}).get(study_type, []),
+                                                  cache_path_for(source, study_type))
+            for item in self.learned_study.get(study_type, []):
+                dictionary.add(item)
+            self.dictionaries[study_type] = dictionary
+
+    def __getstate__(self):
+        # 写入索引缓存时不带抽样表（与权重有关）和词典（有自己的缓存）
+        state = dict(self.__dict__)
+        state["sampler"] = None
+        state["dictionaries"] = {}
+        return state
+
+    def __setstate__(self, state):
+        missing = [name for name in self.CACHED_FIELDS if name not in state]
+        if missing:
+            raise ValueError(f"索引缓存格式不匹配，缺少 {', '.join(missing)}")
+        self.__dict__.update(state)
+        self.sampler = WeightedSampler()
+
+    def extend_learned(self, learned_data):
+        """把 learned.json 里在这份状态之后新追加的学习内容补进索引（缓存写入后用户又教了新内容），
+        返回是否成功；已有内容被改动或删除时不处理并返回False（需要整体重建）"""
+        new_chat = learned_data.get("new_chat", [])
+        new_study = learned_data.get("new_study", {})
+        if new_chat[:len(self.learned_chat)] != self.learned_chat:
+            return False
+        if any(new_study.get(study_type, [])[:len(items)] != items
+               for study_type, items in self.learned_study.items()):
+            return False
+
+        for item in new_chat[len(self.learned_chat):]:
+            self.chat_index.add_learned(item)
+            if item.get("dialog_id"):
+                self.reply_lookup[item["dialog_id"]] = item.get("a", "")
+        for study_type, items in new_study.items():
+            known = self.learned_study.get(study_type)
+            if known is None:
+                self.add_study_trigger(study_type)
+            for item in items[len(known or ()):]:
+                self.reply_lookup[study_weight_id(study_type, item)] = item
+        self.learned_chat = new_chat
+        self.learned_study = new_study
+        return True
+
+    def add_study_trigger(self, study_type):
+        """加入一个学习类别关键词（learn_from_user 新增类别时调用）"""
+        self.study_triggers.add(study_type, study_type)
+
+    def study_trigger(self, text):
+        """扫描一遍文本，返回最早出现的类别名（同一位置开始的取最长），没有返回None"""
+        best = None
+        for end, study_type in self.study_triggers.iter_matches(text):
+            rank = (end - len(study_type), -len(study_type))
+            if best is None or rank < best[0]:
+                best = (rank, study_type)
+        return best[1] if best is not None else None
+
+    def reply_for(self, weight_id):
+        """权重ID对应的学习内容/知识点，查不到返回None"""
+        reply = self.reply_lookup.get(weight_id)
+        if reply is None and self.lazy_study:
+            reply = self.knowledge["study"].study_item(weight_id)
+        return reply
+
+    @classmethod
+    def load(cls, fuzzy=True, dictionary_types=(), pack_path=None, max_pages=0):
+        """从 knowledge.json（或知识包）和 learned.json 加载；知识库读不到时抛出 FileNotFoundError"""
+        return cls(load_knowledge(pack_path, max_pages), load_learned(), fuzzy, dictionary_types)
@@ -0,0 +1,76 @@
+"""
+学习内容去重合并：按规范化后的问题把用户教的问答分组
+- "你几岁"/"你几岁"、"早上好"/"早上好呀"/"早上好哦" 合并成一个问题，带一组回答
+- 每个回答保留自己的 dialog_id（权重也跟着 dialog_id 走）
+- 同一问题下回答完全相同的条目只保留第一条；被合并掉的条目的 dialog_id 记在保留的那条上，
+  对它们的评分（权重）仍然算在这个回答上
+learned.json 的文件格式不变，合并只发生在内存里，匹配时要扫描的模式因此变少
+"""
+
+# 去掉的首尾标点和空白
+_EDGE_PUNCTUATION = " \t\r\n?？!！。.,，、~～…:：;；\"'“”‘’"
+# 去掉的句末语气词（不含会改变意思的"吗"）
+_TRAILING_PARTICLES = "呀啊哦喔呢吧嘛啦"
+# 规范化后的问题至少保留这么多字，避免"早啊"变成"早"后到处误命中
+MIN_CANONICAL_LENGTH = 2
+
+
+def canonical_question(question):
+    """问题的规范形式：小写，去首尾标点空白和句末语气词"""
+    text = str(question).lower().strip(_EDGE_PUNCTUATION)
+    while len(text) > MIN_CANONICAL_LENGTH and text[-1] in _TRAILING_PARTICLES:
+        text = text[:-1].rstrip(_EDGE_PUNCTUATION)
+    return text
+
+
+class LearnedGroups:
+    """规范问题 -> 回答列表（每个回答是原始的学习条目）"""
+
+    def __init__(self, learned_chat=()):
+        self.questions = []  # 按首次出现顺序的规范问题
+        self.positions = {}  # 规范问题 -> 组下标
+        self.answers = {}  # 规范问题 -> [学习条目]
+        self.merged = 0  # 合并掉的重复条目数
+        self.duplicates = {}  # 保留条目的dialog_id -> [合并掉的重复条目的dialog_id]
+        for item in learned_chat:
+            self.add(item)
+
+    def __len__(self):
+        return len(self.questions)
+
+    def find(self, question, answer):
+        """查找同一问题下回答相同的条目，没有返回None"""
+        return self._find(canonical_question(question), answer)
+
+    def _find(self, canonical, answer):
+        for item in self.answers.get(canonical, []):
+            if item.get("a") == answer:
+                return item
+        return None
+
+    def add(self, item):
+        """加入一条学习条目，返回 (组下标, 是否新增)；回答重复时不新增"""
+        canonical = canonical_question(item.get("q", ""))
+        index = self.positions.get(canonical)
+        if index is None:
+            index = self.positions[canonical] = len(self.questions)
+            self.questions.append(canonical)
+            self.answers[canonical] = []
+        kept = self._find(canonical, item.get("a"))
+        if kept is not None:
+            self.merged += 1
+            kept_id, dialog_id = kept.get("dialog_id"), item.get("dialog_id")
+            if kept_id and dialog_id and dialog_id != kept_id:
+                self.duplicates.setdefault(kept_id, []).append(dialog_id)
+            return index, False
+        self.answers[canonical].append(item)
+        return index, True
+
+    def group(self, index):
+        """第index组的回答列表"""
+        return self.answers[self.questions[index]]
+
+    def weight_ids(self, item):
+        """回答的权重ID：它自己的dialog_id，加上合并进来的重复条目的dialog_id"""
+        dialog_id = item.get("dialog_id")
+        return [dialog_id] + self.duplicates.get(dialog_id, []) if dialog_id else []
@@ -1,12 +1,22 @@
-import random
 import os
-from core.config import (
-    KNOWLEDGE_PATH,
-    CHAT_HISTORY_PATH,
-    DIALOG_WEIGHTS_PATH,  # 添加这个导入
-)
+import random
+import threading
+from core.config import RESOURCES_DIR, KNOWLEDGE_PATH, LEARNED_PATH, load_settings
 from utils.file_helper import load_json, save_json, generate_dialog_id
-from core.knowledge.weight_manager import WeightManager
+from utils.file_watcher import FileWatcher
+from core.knowledge.weight_manager import WeightManager, study_weight_id
+from core.knowledge.chat_index import ChatIndex
+from core.knowledge.chat_resolver import (
+    collect_candidates, fill_weights, choose_reply, resolve_chats, resolve_chats_parallel, chat_group_key
+)
+from core.knowledge.knowledge_state import KnowledgeState, load_learned
+from core.knowledge.index_cache import source_key, load_index_cache, save_index_cache, same_knowledge
+from core.knowledge.study_pages import category_sizes, category_size
+from core.knowledge.response_cache import ResponseCache
+from core.knowledge.learned_groups import canonical_question
+from core.knowledge.segmenter import get_segmenter, build_vocabulary, fragments
+from core.storage.store import get_store
+from core.storage.journal import get_journal
 
 
 class LocalKnowledgeMatcher:
@@ -15,27 +25,175 @@ class LocalKnowledgeMatcher:
         from utils.file_helper import init_data_dir
         init_data_dir()
 
-        # 加载知识库
-        self.knowledge = load_json(KNOWLEDGE_PATH)
-        if not self.knowledge:
-            raise FileNotFoundError(f"知识库文件 {KNOWLEDGE_PATH} 不存在，请检查路径")
+        settings = load_settings()
+        self.fuzzy_enabled = settings.get("fuzzy_match", True)
+        self.fuzzy_threshold = settings.get("fuzzy_threshold", 0.35)
+        self.fuzzy_top_k = settings.get("fuzzy_top_k", 5)
+        self.dictionary_types = list(settings.get("dictionary_types", ["单词"]))
+        self.dictionary_max_results = settings.get("dictionary_max_results", 10)
+        pack = settings.get("knowledge_pack", "")
+        self.knowledge_pack = os.path.join(RESOURCES_DIR, pack) if pack else None
+        self.study_page_cache = settings.get("study_page_cache", 8)
+
+        # 存储后端（聊天记录、权重等按记录读写）；第一次获取时重放上次崩溃遗留的变更日志，
+        # 须在读取 learned.json 之前，恢复出来的学习内容才会进入索引
+        self.store = get_store()
+
+        # 加载知识库和用户学习内容，并构建匹配索引（热重载时整体替换 self.state）
+        # 索引缓存有效时直接读取；过期时先用旧索引，初始化完成后在后台重建
+        self.index_cache = settings.get("index_cache", True)
+        self.state, index_stale = self._load_state()
 
         # 初始化权重管理器
         self.weight_manager = WeightManager()
 
-        # 拆分用户学习内容（兼容文件不存在的情况，修复闪退核心）
-        learned_json_path = os.path.join(os.path.dirname(KNOWLEDGE_PATH), "learned.json")
-        self.learned_chat = load_json(learned_json_path, {"new_chat": [], "new_study": {}}).get("new_chat", [])
-        self.learned_study = load_json(learned_json_path, {"new_chat": [], "new_study": {}}).get("new_study", {})
+        # 回复按权重抽样，评分改变权重时只让相关的别名表失效
+        self.rng = random
+        self.weight_manager.weight_listeners.append(self._on_weight_change)
+
+        # 回复候选缓存：学习代数在 learn_from_user 中+1，权重代数由 WeightManager 维护
+        self.learn_generation = 0
+        cache_size = settings.get("response_cache_size", 512)
+        self.response_cache = ResponseCache(cache_size) if cache_size else None
+
+        # 分词器（记忆检索、兴趣统计共用），词表随知识库和学习内容更新
+        self.segmenter = get_segmenter(self._vocabulary(self.state))
 
         from core.knowledge.exploration_engine import ExplorationEngine
         from core.memory.memory_network import MemoryNetwork
         from core.knowledge.learning_strategy import LearningStrategy
 
-        self.exploration_engine = ExplorationEngine()
+        self.exploration_engine = ExplorationEngine(self.knowledge)
         self.memory_network = MemoryNetwork()
         self.learning_strategy = LearningStrategy()
 
+        # 轮询 knowledge.json / learned.json 的修改时间，变化时在后台重建索引并替换
+        self._reload_lock = threading.Lock()
+        self._reloading = False
+        self.knowledge_watcher = FileWatcher([self.knowledge_pack or KNOWLEDGE_PATH, LEARNED_PATH],
+                                             self._on_knowledge_files_changed,
+                                             settings.get("knowledge_reload_interval", 2.0))
+        self.knowledge_watcher.start()
+        if index_stale:
+            threading.Thread(target=self.reload_knowledge, name="index-rebuild", daemon=True).start()
+
+        # 冷数据归档和保留策略压缩在后台线程执行，历史再大也不拖慢窗口出现
+        self.maintenance_thread = threading.Thread(target=self._maintain_storage, name="storage-maintenance",
+                                                   daemon=True)
+        self.maintenance_thread.start()
+
+    # ---------- 知识状态（热重载时整体替换） ----------
+    @property
+    def knowledge(self):
+        return self.state.knowledge
+
+    @property
+    def learned_chat(self):
+        return self.state.learned_chat
+
+    @learned_chat.setter
+    def learned_chat(self, value):
+        self.state.learned_chat = value
+
+    @property
+    def learned_study(self):
+        return self.state.learned_study
+
+    @learned_study.setter
+    def learned_study(self, value):
+        self.state.learned_study = value
+
+    @property
+    def chat_index(self):
+        return self.state.chat_index
+
+    @chat_index.setter
+    def chat_index(self, value):
+        self.state.chat_index = value
+
+    @property
+    def sampler(self):
+        return self.state.sampler
+
+    @property
+    def reply_lookup(self):
+        return self.state.reply_lookup
+
+    @property
+    def dictionaries(self):
+        return self.state.dictionaries
+
+    @staticmethod
+    def _vocabulary(state):
+        return build_vocabulary(state.knowledge, state.learned_chat, state.learned_study,
+                                expand_study=not state.lazy_study, expand_chat=not state.packed)
+
+    def _on_weight_change(self, weight_id):
+        self.state.sampler.invalidate_weight(weight_id)
+
+    def _maintain_storage(self):
+        """后台：把超过保留期的旧数据移入压缩归档，再按保留策略淘汰超出上限的数据、清理孤立权重
+        探索历史由探索引擎自己裁剪（它持有这份文档并整体写回）"""
+        from core.storage.archive import archive_cold_data
+        from core.storage.retention import compact_data, RetentionManager
+        archive_cold_data(self.store)
+        compact_data(self.store, knowledge=self.knowledge,
+                     steps=[step for step in RetentionManager.STEPS if step != "explorations"])
+
+    def _on_knowledge_files_changed(self, paths):
+        """文件监视线程回调：在当前（后台）线程重新加载"""
+        print(f"检测到知识文件变化，重新加载：{paths}")
+        self.reload_knowledge()
+
+    def _load_state(self):
+        """启动时加载知识状态，返回 (状态, 是否需要后台重建)"""
+        key = None
+        if self.index_cache:
+            key = source_key(self.fuzzy_enabled, self.knowledge_pack, self.study_page_cache > 0)
+            cached_key, state = load_index_cache()
+            if state is not None:
+                if cached_key == key:
+                    state.load_dictionaries(self.dictionary_types)
+                    return state, False
+                if same_knowledge(cached_key, key) and state.extend_learned(load_learned()):
+                    # 只是教了新内容：新内容已补进索引，后台重建只为重写缓存
+                    state.load_dictionaries(self.dictionary_types)
+                    return state, True
+                print("知识文件已变化，先使用缓存的旧索引，后台重建")
+                state.load_dictionaries(self.dictionary_types)
+                return state, True
+        state = KnowledgeState.load(self.fuzzy_enabled, self.dictionary_types, self.knowledge_pack,
+                                    self.study_page_cache)
+        if key is not None:
+            save_index_cache(state, key)
+        return state, False
+
+    def reload_knowledge(self):
+        """重新读取知识库和学习内容，构建好全部索引后一次性替换，返回是否成功"""
+        with self._reload_lock:
+            self._reloading = True
+            try:
+                # 缓存键在读取前计算：读取过程中文件又变了时，下次启动会因键不一致而重建
+                key = source_key(self.fuzzy_enabled, self.knowledge_pack, self.study_page_cache > 0) if self.index_cache else None
+                state = KnowledgeState.load(self.fuzzy_enabled, self.dictionary_types, self.knowledge_pack,
+                                            self.study_page_cache)
+                if key is not None:
+                    # 新状态还没有对外可见，序列化时不会被学习等操作修改
+                    save_index_cache(state, key)
+            except Exception as e:
+                # 文件写到一半、格式错误等情况保留旧状态，等下一次修改
+                print(f"重新加载知识库失败，继续使用旧版本：{e}")
+                return False
+            finally:
+                self._reloading = False
+            self.state = state
+            self.exploration_engine.knowledge = state.knowledge
+            # 新教的问题、知识点按新词表分词
+            self.segmenter = get_segmenter(self._vocabulary(state))
+            self.learn_generation += 1
+            print("✅ 知识库已重新加载")
+            return True
+
     def initiate_exploration(self, context=""):
         """发起自主探索"""
         # 1. 决定是否探索（基于探索概率）
@@ -123,90 +281,123 @@ class LocalKnowledgeMatcher:
     def get_active_content(self):
         """获取主动推送的内容（基于权重）"""
         try:
-            # 1. 加载权重数据
-            dialog_weights = load_json(DIALOG_WEIGHTS_PATH, {})
+            # 1. 在高权重内容（权重 > 1.0）中按权重成比例抽一个（求和树，O(log n)）
+            selected_id = self.weight_manager.sample_review(self.rng)
 
-            # 2. 筛选高权重内容（权重 > 1.0）
-            high_weight_items = [k for k, v in dialog_weights.items() if v > 1.0]
-
-            if not high_weight_items:
+            if selected_id is None:
                 # 如果没有高权重内容，使用默认学习内容
                 return self._get_default_study_content()
 
-            # 3. 随机选择一个高权重对话ID
-            selected_id = random.choice(high_weight_items)
-
-            # 4. 从聊天记录中获取对应的内容
-            chat_history = load_json(CHAT_HISTORY_PATH, [])
-            for item in chat_history:
-                if item.get("dialog_id") == selected_id:
-                    return f"复习一下：{item.get('pet_reply', '学习内容')}"
+            # 2. 直接查出对应的内容（学习内容/知识点查表，聊天记录走dialog_id索引）
+            reply = self._reply_for(selected_id)
+            if reply:
+                return f"复习一下：{reply}"
 
             return self._get_default_study_content()
         except Exception as e:
             print(f"获取主动推送内容异常：{e}")
             return "今天也要好好学习哦！"
 
+    def _reply_for(self, weight_id):
+        """权重ID对应的回复内容，查不到返回None"""
+        reply = self.state.reply_for(weight_id)
+        if reply:
+            return reply
+        item = self.store.get_chat(weight_id)
+        return item.get("pet_reply", "学习内容") if item else None
+
     def _get_default_study_content(self):
         """获取默认学习内容"""
-        all_study = []
-        # 原始学习内容
-        for key, items in self.knowledge.get("study", {}).items():
-            all_study.extend(items)
-        # 用户新增的学习内容
-        for key, items in self.learned_study.items():
-            all_study.extend(items)
-
-        if all_study:
-            return random.choice(all_study)
+        # 原始学习内容 + 用户新增的学习内容：按预先算好的各类别条数抽一个下标，只读入抽中的那一类
+        sizes = [(study, study_type, size)
+                 for study in (self.knowledge.get("study", {}), self.learned_study)
+                 for study_type, size in category_sizes(study).items()]
+        total = sum(size for _, _, size in sizes)
+        if total:
+            index = self.rng.randrange(total)
+            for study, study_type, size in sizes:
+                if index < size:
+                    return study[study_type][index]
+                index -= size
         return "记得跟我聊天学习哦～"
 
     def match_chat(self, user_input):
         user_input = user_input.strip().lower()
-        reply = ""
         dialog_id = generate_dialog_id()
-        related_dialog_id = ""  # 用于关联学习内容的dialog_id
-
-        # 1. 优先匹配用户教的闲聊（按权重筛选）
-        matched_chat = []
-        for item in self.learned_chat:
-            if item.get("q", "").lower() in user_input:
-                # 获取该学习内容的dialog_id（必须存在）
-                chat_dialog_id = item.get("dialog_id", "")
-                if not chat_dialog_id:
-                    continue  # 没有dialog_id的内容跳过
-                # 获取该内容的权重
-                weight = self.weight_manager.get_dialog_weight(chat_dialog_id)
-                matched_chat.append((item["a"], weight, chat_dialog_id))
-
-        if matched_chat:
-            # 过滤低权重内容（权重<0.5的直接排除）
-            valid_chat = [x for x in matched_chat if x[1] > 0.5]
-            if valid_chat:
-                # 从高权重里随机选
-                selected = random.choice(valid_chat)
-                reply = selected[0]
-                related_dialog_id = selected[2]  # 绑定学习内容的dialog_id
-            else:
-                # 所有匹配的都是低权重，返回默认回复
-                reply = random.choice(self.knowledge.get("default_answer", ["我还在学习中～"]))
-            # 保存聊天记录（关联学习内容的dialog_id）
-            self._save_chat_record(dialog_id, user_input, reply, related_dialog_id)
-            return reply, dialog_id
 
-        # 2. 匹配原始知识库（逻辑不变）
-        for item in self.knowledge.get("chat", []):
-            for q in item.get("question", []):
-                if q.lower() in user_input:
-                    reply = random.choice(item.get("answer", []))
-                    self._save_chat_record(dialog_id, user_input, reply)
-                    return reply, dialog_id
-
-        # 3. 无匹配返回默认回复
-        reply = random.choice(self.knowledge.get("default_answer", ["我还在学习中～"]))
-        self._save_chat_record(dialog_id, user_input, reply)
+        # 匹配顺序：1. 用户教的闲聊（按权重筛选） 2. 原始知识库 3. 模糊匹配兜底 4. 默认回复
+        candidates = self._chat_candidates(user_input)
+        reply, related_dialog_id, _, _ = choose_reply(candidates, self._default_answers(), self.rng, self.sampler)
+
+        # 保存聊天记录（命中学习内容时关联它的dialog_id）
+        self._save_chat_record(dialog_id, user_input, reply, related_dialog_id)
         return reply, dialog_id
 
+    def segment(self, text):
+        """把一句话切成词（与记忆检索、兴趣统计用同一个分词器）"""
+        return self.segmenter.segment(text)
+
+    def segment_many(self, texts):
+        """批量分词，返回与texts一一对应的词列表"""
+        return self.segmenter.segment_many(texts)
+
+    def _chat_candidates(self, user_input):
+        """规范化输入的候选列表（先查缓存；命中时按当前权重刷新，评分不用让缓存失效）"""
+        if self.response_cache is None:
+            return self._collect_candidates(user_input)
+        candidates = self.response_cache.get(user_input, self.learn_generation)
+        if candidates is None:
+            candidates = self._collect_candidates(user_input)
+            self.response_cache.put(user_input, self.learn_generation, candidates)
+        else:
+            fill_weights([candidates], self.weight_manager.get_dialog_weights)
+        return candidates
+
+    def _collect_candidates(self, user_input):
+        return collect_candidates(self.chat_index, [user_input], self.weight_manager.get_dialog_weights,
+                                  self.fuzzy_enabled, self.fuzzy_top_k, self.fuzzy_threshold)[0]
+
+    def get_response_cache_stats(self):
+        """回复候选缓存的命中率等统计"""
+        return self.response_cache.stats() if self.response_cache is not None else {}
+
+    def match_chat_many(self, inputs, processes=None, chunk_size=5000, seed=None):
+        """批量匹配（离线评估、回放用）：不写聊天记录、不改权重
+        返回与inputs一一对应的 {"input", "reply", "related_dialog_id", "source", "score", "candidates"}
+        processes 大于0且输入超过一块时用进程池分块并行；seed 固定随机选择，便于对比"""
+        inputs = [str(text).strip().lower() for text in inputs]
+        if processes and len(inputs) > chunk_size:
+            weights = {weight_id: self.weight_manager.get_dialog_weight(weight_id)
+                       for item in self.chat_index.learned for weight_id in self.chat_index.weight_ids(item)}
+            return resolve_chats_parallel(
+                self.chat_index, inputs, weights, self._default_answers(), processes, chunk_size, seed,
+                fuzzy=self.fuzzy_enabled, top_k=self.fuzzy_top_k, threshold=self.fuzzy_threshold
+            )
+        return self._resolve_chats(inputs, random.Random(seed) if seed is not None else random)
+
+    def set_seed(self, seed=None):
+        """固定随机选择（测试用）；seed为None时恢复成全局随机"""
+        self.rng = random.Random(seed) if seed is not None else random
+
+    def _resolve_chats(self, inputs, rng=None):
+        return resolve_chats(
+            self.chat_index, inputs, self.weight_manager.get_dialog_weights, self._default_answers(),
+            fuzzy=self.fuzzy_enabled, top_k=self.fuzzy_top_k, threshold=self.fuzzy_threshold,
+            rng=rng or self.rng, sampler=self.sampler
+        )
+
+    def _default_answers(self):
+        return self.knowledge.get("default_answer", ["我还在学习中～"])
+
+    def fuzzy_match(self, user_input, top_k=None, threshold=None):
+        """模糊匹配闲聊问题，返回按相似度排序的候选 [{"source", "item", "score"}]"""
+        if not self.fuzzy_enabled:
+            return []
+        top_k = self.fuzzy_top_k if top_k is None else top_k
+        threshold = self.fuzzy_threshold if threshold is None else threshold
+        return [{"source": source, "item": item, "score": score}
+                for source, item, score in self.chat_index.fuzzy_match(user_input.strip().lower(), top_k, threshold)]
+
     def match_study(self, study_type):
         """匹配学习内容"""
         try:
@@ -214,20 +405,18 @@ class LocalKnowledgeMatcher:
             dialog_id = generate_dialog_id()
 
             # 1. 优先匹配用户教的学习内容
-            if study_type in self.learned_study:
-                user_study_items = self.learned_study[study_type]
-                if user_study_items:
-                    reply = random.choice(user_study_items)
-                    self._save_chat_record(dialog_id, study_type, reply)
-                    return reply, dialog_id
-
-            # 2. 匹配原始知识库
-            if study_type in self.knowledge.get("study", {}):
-                knowledge_items = self.knowledge["study"][study_type]
-                if knowledge_items:
-                    reply = random.choice(knowledge_items)
-                    self._save_chat_record(dialog_id, study_type, reply)
-                    return reply, dialog_id
+            if category_size(self.learned_study, study_type):
+                reply = self._choose_study(("study", study_type, "learned"), self.learned_study, study_type)
+                # 关联知识点的权重ID，对这条回复的评分会作用到知识点上
+                self._save_chat_record(dialog_id, study_type, reply, study_weight_id(study_type, reply))
+                return reply, dialog_id
+
+            # 2. 匹配原始知识库（分页时只读入抽中的那一页）
+            knowledge_study = self.knowledge.get("study", {})
+            if category_size(knowledge_study, study_type):
+                reply = self._choose_study(("study", study_type, "knowledge"), knowledge_study, study_type)
+                self._save_chat_record(dialog_id, study_type, reply, study_weight_id(study_type, reply))
+                return reply, dialog_id
 
             # 3. 无匹配返回默认回复
             reply = "这个我还不太会，教教我吧～"
@@ -241,9 +430,50 @@ class LocalKnowledgeMatcher:
             self._save_chat_record(dialog_id, study_type, reply)
             return reply, dialog_id
 
+    def get_lookup_query(self, user_input):
+        """检测词典查询（"查 app"），返回要查的词，不是查询时返回None"""
+        user_input = user_input.strip()
+        if user_input.startswith("查") and self.dictionaries:
+            query = user_input[1:].strip()
+            return query or None
+        return None
+
+    def lookup_study(self, query, study_type=None, limit=None):
+        """在词典模式的学习类别里查词：先精确命中，再补前缀命中"""
+        dialog_id = generate_dialog_id()
+        limit = self.dictionary_max_results if limit is None else limit
+        study_types = [study_type] if study_type else list(self.dictionaries)
+        found = []
+        for stype in study_types:
+            dictionary = self.dictionaries.get(stype)
+            if dictionary is not None:
+                found.extend((stype, entry) for entry in dictionary.lookup(query, limit - len(found)))
+            if len(found) >= limit:
+                break
+
+        if not found:
+            reply = f"词典里没有找到【{query}】，可以教我：加 单词 {query} - 释义"
+            self._save_chat_record(dialog_id, query, reply)
+            return reply, dialog_id
+
+        reply = "\n".join(entry for _, entry in found)
+        # 只有一条结果时关联这个知识点的权重ID，评分会作用到它上面
+        related = study_weight_id(*found[0]) if len(found) == 1 else ""
+        self._save_chat_record(dialog_id, query, reply, related)
+        return reply, dialog_id
+
+    def _choose_study(self, key, study, study_type):
+        """按知识点权重抽一条学习内容：别名表和知识点权重ID列表按类别缓存，表有效时抽样是O(1)
+        表里只有下标，抽中后再从 study（分页时经过页缓存）取这一条"""
+        index = self.sampler.sample_cached(
+            key, lambda: study[study_type], lambda items: [study_weight_id(study_type, item) for item in items],
+            self.weight_manager.get_dialog_weights, self.rng
+        )
+        return study[study_type][index]
+
     def learn_from_user(self, user_input):
         user_input = user_input.strip()
-        learned_json_path = os.path.join(os.path.dirname(KNOWLEDGE_PATH), "learned.json")
+        learned_json_path = LEARNED_PATH
         # 加载learned.json（确保new_chat和new_study存在）
         learned_data = load_json(learned_json_path, {"new_chat": [], "new_study": {}})
 
@@ -253,15 +483,33 @@ class LocalKnowledgeMatcher:
             q = q_part.replace("问", "").strip()
             a = a_part.replace("答", "").strip()
             if q and a:
+                # 同一问题（规范化后）已经有相同回答时合并掉，不再重复记录
+                if self.chat_index.has_learned(q, a):
+                    return f"这个我已经会啦！问我【{q}】，我会回答【{a}】"
+
                 # 强制生成唯一dialog_id，绑定到这个学习内容
                 new_dialog_id = generate_dialog_id()
-                learned_data["new_chat"].append({
+                new_item = {
                     "q": q,
                     "a": a,
                     "dialog_id": new_dialog_id  # 必须绑定dialog_id
-                })
+                }
+                get_journal().record("learned_add", {"kind": "chat", "item": new_item})
+                learned_data["new_chat"].append(new_item)
                 save_json(learned_json_path, learned_data)
+                self._acknowledge_learned()
                 self.learned_chat = learned_data["new_chat"]
+                self.learn_generation += 1
+                self.reply_lookup[new_dialog_id] = a
+                if len(self.learned_chat) == self.chat_index.source_count + 1:
+                    self.chat_index.add_learned(new_item)
+                    self.sampler.invalidate(chat_group_key(new_item))
+                else:
+                    # learned.json 被外部改动过，整体重建索引（知识包照样传进去，原始闲聊仍从包里匹配）
+                    self.chat_index = ChatIndex(self.learned_chat, self.knowledge.get("chat", []),
+                                                self.fuzzy_enabled, self.knowledge if self.state.packed else None)
+                    self.sampler.clear()
+                self.segmenter.add_words([canonical_question(q)])
                 return f"我记住啦！下次问我【{q}】，我就会回答【{a}】"
 
         # 加知识点：逻辑不变
@@ -269,23 +517,34 @@ class LocalKnowledgeMatcher:
             parts = user_input.replace("加", "").strip().split(" ", 1)
             if len(parts) == 2:
                 stype, scontent = parts
-                if stype not in learned_data["new_study"]:
+                new_type = stype not in learned_data["new_study"]
+                if new_type:
                     learned_data["new_study"][stype] = []
+                get_journal().record("learned_add", {"kind": "study", "type": stype, "content": scontent})
                 learned_data["new_study"][stype].append(scontent)
                 save_json(learned_json_path, learned_data)
+                self._acknowledge_learned()
                 self.learned_study = learned_data["new_study"]
+                if new_type:
+                    self.state.add_study_trigger(stype)
+                self.reply_lookup[study_weight_id(stype, scontent)] = scontent
+                self.sampler.invalidate(("study", stype, "learned"))
+                if stype in self.dictionaries:
+                    self.dictionaries[stype].add(scontent)
+                self.segmenter.add_words([stype] + fragments(scontent))
                 return f"新增【{stype}】知识点：{scontent}，我记住啦！"
 
         return "请用正确格式教我哦～\n1. 问 你叫什么 -> 答 我叫小桌\n2. 加 单词 pear - 梨"
 
+    def _acknowledge_learned(self):
+        """自己写入的 learned.json 不触发热重载（重载进行中时不确认，由下一轮轮询补上）"""
+        if not self._reloading:
+            self.knowledge_watcher.acknowledge(LEARNED_PATH)
+
     def get_study_trigger(self, user_input):
-        """检测学习触发关键词"""
+        """检测学习触发关键词：类别名编译成一个自动机，一遍扫描取最早出现（同位置取最长）的类别"""
         try:
-            all_types = list(self.knowledge.get("study", {}).keys()) + list(self.learned_study.keys())
-            for t in all_types:
-                if t in user_input:
-                    return t
-            return None
+            return self.state.study_trigger(user_input)
         except Exception as e:
             print(f"检测学习关键词异常：{e}")
             return None
@@ -294,8 +553,8 @@ class LocalKnowledgeMatcher:
     def _save_chat_record(self, dialog_id, user_input, pet_reply, related_dialog_id=""):
         import time
         from core.config import DEFAULT_WEIGHT  # 直接从config导入
-        chat_history = load_json(CHAT_HISTORY_PATH, [])
-        chat_history.append({
+        # 只追加一行，不再读出并重写整个历史文件
+        self.store.append_chat({
             "dialog_id": dialog_id,
             "user_input": user_input,
             "pet_reply": pet_reply,
@@ -304,4 +563,4 @@ class LocalKnowledgeMatcher:
             "rating": None,
             "weight": DEFAULT_WEIGHT  # 使用从config导入的常量
         })
-        save_json(CHAT_HISTORY_PATH, chat_history)
+        self.weight_manager.register_dialog(dialog_id, related_dialog_id)
@@ -0,0 +1,82 @@
+"""
+回复候选缓存：规范化输入 -> 已解析好的候选列表（含权重），按最久未使用淘汰
+- 用户一天里反复说"早上好"、"你好"，命中缓存就不用再扫描问题索引、查权重
+- 没有任何匹配（只能回默认回复）的输入单独放在负缓存里
+- 失效靠学习代数：学习新内容、重新加载知识库时+1；
+  条目记录写入时的代数，取出时代数对不上就当作未命中
+- 权重不参与失效：命中后由调用方按当前权重表重新填候选的权重（fill_weights），
+  一次评分只影响它自己那个问题组，不会让其他缓存条目失效
+"""
+import threading
+from collections import OrderedDict
+
+
+class ResponseCache:
+    """带负缓存和代数失效的LRU缓存"""
+
+    def __init__(self, max_entries=512, max_negative=256):
+        self.max_entries = max_entries
+        self.max_negative = max_negative
+        self._entries = OrderedDict()  # 输入 -> (学习代数, 候选)
+        self._negative = OrderedDict()  # 输入 -> 学习代数
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.stale = 0
+
+    def get(self, key, generation):
+        """命中返回候选，未命中返回None；generation 为学习代数"""
+        with self._lock:
+            learn_generation = self._negative.get(key)
+            if learn_generation is not None:
+                if learn_generation == generation:
+                    self._negative.move_to_end(key)
+                    self.negative_hits += 1
+                    return {"match": "none", "candidates": []}
+                del self._negative[key]
+                self.stale += 1
+
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] == generation:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._entries[key]
+                self.stale += 1
+            self.misses += 1
+            return None
+
+    def put(self, key, generation, candidates):
+        """写入缓存；没有任何匹配的输入进负缓存"""
+        with self._lock:
+            if candidates["match"] == "none":
+                self._negative[key] = generation
+                self._negative.move_to_end(key)
+                while len(self._negative) > self.max_negative:
+                    self._negative.popitem(last=False)
+            else:
+                self._entries[key] = (generation, candidates)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._negative.clear()
+
+    def stats(self):
+        """缓存统计：命中（含负缓存命中）/未命中次数、命中率、因代数过期丢弃的条目数"""
+        total = self.hits + self.negative_hits + self.misses
+        return {
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "stale": self.stale,
+            "hit_rate": (self.hits + self.negative_hits) / total if total else 0.0,
+            "entries": len(self._entries),
+            "negative_entries": len(self._negative),
+            "max_entries": self.max_entries
+        }
@@ -0,0 +1,226 @@
+"""
+中文分词：基于词典的双向最大匹配
+- 词典编译成前缀树（正向、反向各一棵），所有节点的边放在一个扁平字典里，不为每个节点建对象
+- 正向、反向各切一遍，取词数少的；词数相同取单字少的；再相同取反向结果
+- 词典由内置常用词、知识库话题、闲聊问题和用户学习的问题组成，学习新内容时增量加词
+- 最近切过的输入放在LRU缓存里，用户反复说的话不用再切
+匹配引擎、记忆检索、探索兴趣统计共用同一个分词器（get_segmenter）
+"""
+import re
+import threading
+from collections import OrderedDict
+
+from core.config import KNOWLEDGE_PATH, LEARNED_PATH, load_settings
+from utils.file_helper import load_json
+from core.knowledge.learned_groups import canonical_question
+
+# 内置常用词（学习相关的动词、常见科目等），保证词典为空时也能切出基本的词
+BASE_WORDS = (
+    "学习", "想学", "了解", "知道", "告诉", "教教", "什么", "怎么", "为什么", "怎么样",
+    "今天", "明天", "昨天", "喜欢", "讨厌", "知识", "问题", "题目", "作业", "考试",
+    "单词", "英语", "数学", "语文", "诗词", "古诗", "历史", "地理", "物理", "化学",
+    "生物", "科学", "音乐", "画画", "运动", "游戏", "故事", "电影", "朋友", "老师",
+)
+# 词典里的词最长这么多字（更长的问题、诗句只取其中的短片段）
+MAX_WORD_LENGTH = 8
+
+# 连续的汉字走词典切分，连续的字母数字作为一个词，其余字符当作分隔符
+_RUN = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff]+|[0-9a-z]+")
+_HAN = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff]")
+
+
+def fragments(text):
+    """文本里连续的汉字片段和字母数字片段"""
+    return _RUN.findall(str(text).lower())
+
+
+class _Trie:
+    """扁平前缀树：(节点, 字) -> 子节点，terminal 记录成词的节点"""
+
+    def __init__(self):
+        self.edges = {}
+        self.terminal = set()
+        self.size = 1  # 节点数（0号为根）
+
+    def add(self, word):
+        node = 0
+        for ch in word:
+            child = self.edges.get((node, ch))
+            if child is None:
+                child = self.edges[(node, ch)] = self.size
+                self.size += 1
+            node = child
+        self.terminal.add(node)
+
+
+class Segmenter:
+    """双向最大匹配分词器"""
+
+    def __init__(self, words=(), cache_size=1024):
+        self.cache_size = cache_size
+        self._cache = OrderedDict()  # 输入 -> 分词结果（元组）
+        self._lock = threading.Lock()
+        self.load(words)
+
+    def load(self, words):
+        """用新词表整体替换词典（建好后一次性替换，正在分词的调用不受影响）"""
+        forward, backward = _Trie(), _Trie()
+        count = 0
+        for word in self._normalize(words):
+            forward.add(word)
+            backward.add(word[::-1])
+            count += 1
+        with self._lock:
+            self._forward, self._backward = forward, backward
+            self.word_count = count
+            self._cache.clear()
+
+    def add_words(self, words):
+        """增量加词（学习新内容时调用），返回新加入的词数"""
+        added = 0
+        with self._lock:
+            for word in self._normalize(words):
+                if self.contains(word):
+                    continue
+                self._forward.add(word)
+                self._backward.add(word[::-1])
+                added += 1
+            if added:
+                self.word_count += added
+                self._cache.clear()
+        return added
+
+    @staticmethod
+    def _normalize(words):
+        """只保留2字以上、含汉字的词"""
+        for word in words:
+            word = str(word).strip().lower()
+            if 1 < len(word) <= MAX_WORD_LENGTH and _HAN.search(word):
+                yield word
+
+    def contains(self, word):
+        node = 0
+        for ch in word:
+            node = self._forward.edges.get((node, ch))
+            if node is None:
+                return False
+        return node in self._forward.terminal
+
+    def segment(self, text):
+        """切分一句话，返回词列表（标点空白丢弃，字母数字串整体作为一个词）"""
+        text = str(text).lower()
+        with self._lock:
+            cached = self._cache.get(text)
+            if cached is not None:
+                self._cache.move_to_end(text)
+                return list(cached)
+            forward, backward = self._forward, self._backward
+
+        words = []
+        for run in fragments(text):
+            if _HAN.match(run):
+                words.extend(self._bidirectional(run, forward, backward))
+            else:
+                words.append(run)
+
+        if self.cache_size:
+            with self._lock:
+                self._cache[text] = tuple(words)
+                self._cache.move_to_end(text)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return words
+
+    def segment_many(self, texts):
+        """批量分词，返回与texts一一对应的词列表（批内重复的输入只切一次）"""
+        results = {}
+        for text in texts:
+            if text not in results:
+                results[text] = self.segment(text)
+        return [list(results[text]) for text in texts]
+
+    def _bidirectional(self, run, forward, backward):
+        fmm = self._forward_match(run, forward)
+        bmm = self._backward_match(run, backward)
+        if len(fmm) != len(bmm):
+            return fmm if len(fmm) < len(bmm) else bmm
+        singles_f = sum(1 for w in fmm if len(w) == 1)
+        singles_b = sum(1 for w in bmm if len(w) == 1)
+        return fmm if singles_f < singles_b else bmm
+
+    @staticmethod
+    def _forward_match(text, trie):
+        """正向最大匹配"""
+        words, i, n = [], 0, len(text)
+        edges, terminal = trie.edges, trie.terminal
+        while i < n:
+            end = i + 1  # 查不到词时单字成词
+            node, j = 0, i
+            while j < n and j - i < MAX_WORD_LENGTH:
+                node = edges.get((node, text[j]))
+                if node is None:
+                    break
+                j += 1
+                if node in terminal:
+                    end = j
+            words.append(text[i:end])
+            i = end
+        return words
+
+    @staticmethod
+    def _backward_match(text, trie):
+        """反向最大匹配（在反向前缀树上从句尾往前走）"""
+        words, i = [], len(text)
+        edges, terminal = trie.edges, trie.terminal
+        while i > 0:
+            start = i - 1
+            node, j = 0, i - 1
+            while j >= 0 and i - j <= MAX_WORD_LENGTH:
+                node = edges.get((node, text[j]))
+                if node is None:
+                    break
+                if node in terminal:
+                    start = j
+                j -= 1
+            words.append(text[start:i])
+            i = start
+        words.reverse()
+        return words
+
+
+def build_vocabulary(knowledge, learned_chat=(), learned_study=None, expand_study=True, expand_chat=True):
+    """由知识库和学习内容生成分词词表
+    expand_study / expand_chat 为False时不展开知识库的知识点 / 闲聊问题（按需读取的知识库很大时）"""
+    words = list(BASE_WORDS)
+    for study, expand in ((knowledge.get("study", {}), expand_study), (learned_study or {}, True)):
+        for study_type in study:
+            words.append(study_type)
+            # 知识点里的短片段（单词释义、诗句等）
+            for item in (study[study_type] if expand else ()):
+                words.extend(fragments(item))
+    for item in (knowledge.get("chat", []) if expand_chat else ()):
+        words.extend(canonical_question(q) for q in item.get("question", []))
+    words.extend(canonical_question(item.get("q", "")) for item in learned_chat)
+    return words
+
+
+def load_vocabulary():
+    """直接从 knowledge.json / learned.json 读取词表"""
+    learned_data = load_json(LEARNED_PATH, {"new_chat": [], "new_study": {}})
+    return build_vocabulary(load_json(KNOWLEDGE_PATH, {}),
+                            learned_data.get("new_chat", []), learned_data.get("new_study", {}))
+
+
+_shared_segmenter = None
+
+
+def get_segmenter(vocabulary=None):
+    """获取进程内共享的分词器；第一次调用时建立，没给词表就从知识文件读取
+    给了词表时总是用它替换共享分词器的词典（分词器可能已由记忆检索等模块按旧词表建立）"""
+    global _shared_segmenter
+    if _shared_segmenter is None:
+        cache_size = load_settings().get("segmenter_cache_size", 1024)
+        _shared_segmenter = Segmenter(load_vocabulary() if vocabulary is None else vocabulary, cache_size)
+    elif vocabulary is not None:
+        _shared_segmenter.load(vocabulary)
+    return _shared_segmenter
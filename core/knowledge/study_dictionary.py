@@ -0,0 +1,194 @@
+"""
+学习内容的词典模式：把 "apple - 苹果" 这类知识点解析成 (词头, 释义)，
+词头和释义各编译成一组排好序的键数组，用 bisect 做精确查询和前缀查询（O(log n)）
+- 知识库里的词表（可能有几万条）编译结果缓存在知识文件旁边，内容不变时启动直接读缓存
+- 用户学习的词条数量少，加载时逐条插入，不写缓存
+- 知识包里预编译的词典直接在 mmap 上二分（只读），学习的词条放进叠加的小词典
+"""
+import bisect
+import hashlib
+import os
+import pickle
+import re
+
+# 缓存格式版本，解析规则变化时+1让旧缓存失效
+CACHE_VERSION = 1
+
+# 词头和释义之间的分隔符（"apple - 苹果"、"apple：苹果"）
+_ENTRY_SEPARATOR = re.compile(r"\s+[-—–]\s+|\s*[：:=]\s*|\s*[—–]\s*")
+# 一个词头下多个释义之间的分隔符（"n. 苹果；苹果树"）
+_GLOSS_SEPARATOR = re.compile(r"[,，;；/、]")
+# 释义前的词性标记
+_PART_OF_SPEECH = re.compile(r"^(?:[a-z]+\.\s*)+")
+
+
+def parse_entry(entry):
+    """解析一条词条，返回 (词头, [释义])；不是"词 - 释义"格式时返回None"""
+    parts = _ENTRY_SEPARATOR.split(str(entry), maxsplit=1)
+    if len(parts) != 2:
+        return None
+    head = parts[0].strip().lower()
+    glosses = []
+    for gloss in _GLOSS_SEPARATOR.split(parts[1]):
+        gloss = _PART_OF_SPEECH.sub("", gloss.strip().lower()).strip()
+        if gloss:
+            glosses.append(gloss)
+    return (head, glosses) if head else None
+
+
+def cache_path_for(source_path, study_type):
+    """知识文件旁边的编译缓存路径"""
+    return f"{source_path}.{study_type}.dict"
+
+
+class StudyDictionary:
+    """一个学习类别的词典：词头、释义两组有序键数组 -> 词条下标"""
+
+    def __init__(self, entries=()):
+        self.entries = []
+        self.head_keys, self.head_rows = [], []
+        self.gloss_keys, self.gloss_rows = [], []
+        self.overlay = None  # 只读词典上新增的词条
+        self._compile(entries)
+
+    @classmethod
+    def from_arrays(cls, entries, head_keys, head_rows, gloss_keys, gloss_rows):
+        """由已编译好的（只读）序列构造，如知识包里的数组"""
+        dictionary = cls()
+        dictionary.entries = entries
+        dictionary.head_keys, dictionary.head_rows = head_keys, head_rows
+        dictionary.gloss_keys, dictionary.gloss_rows = gloss_keys, gloss_rows
+        return dictionary
+
+    def __len__(self):
+        return len(self.entries) + (len(self.overlay) if self.overlay is not None else 0)
+
+    def _compile(self, entries):
+        heads, glosses = [], []
+        for entry in entries:
+            parsed = parse_entry(entry)
+            if parsed is None:
+                continue
+            row = len(self.entries)
+            self.entries.append(entry)
+            heads.append((parsed[0], row))
+            glosses.extend((gloss, row) for gloss in parsed[1])
+        heads.sort()
+        glosses.sort()
+        self.head_keys = [key for key, _ in heads]
+        self.head_rows = [row for _, row in heads]
+        self.gloss_keys = [key for key, _ in glosses]
+        self.gloss_rows = [row for _, row in glosses]
+
+    @staticmethod
+    def digest(entries):
+        """词条内容的摘要，用来校验磁盘缓存"""
+        sha = hashlib.sha1()
+        for entry in entries:
+            sha.update(str(entry).encode("utf-8"))
+            sha.update(b"\n")
+        return sha.hexdigest()
+
+    @classmethod
+    def load(cls, entries, cache_path=None):
+        """编译词条；给了缓存路径时优先读取内容一致的缓存，否则编译后写入缓存"""
+        entries = list(entries)
+        if cache_path is None or not entries:
+            return cls(entries)
+        digest = cls.digest(entries)
+        try:
+            with open(cache_path, "rb") as f:
+                version, cached_digest, arrays = pickle.load(f)
+            if version == CACHE_VERSION and cached_digest == digest:
+                dictionary = cls()
+                (dictionary.entries, dictionary.head_keys, dictionary.head_rows,
+                 dictionary.gloss_keys, dictionary.gloss_rows) = arrays
+                return dictionary
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"读取词典缓存失败，重新编译 {cache_path}：{e}")
+
+        dictionary = cls(entries)
+        dictionary.save(cache_path, digest)
+        return dictionary
+
+    def save(self, cache_path, digest):
+        """写入编译缓存（先写临时文件再改名）"""
+        arrays = (self.entries, self.head_keys, self.head_rows, self.gloss_keys, self.gloss_rows)
+        tmp_path = f"{cache_path}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                pickle.dump((CACHE_VERSION, digest, arrays), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, cache_path)
+        except Exception as e:
+            print(f"保存词典缓存失败 {cache_path}：{e}")
+
+    def add(self, entry):
+        """插入一条词条（用户学习的内容），返回是否是可解析的词条"""
+        if not isinstance(self.entries, list):
+            if self.overlay is None:
+                self.overlay = StudyDictionary()
+            return self.overlay.add(entry)
+        parsed = parse_entry(entry)
+        if parsed is None:
+            return False
+        row = len(self.entries)
+        self.entries.append(entry)
+        self._insert(self.head_keys, self.head_rows, parsed[0], row)
+        for gloss in parsed[1]:
+            self._insert(self.gloss_keys, self.gloss_rows, gloss, row)
+        return True
+
+    @staticmethod
+    def _insert(keys, rows, key, row):
+        i = bisect.bisect_right(keys, key)
+        keys.insert(i, key)
+        rows.insert(i, row)
+
+    @staticmethod
+    def _exact(keys, rows, key):
+        i = bisect.bisect_left(keys, key)
+        j = bisect.bisect_right(keys, key, i)
+        return list(rows[i:j])
+
+    @staticmethod
+    def _prefix(keys, rows, prefix, limit):
+        i = bisect.bisect_left(keys, prefix)
+        found = []
+        while i < len(keys) and len(found) < limit and keys[i].startswith(prefix):
+            found.append(rows[i])
+            i += 1
+        return found
+
+    def exact(self, word):
+        """词头或释义完全等于word的词条"""
+        word = str(word).strip().lower()
+        rows = self._exact(self.head_keys, self.head_rows, word) + self._exact(self.gloss_keys, self.gloss_rows, word)
+        found = self._unique(rows)
+        return self.overlay.exact(word) + found if self.overlay is not None else found
+
+    def prefix(self, prefix, limit=10):
+        """词头或释义以prefix开头的词条（按键的字典序，最多limit条）"""
+        prefix = str(prefix).strip().lower()
+        if not prefix:
+            return []
+        rows = (self._prefix(self.head_keys, self.head_rows, prefix, limit) +
+                self._prefix(self.gloss_keys, self.gloss_rows, prefix, limit))
+        found = self._unique(rows)
+        if self.overlay is not None:
+            found = self._unique_entries(self.overlay.prefix(prefix, limit) + found, limit)
+        return found[:limit]
+
+    def lookup(self, query, limit=10):
+        """先精确命中，再补前缀命中，返回词条列表"""
+        return self._unique_entries(self.exact(query) + self.prefix(query, limit), limit)
+
+    def _unique(self, rows):
+        seen = set()
+        return [self.entries[row] for row in rows if not (row in seen or seen.add(row))]
+
+    @staticmethod
+    def _unique_entries(entries, limit):
+        seen = set()
+        return [entry for entry in entries if not (entry in seen or seen.add(entry))][:limit]
@@ -0,0 +1,195 @@
+"""
+学习内容分页：knowledge.json 里的每个学习类别单独存成一页，按需读入
+- 首次（或 knowledge.json 内容变化后）解析一次知识库，拆成：闲聊/默认回复一页、每个类别一页、
+  知识点权重ID表一页，以及记录各类别条数的索引；之后启动只读索引和闲聊页
+- 常驻内存的页数有上限，按最久未使用淘汰
+- 各类别条数预先算好，随机抽知识点时先按条数定位到类别，只读入那一页
+知识包（knowledge_pack）本身就是按需解码的，不走分页
+"""
+import json
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from collections.abc import Mapping
+
+from core.config import KNOWLEDGE_PATH, KNOWLEDGE_PAGES_DIR
+from core.knowledge.knowledge_pack import PackStudy
+from core.knowledge.weight_manager import study_weight_id
+
+# 分页格式版本，格式变化时+1让旧分页重建
+PAGE_FORMAT = 1
+# 保留的分页版本数（当前 + 上一版，热重载替换前旧状态仍可能读旧页）
+KEEP_VERSIONS = 2
+# 知识点权重ID表在页缓存里的键
+_WEIGHTS_PAGE = "\0weights"
+
+
+def _read_page(path):
+    # 直接解析，不经过 JsonCache（否则整页快照会另外常驻一份）
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _write_page(path, data):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+
+
+class StudyPages(Mapping):
+    """学习类别 -> 知识点列表；页按需读入，常驻页数有上限"""
+
+    def __init__(self, directory, sizes, files, max_resident=8):
+        self.directory = directory
+        self.sizes = dict(sizes)  # 类别 -> 条数（预先算好，不用读页）
+        self.files = dict(files)  # 类别 -> 页文件名
+        self.max_resident = max(1, max_resident)
+        self._pages = OrderedDict()
+        self._lock = threading.Lock()
+        self.loads = 0
+
+    def __getstate__(self):
+        # 写入索引缓存时不带已读入的页
+        state = dict(self.__dict__)
+        state["_pages"] = OrderedDict()
+        state["_lock"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.sizes)
+
+    def __iter__(self):
+        return iter(self.sizes)
+
+    def __contains__(self, study_type):
+        return study_type in self.sizes
+
+    def __getitem__(self, study_type):
+        if study_type not in self.files:
+            raise KeyError(study_type)
+        return self._page(study_type, self.files[study_type], [])
+
+    def _page(self, key, file_name, default):
+        with self._lock:
+            page = self._pages.get(key)
+            if page is not None:
+                self._pages.move_to_end(key)
+                return page
+        try:
+            page = _read_page(os.path.join(self.directory, file_name))
+        except Exception as e:
+            print(f"读取知识分页失败 {file_name}：{e}")
+            return default
+        with self._lock:
+            self.loads += 1
+            self._pages[key] = page
+            self._pages.move_to_end(key)
+            while len(self._pages) > self.max_resident:
+                self._pages.popitem(last=False)
+        return page
+
+    def resident(self):
+        """当前常驻内存的类别"""
+        with self._lock:
+            return [key for key in self._pages if key != _WEIGHTS_PAGE]
+
+    def study_item(self, weight_id):
+        """知识点权重ID对应的知识点内容，不在知识库里返回None"""
+        location = self._page(_WEIGHTS_PAGE, "weights.json", {}).get(weight_id)
+        if location is None:
+            return None
+        items = self[location[0]]
+        return items[location[1]] if location[1] < len(items) else None
+
+    def has_weight_id(self, weight_id):
+        return self._page(_WEIGHTS_PAGE, "weights.json", {}).get(weight_id) is not None
+
+
+def category_sizes(study):
+    """学习类别 -> 条数（分页和知识包不读入/解码知识点）"""
+    if isinstance(study, StudyPages):
+        return dict(study.sizes)
+    return {study_type: len(items) for study_type, items in study.items()}
+
+
+def category_size(study, study_type):
+    """一个学习类别的条数，没有这个类别时为0（分页时不读页）"""
+    if isinstance(study, StudyPages):
+        return study.sizes.get(study_type, 0)
+    return len(study[study_type]) if study_type in study else 0
+
+
+def is_lazy_study(study):
+    """学习内容是否按需读取（分页或知识包），此时不能为全部知识点建表"""
+    return isinstance(study, (StudyPages, PackStudy))
+
+
+def build_pages(knowledge, directory):
+    """把解析好的知识库拆成分页写入 directory，返回分页索引"""
+    tmp_dir = f"{directory}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    sizes, files, weights = {}, {}, {}
+    for k, (study_type, items) in enumerate(knowledge.get("study", {}).items()):
+        files[study_type] = f"{k:04d}.json"
+        sizes[study_type] = len(items)
+        _write_page(os.path.join(tmp_dir, files[study_type]), items)
+        for i, item in enumerate(items):
+            weights.setdefault(study_weight_id(study_type, item), [study_type, i])
+    _write_page(os.path.join(tmp_dir, "weights.json"), weights)
+    _write_page(os.path.join(tmp_dir, "core.json"),
+                {key: value for key, value in knowledge.items() if key != "study"})
+    index = {"format": PAGE_FORMAT, "sizes": sizes, "files": files}
+    # 索引最后写，有索引的目录一定是完整的
+    _write_page(os.path.join(tmp_dir, "index.json"), index)
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(tmp_dir, directory)
+    return index
+
+
+def _prune_versions(root, keep):
+    """只保留最近的几版分页目录"""
+    versions = sorted((entry for entry in os.scandir(root) if entry.is_dir() and not entry.name.endswith(".tmp")),
+                      key=lambda entry: entry.stat().st_mtime, reverse=True)
+    for entry in versions[keep:]:
+        shutil.rmtree(entry.path, ignore_errors=True)
+
+
+def load_paged_knowledge(max_resident=8, source_path=KNOWLEDGE_PATH, root=KNOWLEDGE_PAGES_DIR):
+    """读取分页后的知识库（源文件内容没变时不解析源文件），源文件读不到时返回None"""
+    from core.knowledge.index_cache import file_digest
+    digest = file_digest(source_path)
+    if digest is None:
+        return None
+    directory = os.path.join(root, digest[:16])
+    index = None
+    try:
+        index = _read_page(os.path.join(directory, "index.json"))
+        if index.get("format") != PAGE_FORMAT:
+            index = None
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f"读取知识分页索引失败，重新分页：{e}")
+
+    if index is None:
+        try:
+            knowledge = _read_page(source_path)
+        except Exception as e:
+            print(f"解析知识库失败 {source_path}：{e}")
+            return None
+        if not knowledge:
+            return None
+        os.makedirs(root, exist_ok=True)
+        index = build_pages(knowledge, directory)
+        _prune_versions(root, KEEP_VERSIONS)
+        core = {key: value for key, value in knowledge.items() if key != "study"}
+    else:
+        core = _read_page(os.path.join(directory, "core.json"))
+
+    core["study"] = StudyPages(directory, index["sizes"], index["files"], max_resident)
+    return core
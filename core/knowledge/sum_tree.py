@@ -0,0 +1,85 @@
+"""
+求和树（Fenwick树 / 树状数组）：按权重成比例抽样，抽样和更新权重都是 O(log n)
+主动推送复习内容时用它在常驻的权重表上抽样，不用每次筛选、复制全部ID
+"""
+import random
+
+
+class SumTree:
+    """键 -> 非负权重；按权重成比例抽键"""
+
+    def __init__(self, items=()):
+        self.keys = []
+        self.slots = {}  # 键 -> 下标
+        self.values = []
+        self.capacity = 1
+        self.tree = [0.0, 0.0]  # 1起始的树状数组
+        self.total = 0.0
+        for key, value in items:
+            self._append(key, value)
+        self._rebuild(max(1, len(self.keys)))
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _append(self, key, value):
+        self.slots[key] = len(self.keys)
+        self.keys.append(key)
+        self.values.append(max(0.0, float(value)))
+
+    def _rebuild(self, capacity):
+        """按新容量（2的幂）O(n) 重建树状数组"""
+        size = 1
+        while size < capacity:
+            size <<= 1
+        self.capacity = size
+        self.tree = [0.0] * (size + 1)
+        for i, value in enumerate(self.values, start=1):
+            self.tree[i] += value
+            parent = i + (i & -i)
+            if parent <= size:
+                self.tree[parent] += self.tree[i]
+        self.total = sum(self.values)
+
+    def get(self, key, default=0.0):
+        slot = self.slots.get(key)
+        return self.values[slot] if slot is not None else default
+
+    def update(self, key, value):
+        """设置键的权重（新键自动加入，权重设为0即不再被抽到）"""
+        value = max(0.0, float(value))
+        slot = self.slots.get(key)
+        if slot is None:
+            self._append(key, 0.0)
+            slot = len(self.keys) - 1
+            if len(self.keys) > self.capacity:
+                self._rebuild(len(self.keys))
+        delta = value - self.values[slot]
+        if not delta:
+            return
+        self.values[slot] = value
+        self.total += delta
+        i = slot + 1
+        while i <= self.capacity:
+            self.tree[i] += delta
+            i += i & -i
+
+    def sample(self, rng=random):
+        """按权重成比例抽一个键；总权重为0时返回None"""
+        if self.total <= 0:
+            return None
+        target = rng.random() * self.total
+        # 从最高位往下找第一个前缀和超过target的位置
+        pos = 0
+        step = self.capacity
+        while step:
+            nxt = pos + step
+            if nxt <= self.capacity and self.tree[nxt] <= target:
+                target -= self.tree[nxt]
+                pos = nxt
+            step >>= 1
+        # 浮点误差可能落到末尾或权重为0的位置，往前找最近的有效键
+        pos = min(pos, len(self.keys) - 1)
+        while pos > 0 and self.values[pos] <= 0:
+            pos -= 1
+        return self.keys[pos] if self.values[pos] > 0 else None
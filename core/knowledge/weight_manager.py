@@ -1,10 +1,22 @@
 # weight_manager.py
+import hashlib
+import random
+
 from core.config import (
-    CHAT_HISTORY_PATH, RATING_RECORD_PATH, DIALOG_WEIGHTS_PATH,
     HIGH_RATING_THRESHOLD, LOW_RATING_THRESHOLD,
     DEFAULT_WEIGHT, HIGH_WEIGHT, LOW_WEIGHT
 )
-from utils.file_helper import load_json, save_json
+from core.storage.store import get_store
+from core.knowledge.sum_tree import SumTree
+
+# 权重高于此值的内容才参与主动推送复习
+REVIEW_MIN_WEIGHT = 1.0
+
+
+def study_weight_id(study_type, content):
+    """学习内容（知识点）的权重ID：由类别和内容决定，知识库增删条目后也保持不变"""
+    digest = hashlib.sha1(f"{study_type}\n{content}".encode("utf-8")).hexdigest()
+    return f"stu_{digest[:16]}"
 
 
 class WeightManager:
@@ -19,6 +31,9 @@ class WeightManager:
         self.HIGH_RATING_THRESHOLD = self.settings.get("high_rating_threshold", 4)
         self.LOW_RATING_THRESHOLD = self.settings.get("low_rating_threshold", 2)
 
+        # 权重变化时的回调（如让别名表失效），参数为权重ID
+        self.weight_listeners = []
+
         # 初始化数据文件
         self._init_files()
 
@@ -45,12 +60,37 @@ class WeightManager:
         from utils.file_helper import init_data_dir
         init_data_dir()
 
-        if not load_json(CHAT_HISTORY_PATH):
-            save_json(CHAT_HISTORY_PATH, [])
-        if not load_json(RATING_RECORD_PATH):
-            save_json(RATING_RECORD_PATH, [])
-        if not load_json(DIALOG_WEIGHTS_PATH):
-            save_json(DIALOG_WEIGHTS_PATH, {})
+        # 聊天记录、评分、权重统一由存储后端管理
+        self.store = get_store()
+
+        # 常驻内存的权重表和 dialog_id -> related_dialog_id 映射，启动时构建一次
+        self._load_weight_table()
+
+    def _load_weight_table(self):
+        """从存储构建内存权重表和关联映射（只在启动时扫描一次聊天记录）"""
+        from core.storage.archive import get_archive
+        self.weights = dict(self.store.load_weights())
+        # 复习推送用的求和树：只放高权重内容，按权重成比例抽样
+        self.review_tree = SumTree((k, self._review_weight(v)) for k, v in self.weights.items())
+        # 已归档对话的关联记在归档清单里，对它们的评分也要作用到关联的学习内容上
+        self.related_ids = get_archive().links("chat")
+        for item in self.store.iter_chats():
+            related_id = item.get("related_dialog_id")
+            if related_id:
+                self.related_ids[item.get("dialog_id")] = related_id
+
+    @staticmethod
+    def _review_weight(weight):
+        return weight if weight is not None and weight > REVIEW_MIN_WEIGHT else 0.0
+
+    def sample_review(self, rng=random):
+        """按权重成比例抽一个高权重内容的权重ID，没有高权重内容时返回None"""
+        return self.review_tree.sample(rng)
+
+    def register_dialog(self, dialog_id, related_dialog_id=""):
+        """新聊天记录写入后登记其关联的学习内容ID"""
+        if related_dialog_id:
+            self.related_ids[dialog_id] = related_dialog_id
 
     def calculate_weight(self, rating):
         """根据评分计算权重"""
@@ -67,37 +107,31 @@ class WeightManager:
             # 1. 计算新权重
             new_weight = self.calculate_weight(rating)
 
-            # 2. 首先获取这次对话对应的学习内容ID
-            chat_history = load_json(CHAT_HISTORY_PATH, [])
-            related_dialog_id = None
+            # 2. 首先获取这次对话对应的学习内容ID（内存映射，无需扫描聊天记录）
+            related_dialog_id = self.related_ids.get(dialog_id, "")
 
-            for item in chat_history:
-                if item.get("dialog_id") == dialog_id:
-                    related_dialog_id = item.get("related_dialog_id")
-                    # 更新聊天记录中的评分和权重
-                    item["rating"] = rating
-                    item["weight"] = new_weight
-                    break
+            # 同时更新聊天记录中的评分和权重
+            self.store.update_chat(dialog_id, rating=rating, weight=new_weight)
 
             # 3. 确定权重ID：如果有相关学习内容，使用学习内容ID，否则使用对话ID
             weight_id = related_dialog_id if related_dialog_id else dialog_id
 
-            # 4. 更新权重文件（使用学习内容ID作为键）
-            dialog_weights = load_json(DIALOG_WEIGHTS_PATH, {})
-            dialog_weights[weight_id] = new_weight
-            save_json(DIALOG_WEIGHTS_PATH, dialog_weights)
+            # 4. 更新内存权重表，并只持久化这一条变化（使用学习内容ID作为键）
+            self.weights[weight_id] = new_weight
+            self.store.set_weight(weight_id, new_weight)
+            self.review_tree.update(weight_id, self._review_weight(new_weight))
+            for listener in self.weight_listeners:
+                listener(weight_id)
 
             # 5. 保存评分记录
-            rating_record = load_json(RATING_RECORD_PATH, [])
             import time
-            rating_record.append({
+            self.store.append_rating({
                 "dialog_id": dialog_id,
                 "related_dialog_id": related_dialog_id,  # 新增字段
                 "weight_id": weight_id,  # 新增字段
                 "rating": rating,
                 "timestamp": int(time.time() * 1000)
             })
-            save_json(RATING_RECORD_PATH, rating_record)
 
             return new_weight
         except Exception as e:
@@ -107,21 +141,21 @@ class WeightManager:
     def get_dialog_weight(self, dialog_id):
         """获取单条对话的权重（优先使用学习内容ID）"""
         try:
-            dialog_weights = load_json(DIALOG_WEIGHTS_PATH, {})
             # 首先尝试直接获取
-            weight = dialog_weights.get(dialog_id)
+            weight = self.weights.get(dialog_id)
             if weight is not None:
                 return weight
 
-            # 如果找不到，尝试查找这个对话ID是否在聊天记录中，并获取其相关学习内容ID
-            chat_history = load_json(CHAT_HISTORY_PATH, [])
-            for item in chat_history:
-                if item.get("dialog_id") == dialog_id:
-                    related_id = item.get("related_dialog_id")
-                    if related_id:
-                        return dialog_weights.get(related_id, self.DEFAULT_WEIGHT)
+            # 如果找不到，查找这个对话ID关联的学习内容ID
+            related_id = self.related_ids.get(dialog_id)
+            if related_id:
+                return self.weights.get(related_id, self.DEFAULT_WEIGHT)
 
             return self.DEFAULT_WEIGHT
         except Exception as e:
             print(f"获取权重异常：{e}")
-            return self.DEFAULT_WEIGHT
\ No newline at end of file
+            return self.DEFAULT_WEIGHT
+
+    def get_dialog_weights(self, dialog_ids):
+        """批量获取多条对话的权重，返回与输入顺序一致的列表"""
+        return [self.get_dialog_weight(dialog_id) for dialog_id in dialog_ids]
\ No newline at end of file
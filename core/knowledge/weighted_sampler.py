@@ -0,0 +1,109 @@
+"""
+按权重抽样：Walker 别名表（Vose 构建法），建表 O(n)，每次抽样 O(1)
+- 每个问题组（同一问题的全部学习回答）、每个学习类别各缓存一张别名表
+- 只有组内某个权重变化（评分）或组成员变化（学习新内容）时才让这张表失效
+- 学习类别的表只存下标不存条目，抽中后再到（分页的）学习内容里取，不额外常驻整个类别
+"""
+import random
+from collections import defaultdict
+
+
+class AliasTable:
+    """离散分布的别名表"""
+
+    def __init__(self, weights):
+        n = len(weights)
+        self.n = n
+        self.total = float(sum(weights))
+        self.prob = [1.0] * n
+        self.alias = list(range(n))
+        if n == 0 or self.total <= 0:
+            return  # 全为0时退化成均匀分布
+
+        scaled = [w * n / self.total for w in weights]
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            s, l = small.pop(), large.pop()
+            self.prob[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] = scaled[l] + scaled[s] - 1.0
+            (small if scaled[l] < 1.0 else large).append(l)
+        # 剩下的（含浮点误差留下的）概率都是1；权重为0的条目（如低于回复阈值的回答）始终落到别名上
+        heaviest = max(range(n), key=weights.__getitem__)
+        for i in small + large:
+            if weights[i] > 0:
+                self.prob[i] = 1.0
+            else:
+                self.prob[i], self.alias[i] = 0.0, heaviest
+
+    def sample(self, rng=random):
+        """抽一个下标"""
+        u = rng.random() * self.n
+        i = int(u)
+        return i if u - i < self.prob[i] else self.alias[i]
+
+
+class WeightedSampler:
+    """按分组缓存别名表；权重ID变化时只让包含它的组失效"""
+
+    def __init__(self):
+        self.tables = {}  # 组键 -> (条目列表（只存下标的表为None）, AliasTable)
+        self.weight_ids = {}  # 组键 -> 权重ID列表（权重变化时保留，组成员变化时才重算）
+        self.members = defaultdict(set)  # 权重ID -> 用到它的组键
+
+    def _table(self, key, items, weight_ids, weights):
+        entry = self.tables.get(key)
+        if entry is None:
+            entry = self.tables[key] = (None if items is None else list(items), AliasTable(weights))
+            for weight_id in weight_ids:
+                self.members[weight_id].add(key)
+        return entry
+
+    def choose(self, key, items, weight_ids, weights, rng=random):
+        """在一个组内按权重抽一个条目；表已缓存时直接用缓存（不再读权重）"""
+        items, table = self._table(key, items, weight_ids, weights)
+        return items[table.sample(rng)]
+
+    def sample_cached(self, key, load_items, weight_ids_of, weights_of, rng=random):
+        """按权重抽一个下标，表里不保存条目（适合学习类别这种大组，条目由调用方按下标取）
+        load_items() 只在要计算权重ID时调用；weight_ids_of(条目列表) 的结果按组缓存，
+        权重变化让表失效后只重新调用 weights_of(权重ID列表)"""
+        entry = self.tables.get(key)
+        if entry is None:
+            weight_ids = self.weight_ids.get(key)
+            if weight_ids is None:
+                weight_ids = self.weight_ids[key] = weight_ids_of(load_items())
+            entry = self._table(key, None, weight_ids, weights_of(weight_ids))
+        return entry[1].sample(rng)
+
+    def choose_grouped(self, groups, rng=random):
+        """在多个组的并集上按权重抽样：先按组总权重选组，再在组内用别名表抽
+        groups: [(组键, 条目列表, 权重ID列表, 权重列表)]"""
+        entries = [self._table(*group) for group in groups]
+        if len(entries) == 1:
+            items, table = entries[0]
+            return items[table.sample(rng)]
+        totals = [table.total for _, table in entries]
+        point = rng.random() * sum(totals)
+        for (items, table), total in zip(entries, totals):
+            if point < total:
+                return items[table.sample(rng)]
+            point -= total
+        items, table = entries[-1]
+        return items[table.sample(rng)]
+
+    def invalidate(self, key):
+        """让一个组的表失效（组成员变化时调用）"""
+        self.tables.pop(key, None)
+        self.weight_ids.pop(key, None)
+
+    def invalidate_weight(self, weight_id):
+        """某个权重变化：让包含它的组失效"""
+        for key in self.members.pop(weight_id, ()):
+            self.tables.pop(key, None)
+
+    def clear(self):
+        self.tables.clear()
+        self.weight_ids.clear()
+        self.members.clear()
@@ -2,11 +2,12 @@
 记忆网络：存储和检索探索结果（修复版）
 """
 import json
-import uuid
 import time
 from datetime import datetime
 from collections import defaultdict
-from utils.file_helper import load_json, save_json
+from core.storage.store import get_store
+from core.knowledge.segmenter import get_segmenter
+from utils.id_allocator import new_id
 
 
 class MemoryNetwork:
@@ -15,7 +16,8 @@ class MemoryNetwork:
         from utils.file_helper import init_data_dir
         init_data_dir()
 
-        self.memory_file = "data/exploration_memory.json"
+        # 记忆按条目写入存储后端，不再整文件重写
+        self.store = get_store()
         self.memories = self._load_memories()
 
         # 记忆关联网络 - 确保先初始化
@@ -29,14 +31,7 @@ class MemoryNetwork:
 
     def _load_memories(self):
         """加载记忆"""
-        default_memories = {
-            "facts": [],
-            "preferences": [],
-            "conversations": [],
-            "discoveries": [],
-            "timeline": []
-        }
-        return load_json(self.memory_file, default_memories)
+        return self.store.load_memories()
 
     def _build_association_graph(self):
         """构建记忆关联图"""
@@ -74,7 +69,7 @@ class MemoryNetwork:
 
     def store_memory(self, memory_type, content, importance=0.5, context=None):
         """存储记忆"""
-        memory_id = f"mem_{uuid.uuid4().hex[:8]}_{int(time.time() * 1000)}"
+        memory_id = new_id("mem")
 
         memory_entry = {
             "id": memory_id,
@@ -92,6 +87,7 @@ class MemoryNetwork:
             self.memories[memory_type] = []
 
         self.memories[memory_type].append(memory_entry)
+        self.store.put_memory(memory_type, memory_entry)
 
         # 如果是事实记忆，更新关联图
         if memory_type == "facts" and isinstance(content, dict) and "keywords" in content:
@@ -114,10 +110,19 @@ class MemoryNetwork:
         if "timeline" not in self.memories:
             self.memories["timeline"] = []
         self.memories["timeline"].append(timeline_entry)
+        self.store.put_memory("timeline", timeline_entry)
 
-        self._save_memories()
         return memory_id
 
+    def get_memory(self, memory_id):
+        """按id获取记忆（已归档的记忆会从归档中读取）"""
+        for items in self.memories.values():
+            if isinstance(items, list):
+                for item in items:
+                    if isinstance(item, dict) and item.get("id") == memory_id:
+                        return item
+        return self.store.get_memory(memory_id)
+
     def retrieve_memories(self, query, memory_type=None, limit=5):
         """检索相关记忆"""
         memories_to_search = []
@@ -129,16 +134,17 @@ class MemoryNetwork:
                 if mem_type != "timeline" and isinstance(items, list):
                     memories_to_search.extend(items)
 
-        # 简单关键词匹配
+        # 关键词匹配：查询先分词，单字词太容易误命中，只在查询本身就是单字时使用
         relevant_memories = []
-        query_words = set(str(query).lower().split())
+        query_words = get_segmenter().segment(query)
+        query_words = set(word for word in query_words if len(word) > 1) or set(query_words)
 
         for memory in memories_to_search:
             if not isinstance(memory, dict):
                 continue
 
             content = memory.get("content", {})
-            content_str = json.dumps(content).lower()
+            content_str = json.dumps(content, ensure_ascii=False).lower()
 
             # 计算匹配度
             match_score = 0
@@ -162,12 +168,14 @@ class MemoryNetwork:
         # 按分数排序
         relevant_memories.sort(key=lambda x: x[1], reverse=True)
 
-        # 更新访问记录
+        # 更新访问记录（只写回被访问的记忆）
+        accessed = []
         for memory, _ in relevant_memories[:limit]:
             memory["access_count"] = memory.get("access_count", 0) + 1
             memory["last_accessed"] = datetime.now().isoformat()
+            accessed.append(memory)
 
-        self._save_memories()
+        self.store.update_memories(accessed)
         return [mem[0] for mem in relevant_memories[:limit]]
 
     def _calculate_freshness_score(self, memory):
@@ -271,7 +279,3 @@ class MemoryNetwork:
 
             relevant.sort(key=lambda x: x[1], reverse=True)
             return [mem[0] for mem in relevant[:depth]]
-
-    def _save_memories(self):
-        """保存记忆"""
-        save_json(self.memory_file, self.memories)
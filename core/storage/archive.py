@@ -0,0 +1,223 @@
+"""
+冷数据归档：把超过保留期的聊天记录、评分记录和记忆压缩成分段文件（gzip / lzma）
+- data/archive/ 下每个分段是一份压缩的JSON Lines
+- data/memory_archive.json 是归档清单：每个分段的类型、时间范围、条数和包含的ID；
+  聊天记录分段还记下 dialog_id -> related_dialog_id，对已归档对话的评分仍能作用到关联的学习内容
+- 按 dialog_id / 记忆id 查找时先查热数据，找不到再透明地到归档里找
+"""
+import gzip
+import json
+import lzma
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from core.config import ARCHIVE_DIR, MEMORY_ARCHIVE_PATH
+from utils.file_helper import load_json, save_json
+
+COMPRESSORS = {
+    "gzip": (".jsonl.gz", gzip.open),
+    "lzma": (".jsonl.xz", lzma.open),
+}
+
+# 最近解压过的分段保留在内存里的个数
+DECOMPRESSED_CACHE_SIZE = 4
+
+# 各类记录在清单里额外登记的关联字段：类型 -> (ID字段, 关联字段)
+LINK_FIELDS = {
+    "chat": ("dialog_id", "related_dialog_id"),
+}
+
+
+def _open_segment(path, mode):
+    opener = lzma.open if path.endswith(".xz") else gzip.open
+    return opener(path, mode)
+
+
+class ColdArchive:
+    """压缩归档分段及其清单"""
+
+    def __init__(self, archive_dir=ARCHIVE_DIR, manifest_path=MEMORY_ARCHIVE_PATH, compression="gzip"):
+        self.archive_dir = archive_dir
+        os.makedirs(archive_dir, exist_ok=True)
+        self.manifest_path = manifest_path
+        self.compression = compression if compression in COMPRESSORS else "gzip"
+        self._lock = threading.Lock()
+
+        # 旧版本留下的空清单文件按没有归档处理
+        has_manifest = os.path.exists(manifest_path) and os.path.getsize(manifest_path) > 0
+        manifest = load_json(manifest_path, {"segments": []}) if has_manifest else {"segments": []}
+        self.segments = {meta["name"]: meta for meta in manifest.get("segments", [])
+                         if os.path.exists(os.path.join(archive_dir, meta["name"]))}
+        self.id_map = {}  # (kind, id) -> 分段名
+        for name, meta in self.segments.items():
+            for record_id in meta.get("ids", []):
+                self.id_map[(meta["kind"], record_id)] = name
+        self._decompressed = OrderedDict()  # 分段名 -> {id: record}
+
+    def _save_manifest(self):
+        segments = [self.segments[name] for name in sorted(self.segments)]
+        save_json(self.manifest_path, {"version": 1, "segments": segments})
+
+    def write_segment(self, kind, records, id_key, timestamp_of):
+        """把一批记录压缩写成一个归档分段，返回分段名；records为空时不写"""
+        records = [r for r in records if isinstance(r, dict)]
+        if not records:
+            return None
+        timestamps = [timestamp_of(r) for r in records]
+        suffix, opener = COMPRESSORS[self.compression]
+        day = time.strftime("%Y-%m-%d", time.localtime(min(timestamps) / 1000))
+
+        with self._lock:
+            seq = 0
+            while True:
+                name = f"{kind}_{day}_{seq:03d}{suffix}"
+                if name not in self.segments and not os.path.exists(os.path.join(self.archive_dir, name)):
+                    break
+                seq += 1
+
+            # 先写临时文件再改名，压缩中途崩溃不会留下坏分段
+            path = os.path.join(self.archive_dir, name)
+            with opener(path + ".tmp", "wt", encoding="utf-8") as f:
+                for record in records:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            os.replace(path + ".tmp", path)
+
+            ids = [r.get(id_key) for r in records if r.get(id_key)]
+            self.segments[name] = {
+                "name": name,
+                "kind": kind,
+                "first_ts": min(timestamps),
+                "last_ts": max(timestamps),
+                "count": len(records),
+                "bytes": os.path.getsize(path),
+                "ids": ids
+            }
+            if kind in LINK_FIELDS:
+                self.segments[name]["links"] = _links(kind, records)
+            for record_id in ids:
+                self.id_map[(kind, record_id)] = name
+            self._save_manifest()
+        return name
+
+    def _load_segment(self, name, id_key):
+        """解压一个分段（带小容量LRU缓存）"""
+        with self._lock:
+            if name in self._decompressed:
+                self._decompressed.move_to_end(name)
+                return self._decompressed[name]
+        records = {}
+        with _open_segment(os.path.join(self.archive_dir, name), "rt") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    record = json.loads(line)
+                    records[record.get(id_key)] = record
+        with self._lock:
+            self._decompressed[name] = records
+            while len(self._decompressed) > DECOMPRESSED_CACHE_SIZE:
+                self._decompressed.popitem(last=False)
+        return records
+
+    def find(self, kind, record_id, id_key="id"):
+        """按ID在归档中查找记录，找不到返回None"""
+        name = self.id_map.get((kind, record_id))
+        if name is None:
+            return None
+        try:
+            return self._load_segment(name, id_key).get(record_id)
+        except Exception as e:
+            print(f"读取归档分段失败 {name}：{e}")
+            return None
+
+    def ids(self, kind):
+        """某类归档记录的全部ID"""
+        return {record_id for (k, record_id) in self.id_map if k == kind}
+
+    def links(self, kind):
+        """某类归档记录登记的关联 {ID: 关联ID}（如已归档对话 -> 它关联的学习内容）
+        旧版本写下、清单里没有关联的分段解压一次补上"""
+        result = {}
+        backfilled = False
+        for name in sorted(self.segments):
+            meta = self.segments[name]
+            if meta["kind"] != kind:
+                continue
+            if "links" not in meta and kind in LINK_FIELDS:
+                try:
+                    with _open_segment(os.path.join(self.archive_dir, name), "rt") as f:
+                        records = [json.loads(line) for line in f if line.strip()]
+                except Exception as e:
+                    print(f"读取归档分段失败 {name}：{e}")
+                    continue
+                with self._lock:
+                    meta["links"] = _links(kind, records)
+                backfilled = True
+            result.update(meta.get("links", {}))
+        if backfilled:
+            with self._lock:
+                self._save_manifest()
+        return result
+
+    def iter_records(self, kind, start_ts=None, end_ts=None):
+        """按时间顺序读取某类归档记录，只解压时间范围有交集的分段"""
+        for name in sorted(self.segments):
+            meta = self.segments[name]
+            if meta["kind"] != kind:
+                continue
+            if start_ts is not None and meta["last_ts"] < start_ts:
+                continue
+            if end_ts is not None and meta["first_ts"] > end_ts:
+                continue
+            with _open_segment(os.path.join(self.archive_dir, name), "rt") as f:
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        yield json.loads(line)
+
+    def stats(self):
+        """归档统计：按类型汇总分段数、记录数和压缩后字节数"""
+        summary = {}
+        for meta in self.segments.values():
+            kind = summary.setdefault(meta["kind"], {"segments": 0, "records": 0, "bytes": 0})
+            kind["segments"] += 1
+            kind["records"] += meta["count"]
+            kind["bytes"] += meta["bytes"]
+        return summary
+
+
+def _links(kind, records):
+    id_field, link_field = LINK_FIELDS[kind]
+    return {r[id_field]: r[link_field] for r in records
+            if isinstance(r, dict) and r.get(id_field) and r.get(link_field)}
+
+
+_shared_archive = None
+
+
+def get_archive():
+    """获取进程内共享的冷数据归档"""
+    global _shared_archive
+    if _shared_archive is None:
+        from core.config import load_settings
+        _shared_archive = ColdArchive(compression=load_settings().get("archive_compression", "gzip"))
+    return _shared_archive
+
+
+def archive_cold_data(store, max_age_days=None):
+    """把超过保留期的数据从热存储移到归档，返回各类归档条数"""
+    if max_age_days is None:
+        from core.config import load_settings
+        max_age_days = load_settings().get("archive_after_days", 90)
+    if not max_age_days or max_age_days <= 0:
+        return {}
+    cutoff_ts = int((time.time() - max_age_days * 86400) * 1000)
+    try:
+        moved = store.archive_before(get_archive(), cutoff_ts)
+        if any(moved.values()):
+            print(f"✅ 已归档冷数据：{moved}")
+        return moved
+    except Exception as e:
+        print(f"归档冷数据失败：{e}")
+        return {}
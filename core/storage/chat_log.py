@@ -0,0 +1,378 @@
+"""
+聊天记录日志：按天分段的JSON Lines文件，每行一条聊天记录
+- data/chat_history/ 下每天一个（超过大小上限时再滚动出新的）分段文件，manifest.json 记录
+  每个分段的时间范围、行数和字节数，按时间范围查询时只打开相关分段
+- index.jsonl 记录 dialog_id -> (分段, 字节偏移, 行长度)，按ID查找和评分更新都是O(1)
+- rating / weight 字段写成定宽，评分时原地覆盖这一行，不重写整个历史
+"""
+import json
+import os
+import threading
+import time
+
+from core.config import CHAT_LOG_DIR, CHAT_LOG_PATH, CHAT_HISTORY_PATH
+from utils.file_helper import load_json, save_json_deferred, append_jsonl, iter_jsonl
+
+# 定宽字段的宽度（JSON允许多余空格，原地更新时长度保持不变）
+RATING_WIDTH = 4
+WEIGHT_WIDTH = 12
+
+# 单个分段文件的大小上限，超过后当天滚动出新分段
+SEGMENT_MAX_BYTES = 4 * 1024 * 1024
+
+
+def encode_record(record):
+    """把聊天记录编码成一行（rating/weight放在末尾并补齐到定宽）"""
+    body = {k: v for k, v in record.items() if k not in ("rating", "weight")}
+    rating = json.dumps(record.get("rating"))
+    weight = record.get("weight")
+    weight = json.dumps(round(weight, 6) if isinstance(weight, float) else weight)
+    text = json.dumps(body, ensure_ascii=False)[:-1]
+    if body:
+        text += ", "
+    text += f'"rating": {rating:<{RATING_WIDTH}}, "weight": {weight:<{WEIGHT_WIDTH}}}}'
+    return (text + "\n").encode("utf-8")
+
+
+def _decode(line):
+    try:
+        return json.loads(line)
+    except ValueError:
+        return None
+
+
+def _day_of(timestamp_ms):
+    """毫秒时间戳对应的本地日期"""
+    return time.strftime("%Y-%m-%d", time.localtime(timestamp_ms / 1000))
+
+
+class ChatLog:
+    """按天分段、带持久化 dialog_id 索引的聊天记录"""
+
+    def __init__(self, log_dir=CHAT_LOG_DIR, legacy_paths=(CHAT_LOG_PATH, CHAT_HISTORY_PATH)):
+        self.log_dir = log_dir
+        os.makedirs(log_dir, exist_ok=True)
+        self.manifest_path = os.path.join(log_dir, "manifest.json")
+        self.index_path = os.path.join(log_dir, "index.jsonl")
+        self.legacy_paths = legacy_paths
+        self._lock = threading.Lock()
+
+        self.segments = {}  # 分段文件名 -> {day, first_ts, last_ts, count, bytes}
+        self.index = {}  # dialog_id -> (分段文件名, offset, length)
+
+        self._load()
+        self.migrate_legacy()
+
+    # ---------- 清单与索引 ----------
+    def _load(self):
+        """加载清单和索引；分段文件比清单新（如上次崩溃）时只补扫尾部"""
+        manifest = load_json(self.manifest_path, {"segments": []})
+        for meta in manifest.get("segments", []):
+            self.segments[meta["name"]] = meta
+
+        for entry in iter_jsonl(self.index_path):
+            try:
+                dialog_id, name, offset, length = entry
+            except (TypeError, ValueError):
+                continue
+            self.index[dialog_id] = (name, offset, length)
+
+        changed = False
+        # 指向已不存在分段（如已归档）的索引项直接丢弃
+        stale = [d for d, (name, _, _) in self.index.items()
+                 if not os.path.exists(self._segment_path(name))]
+        for dialog_id in stale:
+            del self.index[dialog_id]
+        if stale:
+            self._rewrite_index()
+        for name in sorted(os.listdir(self.log_dir)):
+            if not name.endswith(".jsonl") or name == "index.jsonl":
+                continue
+            meta = self.segments.get(name)
+            size = os.path.getsize(self._segment_path(name))
+            if meta is None:
+                meta = self.segments[name] = self._new_meta(name)
+            if meta["bytes"] > size:
+                # 清单和文件对不上（文件被替换过），整体重建
+                self.rebuild_index()
+                return
+            if meta["bytes"] < size:
+                self._index_tail(name)
+                changed = True
+        for name in [n for n in self.segments if not os.path.exists(self._segment_path(n))]:
+            del self.segments[name]
+            changed = True
+        if changed:
+            self._save_manifest()
+
+    def rebuild_index(self):
+        """从头扫描所有分段重建清单和索引"""
+        self.index = {}
+        self.segments = {}
+        if os.path.exists(self.index_path):
+            os.remove(self.index_path)
+        for name in sorted(os.listdir(self.log_dir)):
+            if name.endswith(".jsonl") and name != "index.jsonl":
+                self.segments[name] = self._new_meta(name)
+                self._index_tail(name)
+        self._save_manifest()
+
+    def _index_tail(self, name):
+        """扫描分段中尚未登记的尾部，补充索引和统计"""
+        meta = self.segments[name]
+        with open(self._segment_path(name), "rb") as f:
+            f.seek(meta["bytes"])
+            offset = meta["bytes"]
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # 崩溃留下的半行，下次追加前会被截掉
+                record = _decode(line)
+                if record is not None:
+                    self._register(name, record, offset, len(line))
+                offset += len(line)
+        meta["bytes"] = offset
+
+    def _register(self, name, record, offset, length):
+        """登记一行：更新分段统计和索引"""
+        meta = self.segments[name]
+        timestamp = record.get("timestamp") or 0
+        meta["first_ts"] = timestamp if meta["first_ts"] is None else min(meta["first_ts"], timestamp)
+        meta["last_ts"] = timestamp if meta["last_ts"] is None else max(meta["last_ts"], timestamp)
+        meta["count"] += 1
+        meta["bytes"] = max(meta["bytes"], offset + length)
+        dialog_id = record.get("dialog_id")
+        if dialog_id:
+            self.index[dialog_id] = (name, offset, length)
+            append_jsonl(self.index_path, [dialog_id, name, offset, length])
+
+    def _rewrite_index(self):
+        """按当前内存索引重写索引文件（去掉重复和失效的项）"""
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for dialog_id, (name, offset, length) in self.index.items():
+                f.write(json.dumps([dialog_id, name, offset, length], ensure_ascii=False) + "\n")
+        os.replace(tmp_path, self.index_path)
+
+    def _save_manifest(self):
+        """保存清单（统计信息可由分段文件重建，延迟写入即可）"""
+        segments = [self.segments[name] for name in sorted(self.segments)]
+        save_json_deferred(self.manifest_path, {"version": 1, "segments": segments})
+
+    @staticmethod
+    def _new_meta(name):
+        return {"name": name, "day": name.split("_")[0], "first_ts": None, "last_ts": None,
+                "count": 0, "bytes": 0}
+
+    def _segment_path(self, name):
+        return os.path.join(self.log_dir, name)
+
+    def _segment_for(self, timestamp):
+        """记录应写入的分段：所在日期的最后一个分段，超过大小上限则新开一个"""
+        day = _day_of(timestamp)
+        names = sorted(n for n in self.segments if self.segments[n]["day"] == day)
+        if names and self.segments[names[-1]]["bytes"] < SEGMENT_MAX_BYTES:
+            return names[-1]
+        name = f"{day}_{len(names):03d}.jsonl"
+        self.segments[name] = self._new_meta(name)
+        return name
+
+    # ---------- 迁移 ----------
+    def migrate_legacy(self):
+        """把旧版单文件聊天记录（JSONL或JSON数组）迁移到分段存储，只执行一次"""
+        migrated = 0
+        for legacy_path in self.legacy_paths:
+            if not os.path.exists(legacy_path):
+                continue
+            if legacy_path.endswith(".jsonl"):
+                records = iter_jsonl(legacy_path)
+            else:
+                records = load_json(legacy_path, [])
+                if not isinstance(records, list):
+                    records = []
+            with self._lock:
+                for record in records:
+                    if isinstance(record, dict):
+                        self._append_locked(record)
+                        migrated += 1
+            # 旧文件改名保留，不再参与读写
+            os.replace(legacy_path, legacy_path + ".migrated")
+            stale_index = os.path.splitext(legacy_path)[0] + ".idx"
+            if os.path.exists(stale_index):
+                os.remove(stale_index)
+        if migrated:
+            self._save_manifest()
+            print(f"✅ 已迁移 {migrated} 条聊天记录到 {self.log_dir}")
+        return migrated
+
+    # ---------- 写入 ----------
+    def append(self, record):
+        """追加一条聊天记录并登记索引"""
+        with self._lock:
+            ok = self._append_locked(record)
+        self._save_manifest()
+        return ok
+
+    def _append_locked(self, record):
+        try:
+            data = encode_record(record)
+            name = self._segment_for(record.get("timestamp") or int(time.time() * 1000))
+            committed = self.segments[name]["bytes"]
+            with open(self._segment_path(name), "ab") as f:
+                f.seek(0, os.SEEK_END)
+                if f.tell() > committed:
+                    # 截掉上次崩溃残留的半行
+                    f.truncate(committed)
+                f.write(data)
+            self._register(name, record, committed, len(data))
+            return True
+        except Exception as e:
+            print(f"追加聊天记录失败 {self.log_dir}：{e}")
+            return False
+
+    def update(self, dialog_id, **fields):
+        """更新指定记录的字段，返回更新后的记录
+        只改rating/weight时原地覆盖该行；其他情况追加新版本并改指索引"""
+        with self._lock:
+            record = self.find(dialog_id)
+            if record is None:
+                return None
+            record.update(fields)
+            data = encode_record(record)
+            name, offset, length = self.index[dialog_id]
+            if len(data) == length:
+                with open(self._segment_path(name), "r+b") as f:
+                    f.seek(offset)
+                    f.write(data)
+                return record
+            self._append_locked(record)
+        self._save_manifest()
+        return record
+
+    def segments_before(self, cutoff_ts):
+        """最新记录早于cutoff_ts的分段（可整体归档），不含今天正在写的分段"""
+        today = _day_of(int(time.time() * 1000))
+        return [name for name in sorted(self.segments)
+                if self.segments[name]["day"] != today
+                and self.segments[name]["last_ts"] is not None
+                and self.segments[name]["last_ts"] < cutoff_ts]
+
+    def segments_over_budget(self, max_records=0, max_bytes=0, cutoff_ts=None):
+        """超出条数/字节预算或早于cutoff_ts、应整段淘汰的最旧分段（不含今天正在写的分段）"""
+        today = _day_of(int(time.time() * 1000))
+        names = sorted(self.segments)
+        total_records = sum(self.segments[n]["count"] for n in names)
+        total_bytes = sum(self.segments[n]["bytes"] for n in names)
+        evicted = []
+        for name in names:
+            meta = self.segments[name]
+            if meta["day"] == today:
+                break
+            expired = cutoff_ts is not None and meta["last_ts"] is not None and meta["last_ts"] < cutoff_ts
+            over = (max_records and total_records > max_records) or (max_bytes and total_bytes > max_bytes)
+            if not (expired or over):
+                break
+            evicted.append(name)
+            total_records -= meta["count"]
+            total_bytes -= meta["bytes"]
+        return evicted
+
+    def drop_segment(self, name):
+        """删除一个分段（已归档后调用），同时清理它的索引项"""
+        self.drop_segments([name])
+
+    def drop_segments(self, names):
+        """批量删除分段，索引只重写一次"""
+        names = set(names)
+        with self._lock:
+            names &= set(self.segments)
+            if not names:
+                return
+            for name in names:
+                del self.segments[name]
+                path = self._segment_path(name)
+                if os.path.exists(path):
+                    os.remove(path)
+            self.index = {d: loc for d, loc in self.index.items() if loc[0] not in names}
+            self._rewrite_index()
+        self._save_manifest()
+
+    # ---------- 读取 ----------
+    def iter_segment(self, name):
+        """读取一个分段中的有效记录（跳过被新版本取代的旧行）"""
+        path = self._segment_path(name)
+        if not os.path.exists(path):
+            return
+        with open(path, "rb") as f:
+            offset = 0
+            for line in f:
+                record = _decode(line) if line.strip() else None
+                if record is not None:
+                    location = self.index.get(record.get("dialog_id"))
+                    if location is None or (location[0] == name and location[1] == offset):
+                        yield record
+                offset += len(line)
+
+    def iter_records(self):
+        """按时间顺序流式读取全部聊天记录"""
+        for name in sorted(self.segments):
+            yield from self.iter_segment(name)
+
+    def iter_range(self, start_ts=None, end_ts=None):
+        """读取时间戳在 [start_ts, end_ts] 内的记录，只打开时间范围有交集的分段"""
+        for name in sorted(self.segments):
+            meta = self.segments[name]
+            if meta["first_ts"] is None:
+                continue
+            if start_ts is not None and meta["last_ts"] < start_ts:
+                continue
+            if end_ts is not None and meta["first_ts"] > end_ts:
+                continue
+            for record in self.iter_segment(name):
+                timestamp = record.get("timestamp") or 0
+                if (start_ts is None or timestamp >= start_ts) and (end_ts is None or timestamp <= end_ts):
+                    yield record
+
+    def tail(self, n):
+        """最近n条记录（按时间顺序），从最新的分段往前读，够数即停"""
+        if n <= 0:
+            return []
+        chunks = []
+        total = 0
+        for name in sorted(self.segments, reverse=True):
+            records = list(self.iter_segment(name))
+            chunks.append(records)
+            total += len(records)
+            if total >= n:
+                break
+        result = [record for chunk in reversed(chunks) for record in chunk]
+        return result[-n:]
+
+    def find(self, dialog_id):
+        """按dialog_id查找聊天记录（索引直接定位），找不到返回None"""
+        location = self.index.get(dialog_id)
+        if location is None:
+            return None
+        name, offset, length = location
+        with open(self._segment_path(name), "rb") as f:
+            f.seek(offset)
+            return _decode(f.read(length))
+
+    def stats(self):
+        """分段统计"""
+        return {
+            "segments": len(self.segments),
+            "lines": sum(meta["count"] for meta in self.segments.values()),
+            "bytes": sum(meta["bytes"] for meta in self.segments.values()),
+            "indexed_dialogs": len(self.index)
+        }
+
+
+_shared_chat_log = None
+
+
+def get_chat_log():
+    """获取进程内共享的聊天记录日志"""
+    global _shared_chat_log
+    if _shared_chat_log is None:
+        _shared_chat_log = ChatLog()
+    return _shared_chat_log
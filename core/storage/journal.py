@@ -0,0 +1,273 @@
+"""
+预写日志（WAL）：所有数据变更先追加到 data/journal.wal 并落盘，再真正修改存储
+- 变更按批组提交：调用线程只写入，后台线程合并fsync（断电时最多丢失 SYNC_INTERVAL 秒）
+- 启动时重放日志，把上次崩溃前没来得及写盘的变更补回去（每种操作的重放都是幂等的）
+- 检查点：在锁内把当前日志改名成待清理的旧日志（之后的变更写进新文件），
+  锁外把延迟写入全部落盘后再删除旧日志；检查点期间其他线程照常记录变更，
+  中途崩溃留下的旧日志在下次启动时和新日志一起重放
+有了日志，后台延迟写入可以把合并窗口放得更大而不用担心丢数据
+"""
+import atexit
+import json
+import os
+import threading
+import time
+
+from core.config import JOURNAL_PATH, LEARNED_PATH
+from utils.file_helper import load_json, save_json, iter_jsonl, flush_pending_writes
+
+# 日志超过这么多条时自动做一次检查点
+CHECKPOINT_ENTRIES = 500
+# 组提交间隔（秒）：这段时间内写入的变更由后台线程一次fsync
+SYNC_INTERVAL = 0.2
+
+
+class Journal:
+    """追加写入、按批组提交落盘的变更日志
+    - record 在调用线程（通常是界面线程）只写入并 flush 到操作系统，程序崩溃不会丢失
+    - fsync 由后台线程按 SYNC_INTERVAL 合并执行；只有系统断电/宕机时
+      可能丢失最近 SYNC_INTERVAL 秒内的变更
+    """
+
+    def __init__(self, path=JOURNAL_PATH, sync=True, sync_interval=SYNC_INTERVAL):
+        self.path = path
+        self.sync = sync
+        self.sync_interval = sync_interval
+        self.replaying = False
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._file = None
+        self._unsynced = 0
+        self._sync_thread = None
+        self._checkpointing = False
+        self._entries = sum(1 for _ in iter_jsonl(path))
+        self._seq = self._entries + sum(1 for p in self._rotated_paths() for _ in iter_jsonl(p))
+        self.syncs = 0
+
+    def record(self, op, data):
+        """记录一次变更（在真正修改存储之前调用）；重放期间不重复记录"""
+        if self.replaying:
+            return
+        rotated = None
+        with self._lock:
+            if self._entries >= CHECKPOINT_ENTRIES and not self._checkpointing:
+                rotated = self._rotate_locked()
+            self._seq += 1
+            line = json.dumps({"seq": self._seq, "op": op, "data": data, "ts": time.time()},
+                              ensure_ascii=False)
+            try:
+                if self._file is None:
+                    self._file = open(self.path, "a", encoding="utf-8")
+                self._file.write(line + "\n")
+                self._file.flush()
+                self._entries += 1
+                if self.sync:
+                    self._unsynced += 1
+                    self._ensure_sync_thread()
+                    self._cond.notify()
+            except Exception as e:
+                print(f"写入变更日志失败 {self.path}：{e}")
+        if rotated is not None:
+            self._finish_checkpoint(rotated)
+
+    def flush(self):
+        """把已写入的变更立即落盘（fsync），返回是否成功"""
+        with self._lock:
+            if self._file is None or not self._unsynced:
+                return True
+            # 复制一份文件描述符，在锁外fsync，期间不阻塞 record；检查点关闭文件也不影响
+            fd = os.dup(self._file.fileno())
+            self._unsynced = 0
+        try:
+            os.fsync(fd)
+            self.syncs += 1
+            return True
+        except OSError as e:
+            print(f"变更日志落盘失败 {self.path}：{e}")
+            return False
+        finally:
+            os.close(fd)
+
+    def _ensure_sync_thread(self):
+        if self._sync_thread is None or not self._sync_thread.is_alive():
+            self._sync_thread = threading.Thread(target=self._sync_loop, name="journal-sync", daemon=True)
+            self._sync_thread.start()
+
+    def _sync_loop(self):
+        while True:
+            with self._cond:
+                while not self._unsynced:
+                    self._cond.wait()
+            # 等一个组提交间隔，把这段时间内的写入合并成一次fsync
+            time.sleep(self.sync_interval)
+            self.flush()
+
+    def entries(self):
+        """按顺序读取日志中的全部变更（先是检查点没做完留下的旧日志）"""
+        for path in self._rotated_paths() + [self.path]:
+            yield from iter_jsonl(path)
+
+    def has_entries(self):
+        """是否有可重放的日志文件"""
+        return os.path.exists(self.path) or bool(self._rotated_paths())
+
+    def _rotated_paths(self):
+        """检查点改名出来、还没删除的旧日志（journal.wal.1、journal.wal.2…），按改名顺序"""
+        directory, prefix = os.path.split(self.path)
+        numbered = []
+        for name in os.listdir(directory or "."):
+            suffix = name[len(prefix) + 1:]
+            if name.startswith(prefix + ".") and suffix.isdigit():
+                numbered.append((int(suffix), os.path.join(directory, name)))
+        return [path for _, path in sorted(numbered)]
+
+    def checkpoint(self):
+        """把延迟写入全部落盘，然后清空日志（另一个检查点正在进行时什么都不做）"""
+        with self._lock:
+            if self._checkpointing:
+                return
+            rotated = self._rotate_locked()
+        self._finish_checkpoint(rotated)
+
+    def _rotate_locked(self):
+        """（持有锁）关闭并改名当前日志，之后的变更写进新文件
+        返回改名后的路径，没有日志时返回空字符串；调用方之后必须调用 _finish_checkpoint"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._unsynced = 0
+        self._entries = 0
+        self._checkpointing = True
+        if not os.path.exists(self.path):
+            return ""
+        rotated = self._rotated_paths()
+        number = int(rotated[-1].rsplit(".", 1)[1]) + 1 if rotated else 1
+        rotated_path = f"{self.path}.{number}"
+        os.replace(self.path, rotated_path)
+        return rotated_path
+
+    def _finish_checkpoint(self, rotated_path):
+        """（不持有锁）延迟写入全部落盘后删除改名出来的旧日志（含上次崩溃留下的）
+        检查点进行中不会再改名出新的旧日志，这时存在的都可以删"""
+        try:
+            flush_pending_writes()
+            for path in self._rotated_paths():
+                os.remove(path)
+        except OSError as e:
+            print(f"清理变更日志失败 {self.path}：{e}")
+        finally:
+            with self._lock:
+                self._checkpointing = False
+
+    def replay(self, store):
+        """重放日志中的变更到存储，返回重放的条数"""
+        applied = 0
+        # 各操作查重用的键集合，一次重放内只从存储读一次
+        seen = {}
+        self.replaying = True
+        try:
+            for entry in self.entries():
+                handler = REPLAY_HANDLERS.get(entry.get("op"))
+                if handler is None:
+                    continue
+                try:
+                    handler(store, entry.get("data") or {}, seen)
+                    applied += 1
+                except Exception as e:
+                    print(f"重放变更失败 {entry.get('op')}#{entry.get('seq')}：{e}")
+        finally:
+            self.replaying = False
+        return applied
+
+
+# ---------- 各类操作的幂等重放 ----------
+# 处理函数的参数：(存储, 变更数据, 本次重放共用的查重集合 {名称: set})
+def _replay_chat_append(store, record, seen):
+    if store.get_chat(record.get("dialog_id")) is None:
+        store.append_chat(record)
+
+
+def _replay_chat_update(store, data, seen):
+    store.update_chat(data["dialog_id"], **data.get("fields", {}))
+
+
+def _replay_weight_set(store, data, seen):
+    store.set_weight(data["weight_id"], data["weight"])
+
+
+def _rating_key(record):
+    return record.get("dialog_id"), record.get("timestamp")
+
+
+def _replay_rating_append(store, record, seen):
+    # 已有评分的键只在第一次遇到评分变更时读一遍，之后随重放增量维护
+    if "ratings" not in seen:
+        seen["ratings"] = {_rating_key(r) for r in store.iter_ratings()}
+    key = _rating_key(record)
+    if key not in seen["ratings"]:
+        store.append_rating(record)
+        seen["ratings"].add(key)
+
+
+def _replay_memory_put(store, data, seen):
+    entry = data["entry"]
+    memory_type = data["memory_type"]
+    if memory_type == "timeline":
+        if "timeline" not in seen:
+            seen["timeline"] = {item.get("memory_id") for item in store.load_memories().get("timeline", [])}
+        if entry.get("memory_id") in seen["timeline"]:
+            return
+        seen["timeline"].add(entry.get("memory_id"))
+    elif store.get_memory(entry.get("id")) is not None:
+        return
+    store.put_memory(memory_type, entry)
+
+
+def _replay_learned_add(store, data, seen):
+    learned_data = load_json(LEARNED_PATH, {"new_chat": [], "new_study": {}})
+    if data.get("kind") == "chat":
+        item = data["item"]
+        if any(x.get("dialog_id") == item.get("dialog_id") for x in learned_data.setdefault("new_chat", [])):
+            return
+        learned_data["new_chat"].append(item)
+    else:
+        items = learned_data.setdefault("new_study", {}).setdefault(data["type"], [])
+        if data["content"] in items:
+            return
+        items.append(data["content"])
+    save_json(LEARNED_PATH, learned_data)
+
+
+REPLAY_HANDLERS = {
+    "chat_append": _replay_chat_append,
+    "chat_update": _replay_chat_update,
+    "weight_set": _replay_weight_set,
+    "rating_append": _replay_rating_append,
+    "memory_put": _replay_memory_put,
+    "learned_add": _replay_learned_add,
+}
+
+
+_shared_journal = None
+
+
+def get_journal():
+    """获取进程内共享的变更日志"""
+    global _shared_journal
+    if _shared_journal is None:
+        _shared_journal = Journal()
+        # 退出时把最后一批还没组提交的变更落盘
+        atexit.register(_shared_journal.flush)
+    return _shared_journal
+
+
+def recover(store):
+    """启动时重放上次遗留的日志，并立即做一次检查点"""
+    journal = get_journal()
+    if not journal.has_entries():
+        return 0
+    applied = journal.replay(store)
+    journal.checkpoint()
+    if applied:
+        print(f"✅ 已从变更日志恢复 {applied} 条操作")
+    return applied
@@ -0,0 +1,204 @@
+"""
+数据保留策略：给会无限增长的数据设条数上限、天数上限和字节预算，并清理孤立的权重
+- 聊天记录、评分记录、探索历史（explorations / user_responses）、记忆时间线、对话权重各是一个压缩步骤
+- 每一步只处理超出预算的部分，可以一次跑完，也可以每次跑几步（增量压缩）
+- 每一步返回回收的条数和字节数，汇总成报告
+- 字节预算覆盖每个会增长的文件（聊天分段、评分记录、探索历史、记忆时间线）；
+  超出上限/预算的数据默认先移入冷数据归档（archive_evicted），再从热数据删除
+策略来自设置项 retention，缺省值见 config.RETENTION_DEFAULTS，0 表示不限制
+"""
+import time
+
+from core.config import RETENTION_DEFAULTS, EXPLORATION_HISTORY_PATH, LEARNED_PATH, KNOWLEDGE_PATH
+from utils.file_helper import load_json
+from core.storage.store import encoded_size, oldest_over_budget
+
+
+def load_policy(settings=None):
+    """读取保留策略（设置项 retention 覆盖默认值）"""
+    if settings is None:
+        from core.config import load_settings
+        settings = load_settings()
+    policy = dict(RETENTION_DEFAULTS)
+    policy.update(settings.get("retention") or {})
+    return policy
+
+
+def _cutoff_ms(days):
+    """days天前的毫秒时间戳，days为0表示不按时间淘汰"""
+    if not days or days <= 0:
+        return None
+    return int((time.time() - days * 86400) * 1000)
+
+
+def _empty():
+    return {"records": 0, "bytes": 0}
+
+
+def _exploration_timestamp(entry):
+    # 探索结果的timestamp是秒
+    return int((entry.get("timestamp") or 0) * 1000)
+
+
+def _response_timestamps(explorations):
+    """user_responses 条目的时间戳（毫秒）：值里自带的时间，否则用同一 exploration_id 的探索记录的时间，
+    都没有时为0（不用归档时的当前时间，免得旧回复在归档里显得是新的）"""
+    by_id = {e.get("exploration_id"): _exploration_timestamp(e)
+             for e in (explorations if isinstance(explorations, list) else ()) if isinstance(e, dict)}
+
+    def timestamp_of(record):
+        value = record["value"]
+        if isinstance(value, dict) and value.get("timestamp"):
+            return _exploration_timestamp(value)
+        return by_id.get(record["key"], 0)
+    return timestamp_of
+
+
+def trim_exploration_history(history, policy, archive=None):
+    """按策略就地裁剪探索历史，返回回收统计；给了archive时淘汰的记录先归档"""
+    reclaimed = _empty()
+
+    explorations = history.get("explorations")
+    if isinstance(explorations, list):
+        cutoff = _cutoff_ms(policy.get("exploration_max_days"))
+        kept = [e for e in explorations
+                if cutoff is None or _exploration_timestamp(e) >= cutoff]
+        kept = kept[oldest_over_budget(kept, policy.get("exploration_max_records"),
+                                       policy.get("exploration_max_bytes")):]
+        if len(kept) < len(explorations):
+            kept_ids = {id(e) for e in kept}
+            removed = [e for e in explorations if id(e) not in kept_ids]
+            if archive is not None:
+                archive.write_segment("explorations", removed, "exploration_id", _exploration_timestamp)
+            history["explorations"] = kept
+            reclaimed["records"] += len(removed)
+            reclaimed["bytes"] += encoded_size(removed)
+
+    responses = history.get("user_responses")
+    max_responses = policy.get("user_responses_max_records")
+    if isinstance(responses, dict) and max_responses and len(responses) > max_responses:
+        # 字典保持插入顺序，保留最近写入的
+        keys = list(responses)
+        removed = [(k, responses[k]) for k in keys[:-max_responses]]
+        if archive is not None:
+            # explorations 仍是裁剪前的列表，已淘汰的探索记录也能查到时间
+            archive.write_segment("user_responses", [{"key": k, "value": v} for k, v in removed], "key",
+                                  _response_timestamps(explorations))
+        history["user_responses"] = {k: responses[k] for k in keys[-max_responses:]}
+        reclaimed["records"] += len(removed)
+        reclaimed["bytes"] += encoded_size(removed)
+
+    return reclaimed
+
+
+class RetentionManager:
+    """按步骤执行的增量数据压缩"""
+
+    STEPS = ("chat", "ratings", "explorations", "timeline", "weights")
+
+    def __init__(self, store, policy=None, archive=None, knowledge=None, steps=None):
+        self.store = store
+        self.policy = policy or load_policy()
+        self.archive = archive
+        self.knowledge = knowledge  # 已加载的知识库（dict或知识包），不给时读 knowledge.json
+        self.steps = tuple(steps) if steps is not None else self.STEPS  # 要执行的步骤（STEPS的子集）
+        self._cursor = 0
+
+    def run_step(self):
+        """执行下一个压缩步骤，返回 (步骤名, 回收统计)"""
+        name = self.steps[self._cursor % len(self.steps)]
+        self._cursor += 1
+        try:
+            return name, getattr(self, f"_compact_{name}")()
+        except Exception as e:
+            print(f"数据压缩步骤 {name} 失败：{e}")
+            return name, _empty()
+
+    def run(self, max_steps=None):
+        """执行若干步（默认一轮全部步骤），返回报告 {步骤名: 回收统计, "total": 合计}"""
+        steps = len(self.steps) if max_steps is None else max_steps
+        report = {}
+        total = _empty()
+        for _ in range(steps):
+            name, reclaimed = self.run_step()
+            report[name] = reclaimed
+            total["records"] += reclaimed["records"]
+            total["bytes"] += reclaimed["bytes"]
+        report["total"] = total
+        return report
+
+    # ---------- 各压缩步骤 ----------
+    def _evicted_archive(self):
+        """淘汰的数据要移入的归档，策略关闭归档时返回None（直接删除）"""
+        return self.archive if self.policy.get("archive_evicted") else None
+
+    def _compact_chat(self):
+        return self.store.evict_chats(
+            self.policy.get("chat_max_records", 0),
+            self.policy.get("chat_max_bytes", 0),
+            _cutoff_ms(self.policy.get("chat_max_days")),
+            archive=self._evicted_archive()
+        )
+
+    def _compact_ratings(self):
+        return self.store.trim_ratings(
+            self.policy.get("rating_max_records", 0),
+            _cutoff_ms(self.policy.get("rating_max_days")),
+            self.policy.get("rating_max_bytes", 0),
+            archive=self._evicted_archive()
+        )
+
+    def _compact_explorations(self):
+        history = self.store.load_document(EXPLORATION_HISTORY_PATH, None)
+        if not isinstance(history, dict):
+            return _empty()
+        reclaimed = trim_exploration_history(history, self.policy, self._evicted_archive())
+        if reclaimed["records"]:
+            self.store.save_document(EXPLORATION_HISTORY_PATH, history)
+        return reclaimed
+
+    def _compact_timeline(self):
+        return self.store.trim_timeline(
+            self.policy.get("timeline_max_records", 0),
+            self.policy.get("timeline_max_bytes", 0),
+            archive=self._evicted_archive()
+        )
+
+    def _compact_weights(self):
+        """删除既不属于学习内容/知识点、也不属于任何（热或已归档）聊天记录的权重"""
+        if not self.policy.get("gc_orphan_weights"):
+            return _empty()
+        from core.knowledge.weight_manager import study_weight_id
+        from core.knowledge.study_pages import is_lazy_study
+        knowledge = self.knowledge if self.knowledge is not None else load_json(KNOWLEDGE_PATH, {})
+        # 知识包/分页的知识点权重ID直接在它们的权重ID表上查，不展开全部知识点
+        pack = knowledge.get("study") if is_lazy_study(knowledge.get("study")) else None
+        # 先取权重再取存活ID：评分总在聊天记录写入之后，取到的每个权重对应的记录都在下面的ID里
+        # （压缩在后台线程执行时，期间新写入的权重不会被误当作孤立权重）
+        weight_ids = list(self.store.load_weights())
+        learned = load_json(LEARNED_PATH, {"new_chat": [], "new_study": {}})
+        live_ids = {item.get("dialog_id") for item in learned.get("new_chat", []) if isinstance(item, dict)}
+        studies = (learned.get("new_study", {}),) if pack is not None else (knowledge.get("study", {}), learned.get("new_study", {}))
+        for study in studies:
+            for study_type, items in study.items():
+                live_ids.update(study_weight_id(study_type, item) for item in items)
+        live_ids |= self.store.chat_ids()
+        if self.archive is not None:
+            live_ids |= self.archive.ids("chat")
+        live_ids.discard(None)
+        if not live_ids and pack is None:
+            # 学习内容和聊天记录都读不到时不做清理，避免误删全部权重
+            return _empty()
+        orphans = [weight_id for weight_id in weight_ids
+                   if weight_id not in live_ids and not (pack is not None and pack.has_weight_id(weight_id))]
+        return self.store.delete_weights(orphans)
+
+
+def compact_data(store, max_steps=None, knowledge=None, steps=None):
+    """按保留策略压缩数据，返回回收报告；steps 指定只执行其中几个步骤"""
+    from core.storage.archive import get_archive
+    report = RetentionManager(store, archive=get_archive(), knowledge=knowledge, steps=steps).run(max_steps)
+    total = report["total"]
+    if total["records"]:
+        print(f"✅ 数据压缩完成：回收 {total['records']} 条记录，约 {total['bytes'] / 1024:.1f} KB")
+    return report
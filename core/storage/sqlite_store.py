@@ -0,0 +1,456 @@
+"""
+SQLite存储后端：基于标准库 sqlite3（WAL模式），聊天记录、评分、权重和记忆按记录读写
+"""
+import json
+import os
+import sqlite3
+import threading
+
+from core.config import (
+    DATA_DIR,
+    STORAGE_DB_PATH,
+    RATING_RECORD_PATH,
+    DIALOG_WEIGHTS_PATH,
+    EXPLORATION_MEMORY_PATH,
+)
+from utils.file_helper import save_json
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS chat_records (
+    dialog_id TEXT PRIMARY KEY,
+    user_input TEXT,
+    pet_reply TEXT,
+    related_dialog_id TEXT,
+    timestamp INTEGER,
+    rating INTEGER,
+    weight REAL
+);
+CREATE INDEX IF NOT EXISTS idx_chat_timestamp ON chat_records(timestamp);
+CREATE INDEX IF NOT EXISTS idx_chat_related ON chat_records(related_dialog_id);
+
+CREATE TABLE IF NOT EXISTS ratings (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    dialog_id TEXT,
+    related_dialog_id TEXT,
+    weight_id TEXT,
+    rating INTEGER,
+    timestamp INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_ratings_dialog ON ratings(dialog_id);
+CREATE INDEX IF NOT EXISTS idx_ratings_timestamp ON ratings(timestamp);
+
+CREATE TABLE IF NOT EXISTS dialog_weights (
+    weight_id TEXT PRIMARY KEY,
+    weight REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS memories (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT UNIQUE,
+    type TEXT NOT NULL,
+    timestamp TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_memories_type ON memories(type);
+
+CREATE TABLE IF NOT EXISTS documents (
+    name TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+"""
+
+CHAT_COLUMNS = ("dialog_id", "user_input", "pet_reply", "related_dialog_id",
+                "timestamp", "rating", "weight")
+RATING_COLUMNS = ("dialog_id", "related_dialog_id", "weight_id", "rating", "timestamp")
+
+# 遍历查询结果时每批从游标取的行数
+ITER_BATCH_ROWS = 500
+
+
+def row_size_sql(columns):
+    """估算一行按JSON序列化后字节数的SQL表达式（与 store.encoded_size 对同一行的结果基本一致）
+    每个字段值：文本按UTF-8字节数加两个引号，NULL为null，数字按文本长度；
+    每个键加引号、冒号空格和逗号空格，再加一对大括号和换行"""
+    values = " + ".join(
+        f"(CASE WHEN {c} IS NULL THEN 4 WHEN typeof({c}) = 'text' "
+        f"THEN length(CAST({c} AS BLOB)) + 2 ELSE length({c}) END)"
+        for c in columns
+    )
+    return f"{values} + {sum(len(c) + 6 for c in columns) + 1}"
+
+
+class SQLiteStore:
+    """基于SQLite的存储后端，接口与 JsonStore 一致"""
+
+    name = "sqlite"
+
+    def __init__(self, db_path=STORAGE_DB_PATH):
+        from utils.file_helper import init_data_dir
+        init_data_dir()
+
+        self.db_path = db_path
+        is_new = not os.path.exists(db_path)
+
+        # 后台线程（写入、重建索引）也会访问，统一用锁串行化
+        self._lock = threading.RLock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self.conn.commit()
+
+        if is_new:
+            self.import_json()
+
+    def close(self):
+        """关闭数据库连接"""
+        with self._lock:
+            self.conn.close()
+
+    # ---------- 聊天记录 ----------
+    def append_chat(self, record):
+        """追加一条聊天记录"""
+        with self._lock, self.conn:
+            self.conn.execute(
+                f"INSERT OR REPLACE INTO chat_records ({', '.join(CHAT_COLUMNS)}) "
+                f"VALUES ({', '.join('?' * len(CHAT_COLUMNS))})",
+                tuple(record.get(c) for c in CHAT_COLUMNS)
+            )
+        return True
+
+    def get_chat(self, dialog_id):
+        """按dialog_id获取聊天记录（热数据找不到时查归档），找不到返回None"""
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT * FROM chat_records WHERE dialog_id = ?", (dialog_id,)
+            ).fetchone()
+        if row:
+            return dict(row)
+        from core.storage.archive import get_archive
+        return get_archive().find("chat", dialog_id, "dialog_id")
+
+    def update_chat(self, dialog_id, **fields):
+        """更新聊天记录的字段，返回更新后的记录"""
+        fields = {k: v for k, v in fields.items() if k in CHAT_COLUMNS and k != "dialog_id"}
+        if fields:
+            assignments = ", ".join(f"{k} = ?" for k in fields)
+            with self._lock, self.conn:
+                self.conn.execute(
+                    f"UPDATE chat_records SET {assignments} WHERE dialog_id = ?",
+                    (*fields.values(), dialog_id)
+                )
+        return self.get_chat(dialog_id)
+
+    def _iter_rows(self, sql, params=()):
+        """逐批从游标读取查询结果，不把整张表一次读进内存；每批单独加锁，遍历期间不阻塞其他线程"""
+        with self._lock:
+            cursor = self.conn.execute(sql, params)
+        try:
+            while True:
+                with self._lock:
+                    rows = cursor.fetchmany(ITER_BATCH_ROWS)
+                if not rows:
+                    return
+                for row in rows:
+                    yield dict(row)
+        finally:
+            with self._lock:
+                cursor.close()
+
+    def iter_chats(self):
+        """按时间顺序读取聊天记录"""
+        return self._iter_rows("SELECT * FROM chat_records ORDER BY timestamp, rowid")
+
+    def iter_chats_between(self, start_ts=None, end_ts=None):
+        """读取时间戳（毫秒）在 [start_ts, end_ts] 内的聊天记录（走timestamp索引）"""
+        start_ts = float("-inf") if start_ts is None else start_ts
+        end_ts = float("inf") if end_ts is None else end_ts
+        return self._iter_rows(
+            "SELECT * FROM chat_records WHERE timestamp BETWEEN ? AND ? ORDER BY timestamp, rowid",
+            (start_ts, end_ts)
+        )
+
+    def tail_chats(self, n):
+        """最近n条聊天记录（按时间顺序）"""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT * FROM chat_records ORDER BY timestamp DESC, rowid DESC LIMIT ?", (n,)
+            ).fetchall()
+        return [dict(row) for row in reversed(rows)]
+
+    def chat_ids(self):
+        """全部热聊天记录的dialog_id"""
+        with self._lock:
+            rows = self.conn.execute("SELECT dialog_id FROM chat_records").fetchall()
+        return {row["dialog_id"] for row in rows}
+
+    def _evict_rows(self, table, key, rows):
+        """按主键删除一批行，返回回收的条数和（序列化后的）字节数"""
+        from core.storage.store import encoded_size
+        if not rows:
+            return {"records": 0, "bytes": 0}
+        with self._lock, self.conn:
+            self.conn.executemany(f"DELETE FROM {table} WHERE {key} = ?", [(row[key],) for row in rows])
+        return {"records": len(rows), "bytes": encoded_size(dict(row) for row in rows)}
+
+    def _oldest_rows(self, table, order, max_records=0, max_bytes=0, cutoff_ts=None, where="1"):
+        """表中按order排序最旧、早于cutoff_ts或超出条数/字节预算的行
+        先在SQL里汇总这张表剩余行的字节数，没超过字节预算时不用逐行计算大小，只按条数取"""
+        from core.storage.store import oldest_over_budget
+        rows = []
+        with self._lock:
+            columns = [info["name"] for info in self.conn.execute(f"PRAGMA table_info({table})")]
+            if cutoff_ts is not None:
+                rows = self.conn.execute(
+                    f"SELECT * FROM {table} WHERE {where} AND COALESCE(timestamp, 0) < ? ORDER BY {order}",
+                    (cutoff_ts,)
+                ).fetchall()
+            since = cutoff_ts if cutoff_ts is not None else float("-inf")
+            total = self.conn.execute(f"SELECT COUNT(*) FROM {table} WHERE {where}").fetchone()[0] - len(rows)
+            size = self.conn.execute(
+                f"SELECT COALESCE(SUM({row_size_sql(columns)}), 0) FROM {table} "
+                f"WHERE {where} AND COALESCE(timestamp, 0) >= ?",
+                (since,)
+            ).fetchone()[0] if max_bytes else 0
+            if max_bytes and size > max_bytes:
+                rest = self.conn.execute(
+                    f"SELECT * FROM {table} WHERE {where} AND COALESCE(timestamp, 0) >= ? ORDER BY {order}",
+                    (since,)
+                ).fetchall()
+                rows += rest[:oldest_over_budget([dict(row) for row in rest], max_records, max_bytes)]
+            elif max_records and total > max_records:
+                rows += self.conn.execute(
+                    f"SELECT * FROM {table} WHERE {where} AND COALESCE(timestamp, 0) >= ? ORDER BY {order} LIMIT ?",
+                    (since, total - max_records)
+                ).fetchall()
+        return rows
+
+    def evict_chats(self, max_records=0, max_bytes=0, cutoff_ts=None, archive=None):
+        """按条数/字节预算和时间淘汰最旧的聊天记录（给了archive时先归档）"""
+        from core.storage.store import chat_timestamp
+        rows = self._oldest_rows("chat_records", "timestamp, rowid", max_records, max_bytes, cutoff_ts)
+        if archive is not None and rows:
+            archive.write_segment("chat", [dict(row) for row in rows], "dialog_id", chat_timestamp)
+        return self._evict_rows("chat_records", "dialog_id", rows)
+
+    # ---------- 评分记录 ----------
+    def append_rating(self, record):
+        """追加一条评分记录"""
+        with self._lock, self.conn:
+            self.conn.execute(
+                f"INSERT INTO ratings ({', '.join(RATING_COLUMNS)}) "
+                f"VALUES ({', '.join('?' * len(RATING_COLUMNS))})",
+                tuple(record.get(c) for c in RATING_COLUMNS)
+            )
+        return True
+
+    def iter_ratings(self):
+        """按写入顺序读取评分记录"""
+        return self._iter_rows(f"SELECT {', '.join(RATING_COLUMNS)} FROM ratings ORDER BY seq")
+
+    def trim_ratings(self, max_records=0, cutoff_ts=None, max_bytes=0, archive=None):
+        """删除早于cutoff_ts（毫秒）和超出条数/字节预算的最旧评分记录（给了archive时先归档）"""
+        from core.storage.store import chat_timestamp
+        rows = self._oldest_rows("ratings", "seq", max_records, max_bytes, cutoff_ts)
+        if archive is not None and rows:
+            archive.write_segment("ratings", [{c: row[c] for c in RATING_COLUMNS} for row in rows],
+                                  "dialog_id", chat_timestamp)
+        return self._evict_rows("ratings", "seq", rows)
+
+    # ---------- 对话权重 ----------
+    def load_weights(self):
+        """读取全部对话权重 {weight_id: weight}"""
+        with self._lock:
+            rows = self.conn.execute("SELECT weight_id, weight FROM dialog_weights").fetchall()
+        return {row["weight_id"]: row["weight"] for row in rows}
+
+    def get_weight(self, weight_id, default=None):
+        """读取单个权重"""
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT weight FROM dialog_weights WHERE weight_id = ?", (weight_id,)
+            ).fetchone()
+        return row["weight"] if row else default
+
+    def set_weight(self, weight_id, weight):
+        """写入单个权重"""
+        with self._lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO dialog_weights (weight_id, weight) VALUES (?, ?)",
+                (weight_id, weight)
+            )
+        return True
+
+    def delete_weights(self, weight_ids):
+        """删除一批权重"""
+        weight_ids = set(weight_ids)
+        with self._lock:
+            rows = [row for row in self.conn.execute("SELECT weight_id, weight FROM dialog_weights").fetchall()
+                    if row["weight_id"] in weight_ids]
+        return self._evict_rows("dialog_weights", "weight_id", rows)
+
+    # ---------- 记忆 ----------
+    def load_memories(self):
+        """读取全部记忆（按类型分组，含timeline）"""
+        from core.storage.store import default_memories
+        memories = default_memories()
+        with self._lock:
+            rows = self.conn.execute("SELECT type, data FROM memories ORDER BY seq").fetchall()
+        for row in rows:
+            memories.setdefault(row["type"], []).append(json.loads(row["data"]))
+        return memories
+
+    def put_memory(self, memory_type, entry):
+        """新增一条记忆（timeline条目没有id，按插入顺序保存）"""
+        with self._lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO memories (id, type, timestamp, data) VALUES (?, ?, ?, ?)",
+                (entry.get("id"), memory_type, entry.get("timestamp"),
+                 json.dumps(entry, ensure_ascii=False))
+            )
+        return True
+
+    def get_memory(self, memory_id):
+        """按id获取记忆（热数据找不到时查归档）"""
+        with self._lock:
+            row = self.conn.execute("SELECT data FROM memories WHERE id = ?", (memory_id,)).fetchone()
+        if row:
+            return json.loads(row["data"])
+        from core.storage.archive import get_archive
+        return get_archive().find("memories", memory_id)
+
+    def update_memories(self, entries):
+        """按id覆盖已存在的记忆（如访问计数变化）"""
+        rows = [(json.dumps(entry, ensure_ascii=False), entry["id"])
+                for entry in entries if entry.get("id")]
+        if rows:
+            with self._lock, self.conn:
+                self.conn.executemany("UPDATE memories SET data = ? WHERE id = ?", rows)
+        return True
+
+    def trim_timeline(self, max_records=0, max_bytes=0, archive=None):
+        """只保留条数/字节预算内最近的记忆时间线（给了archive时淘汰的部分先归档）"""
+        from core.storage.store import memory_timestamp
+        rows = self._oldest_rows("memories", "seq", max_records, max_bytes, where="type = 'timeline'")
+        if archive is not None and rows:
+            archive.write_segment("timeline", [json.loads(row["data"]) for row in rows], "memory_id",
+                                  memory_timestamp)
+        return self._evict_rows("memories", "seq", rows)
+
+    # ---------- 冷数据归档 ----------
+    def archive_before(self, archive, cutoff_ts):
+        """把cutoff_ts（毫秒）之前的聊天记录、评分和记忆移入归档"""
+        from core.storage.store import memory_timestamp
+        moved = {"chat": 0, "ratings": 0, "memories": 0}
+
+        old_chats = list(self.iter_chats_between(None, cutoff_ts - 1))
+        if old_chats:
+            archive.write_segment("chat", old_chats, "dialog_id", lambda r: r.get("timestamp") or 0)
+            with self._lock, self.conn:
+                self.conn.execute("DELETE FROM chat_records WHERE timestamp < ?", (cutoff_ts,))
+            moved["chat"] = len(old_chats)
+
+        with self._lock:
+            old_ratings = [dict(row) for row in self.conn.execute(
+                f"SELECT {', '.join(RATING_COLUMNS)} FROM ratings WHERE timestamp < ? ORDER BY seq",
+                (cutoff_ts,)
+            ).fetchall()]
+        if old_ratings:
+            archive.write_segment("ratings", old_ratings, "dialog_id", lambda r: r.get("timestamp") or 0)
+            with self._lock, self.conn:
+                self.conn.execute("DELETE FROM ratings WHERE timestamp < ?", (cutoff_ts,))
+            moved["ratings"] = len(old_ratings)
+
+        with self._lock:
+            rows = self.conn.execute("SELECT seq, type, data FROM memories").fetchall()
+        expired = {}
+        for row in rows:
+            entry = json.loads(row["data"])
+            if memory_timestamp(entry) < cutoff_ts:
+                expired.setdefault(row["type"], []).append((row["seq"], entry))
+        if expired:
+            seqs = [(seq,) for items in expired.values() for seq, _ in items]
+            timeline = [entry for _, entry in expired.pop("timeline", [])]
+            memories = [entry for items in expired.values() for _, entry in items]
+            archive.write_segment("memories", memories, "id", memory_timestamp)
+            archive.write_segment("timeline", timeline, "memory_id", memory_timestamp)
+            with self._lock, self.conn:
+                self.conn.executemany("DELETE FROM memories WHERE seq = ?", seqs)
+            moved["memories"] = len(memories)
+
+        return moved
+
+    # ---------- 整文档数据 ----------
+    def load_document(self, file_path, default=None):
+        """读取整文档数据（按文件名存放在 documents 表）"""
+        if default is None:
+            default = {}
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT data FROM documents WHERE name = ?", (os.path.basename(file_path),)
+            ).fetchone()
+        return json.loads(row["data"]) if row else default
+
+    def save_document(self, file_path, data):
+        """保存整文档数据"""
+        with self._lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO documents (name, data) VALUES (?, ?)",
+                (os.path.basename(file_path), json.dumps(data, ensure_ascii=False))
+            )
+        return True
+
+    # ---------- JSON导入/导出 ----------
+    def import_json(self):
+        """首次创建数据库时，从现有JSON存储导入全部数据"""
+        from core.config import EXPLORATION_HISTORY_PATH, USER_INTERESTS_PATH
+        from core.storage.store import JsonStore
+        json_store = JsonStore()
+
+        with self._lock, self.conn:
+            self.conn.executemany(
+                f"INSERT OR REPLACE INTO chat_records ({', '.join(CHAT_COLUMNS)}) "
+                f"VALUES ({', '.join('?' * len(CHAT_COLUMNS))})",
+                (tuple(r.get(c) for c in CHAT_COLUMNS) for r in json_store.iter_chats())
+            )
+            self.conn.executemany(
+                f"INSERT INTO ratings ({', '.join(RATING_COLUMNS)}) "
+                f"VALUES ({', '.join('?' * len(RATING_COLUMNS))})",
+                (tuple(r.get(c) for c in RATING_COLUMNS) for r in json_store.iter_ratings())
+            )
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO dialog_weights (weight_id, weight) VALUES (?, ?)",
+                json_store.load_weights().items()
+            )
+
+        for memory_type, items in json_store.load_memories().items():
+            if isinstance(items, list):
+                for entry in items:
+                    if isinstance(entry, dict):
+                        self.put_memory(memory_type, entry)
+
+        for path in (EXPLORATION_HISTORY_PATH, USER_INTERESTS_PATH):
+            data = json_store.load_document(path, None)
+            if data is not None:
+                self.save_document(path, data)
+
+        print(f"✅ 已从JSON文件导入数据到 {self.db_path}")
+
+    def export_json(self, target_dir=None):
+        """把数据库内容导出为原有格式的JSON文件，默认导出到 data/export/"""
+        from core.config import EXPLORATION_HISTORY_PATH, USER_INTERESTS_PATH
+
+        target_dir = target_dir or os.path.join(DATA_DIR, "export")
+        os.makedirs(target_dir, exist_ok=True)
+
+        def target(path):
+            return os.path.join(target_dir, os.path.basename(path))
+
+        save_json(os.path.join(target_dir, "chat_history.json"), list(self.iter_chats()))
+        save_json(target(RATING_RECORD_PATH), list(self.iter_ratings()))
+        save_json(target(DIALOG_WEIGHTS_PATH), self.load_weights())
+        save_json(target(EXPLORATION_MEMORY_PATH), self.load_memories())
+        for path in (EXPLORATION_HISTORY_PATH, USER_INTERESTS_PATH):
+            save_json(target(path), self.load_document(path))
+        return target_dir
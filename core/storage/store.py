@@ -0,0 +1,454 @@
+"""
+存储后端：统一的记录级读写接口
+- JsonStore：默认后端，沿用 data/ 下的JSON文件和聊天记录JSONL日志；
+  评分、权重、记忆的变更只追加一行增量日志，日志过长或启动时才合并重写主文件；
+  整文档写入走后台延迟合并写入（save_json_deferred），不阻塞界面线程
+- SQLiteStore：可选后端（设置项 storage_backend = "sqlite"），见 sqlite_store.py
+"""
+import json
+import os
+import threading
+from datetime import datetime
+
+from core.config import (
+    RATING_RECORD_PATH,
+    RATING_RECORD_LOG_PATH,
+    DIALOG_WEIGHTS_PATH,
+    DIALOG_WEIGHTS_LOG_PATH,
+    EXPLORATION_MEMORY_PATH,
+    EXPLORATION_MEMORY_LOG_PATH,
+)
+from utils.file_helper import (
+    load_json, save_json, save_json_deferred, append_jsonl, iter_jsonl
+)
+from core.storage.chat_log import get_chat_log
+from core.storage.journal import get_journal, recover
+
+# 权重增量日志超过这么多行时合并回 dialog_weights.json
+WEIGHT_LOG_COMPACT_LINES = 1000
+# 评分、记忆增量日志超过这么多行时合并回主文件
+RECORD_LOG_COMPACT_LINES = 1000
+
+
+def memory_timestamp(entry):
+    """记忆的活跃时间（毫秒）：最近访问时间，没有则用创建时间"""
+    value = entry.get("last_accessed") or entry.get("timestamp")
+    try:
+        return int(datetime.fromisoformat(value).timestamp() * 1000)
+    except (TypeError, ValueError):
+        return 0
+
+
+def split_memories(memories, cutoff_ts):
+    """把记忆文档按活跃时间拆成 (保留的文档, {类型: 过期条目})"""
+    kept, expired = {}, {}
+    for memory_type, items in memories.items():
+        if not isinstance(items, list):
+            kept[memory_type] = items
+            continue
+        kept[memory_type] = []
+        for item in items:
+            if isinstance(item, dict) and memory_timestamp(item) < cutoff_ts:
+                expired.setdefault(memory_type, []).append(item)
+            else:
+                kept[memory_type].append(item)
+    return kept, expired
+
+
+def encoded_size(items):
+    """记录序列化后的大致字节数（用于统计保留策略回收了多少空间）"""
+    return sum(len(json.dumps(item, ensure_ascii=False).encode("utf-8")) + 1 for item in items)
+
+
+def oldest_over_budget(records, max_records=0, max_bytes=0):
+    """按时间顺序排列的记录中，要满足条数/字节预算需要淘汰的最旧记录条数"""
+    if not records or not (max_records or max_bytes):
+        return 0
+    sizes = [encoded_size([record]) for record in records]
+    total_records, total_bytes = len(records), sum(sizes)
+    evicted = 0
+    while evicted < len(records) and ((max_records and total_records > max_records)
+                                      or (max_bytes and total_bytes > max_bytes)):
+        total_records -= 1
+        total_bytes -= sizes[evicted]
+        evicted += 1
+    return evicted
+
+
+def chat_timestamp(record):
+    """聊天/评分记录的时间戳（毫秒），没有时为0"""
+    return record.get("timestamp") or 0
+
+
+def rating_key(record):
+    """评分记录的标识：同一对话同一时刻只有一条评分"""
+    return record.get("dialog_id"), record.get("timestamp")
+
+
+def merge_ratings(ratings, deltas):
+    """把评分增量日志接到主文件的评分后面；已在主文件里的（合并到一半崩溃时）跳过"""
+    keys = None
+    for record in deltas:
+        if keys is None:
+            keys = {rating_key(r) for r in ratings}
+        if rating_key(record) not in keys:
+            keys.add(rating_key(record))
+            ratings.append(record)
+    return ratings
+
+
+def memory_key(memory_type, entry):
+    """记忆条目的标识：timeline条目用memory_id，其他类型用id"""
+    return entry.get("memory_id") if memory_type == "timeline" else entry.get("id")
+
+
+def apply_memory_deltas(memories, deltas):
+    """把记忆增量日志（put 新增 / update 按id覆盖）应用到记忆文档上
+    重复应用同一段日志（合并到一半崩溃时）不会产生重复记忆"""
+    keys, positions = {}, None
+    for delta in deltas:
+        if delta.get("op") == "put":
+            memory_type, entry = delta.get("memory_type"), delta.get("entry") or {}
+            items = memories.setdefault(memory_type, [])
+            if memory_type not in keys:
+                keys[memory_type] = {memory_key(memory_type, item) for item in items if isinstance(item, dict)}
+            key = memory_key(memory_type, entry)
+            if key is not None and key in keys[memory_type]:
+                continue
+            keys[memory_type].add(key)
+            items.append(entry)
+            if positions is not None and entry.get("id"):
+                positions[entry["id"]] = (memory_type, len(items) - 1)
+        elif delta.get("op") == "update":
+            if positions is None:
+                positions = {item["id"]: (memory_type, i)
+                             for memory_type, items in memories.items() if isinstance(items, list)
+                             for i, item in enumerate(items) if isinstance(item, dict) and item.get("id")}
+            for entry in delta.get("entries") or []:
+                if entry.get("id") in positions:
+                    memory_type, i = positions[entry["id"]]
+                    memories[memory_type][i] = entry
+    return memories
+
+
+def default_memories():
+    """记忆文件的默认结构"""
+    return {
+        "facts": [],
+        "preferences": [],
+        "conversations": [],
+        "discoveries": [],
+        "timeline": []
+    }
+
+
+class JsonStore:
+    """基于JSON文件的存储后端"""
+
+    name = "json"
+
+    def __init__(self):
+        from utils.file_helper import init_data_dir
+        init_data_dir()
+
+        self.chat_log = get_chat_log()
+
+        # 评分、权重、记忆文件的读改写串行化（冷数据归档和保留策略压缩在后台线程执行）
+        self._lock = threading.RLock()
+
+        # 变更先写预写日志，延迟写入期间崩溃也能在下次启动时恢复
+        self.journal = get_journal()
+
+        # 启动时把上次运行留下的权重、评分、记忆增量合并进主文件
+        self.compact_weights()
+        self.compact_ratings()
+        self.compact_memories()
+
+    # ---------- 聊天记录 ----------
+    def append_chat(self, record):
+        """追加一条聊天记录"""
+        self.journal.record("chat_append", record)
+        return self.chat_log.append(record)
+
+    def get_chat(self, dialog_id):
+        """按dialog_id获取聊天记录（热数据找不到时查归档），找不到返回None"""
+        record = self.chat_log.find(dialog_id)
+        if record is None:
+            from core.storage.archive import get_archive
+            record = get_archive().find("chat", dialog_id, "dialog_id")
+        return record
+
+    def update_chat(self, dialog_id, **fields):
+        """更新聊天记录的字段，返回更新后的记录"""
+        self.journal.record("chat_update", {"dialog_id": dialog_id, "fields": fields})
+        return self.chat_log.update(dialog_id, **fields)
+
+    def iter_chats(self):
+        """按时间顺序流式读取聊天记录"""
+        return self.chat_log.iter_records()
+
+    def iter_chats_between(self, start_ts=None, end_ts=None):
+        """读取时间戳（毫秒）在 [start_ts, end_ts] 内的聊天记录"""
+        return self.chat_log.iter_range(start_ts, end_ts)
+
+    def tail_chats(self, n):
+        """最近n条聊天记录（按时间顺序）"""
+        return self.chat_log.tail(n)
+
+    def chat_ids(self):
+        """全部热聊天记录的dialog_id"""
+        return set(self.chat_log.index)
+
+    def evict_chats(self, max_records=0, max_bytes=0, cutoff_ts=None, archive=None):
+        """按条数/字节预算和时间淘汰最旧的聊天记录（整段移除），返回回收的条数和字节数
+        给了archive时分段先压缩归档再删除"""
+        names = self.chat_log.segments_over_budget(max_records, max_bytes, cutoff_ts)
+        reclaimed = {
+            "records": sum(self.chat_log.segments[n]["count"] for n in names),
+            "bytes": sum(self.chat_log.segments[n]["bytes"] for n in names)
+        }
+        if archive is not None:
+            for name in names:
+                archive.write_segment("chat", list(self.chat_log.iter_segment(name)), "dialog_id", chat_timestamp)
+        self.chat_log.drop_segments(names)
+        return reclaimed
+
+    # ---------- 评分记录 ----------
+    def append_rating(self, record):
+        """追加一条评分记录：只追加一行增量，不重写整个评分文件"""
+        with self._lock:
+            self.journal.record("rating_append", record)
+            ok = append_jsonl(RATING_RECORD_LOG_PATH, record)
+            self._rating_log_lines += 1
+            if self._rating_log_lines >= RECORD_LOG_COMPACT_LINES:
+                self.compact_ratings()
+            return ok
+
+    def _load_ratings(self):
+        """全部评分记录（主文件 + 增量日志），按写入顺序"""
+        with self._lock:
+            return merge_ratings(load_json(RATING_RECORD_PATH, []), iter_jsonl(RATING_RECORD_LOG_PATH))
+
+    def iter_ratings(self):
+        """读取全部评分记录"""
+        return iter(self._load_ratings())
+
+    def _save_ratings(self, ratings):
+        """重写评分主文件（已合并增量日志）并清空日志"""
+        with self._lock:
+            self._rating_log_lines = 0
+            if not save_json(RATING_RECORD_PATH, ratings):
+                return False
+            if os.path.exists(RATING_RECORD_LOG_PATH):
+                os.remove(RATING_RECORD_LOG_PATH)
+            return True
+
+    def compact_ratings(self):
+        """把评分增量日志合并进 rating_record.json 并清空日志"""
+        with self._lock:
+            self._rating_log_lines = 0
+            if not os.path.exists(RATING_RECORD_LOG_PATH):
+                return True
+            return self._save_ratings(self._load_ratings())
+
+    def trim_ratings(self, max_records=0, cutoff_ts=None, max_bytes=0, archive=None):
+        """删除早于cutoff_ts（毫秒）和超出条数/字节预算的最旧评分记录（给了archive时先归档）"""
+        with self._lock:
+            ratings = self._load_ratings()
+            kept = [r for r in ratings if cutoff_ts is None or (r.get("timestamp") or 0) >= cutoff_ts]
+            kept = kept[oldest_over_budget(kept, max_records, max_bytes):]
+            if len(kept) == len(ratings):
+                return {"records": 0, "bytes": 0}
+            kept_ids = {id(r) for r in kept}
+            removed = [r for r in ratings if id(r) not in kept_ids]
+            if archive is not None:
+                archive.write_segment("ratings", removed, "dialog_id", chat_timestamp)
+            self._save_ratings(kept)
+            return {"records": len(removed), "bytes": encoded_size(removed)}
+
+    # ---------- 对话权重 ----------
+    def load_weights(self):
+        """读取全部对话权重 {weight_id: weight}（主文件 + 增量日志）"""
+        with self._lock:
+            dialog_weights = load_json(DIALOG_WEIGHTS_PATH, {})
+            for delta in iter_jsonl(DIALOG_WEIGHTS_LOG_PATH):
+                dialog_weights[delta.get("weight_id")] = delta.get("weight")
+            return dialog_weights
+
+    def get_weight(self, weight_id, default=None):
+        """读取单个权重"""
+        return self.load_weights().get(weight_id, default)
+
+    def set_weight(self, weight_id, weight):
+        """写入单个权重：只追加一行增量，不重写整个权重文件"""
+        with self._lock:
+            self.journal.record("weight_set", {"weight_id": weight_id, "weight": weight})
+            ok = append_jsonl(DIALOG_WEIGHTS_LOG_PATH, {"weight_id": weight_id, "weight": weight})
+            self._weight_log_lines += 1
+            if self._weight_log_lines >= WEIGHT_LOG_COMPACT_LINES:
+                self.compact_weights()
+            return ok
+
+    def compact_weights(self):
+        """把增量日志合并进 dialog_weights.json 并清空日志"""
+        with self._lock:
+            self._weight_log_lines = 0
+            if not os.path.exists(DIALOG_WEIGHTS_LOG_PATH):
+                return True
+            if not save_json(DIALOG_WEIGHTS_PATH, self.load_weights()):
+                return False
+            os.remove(DIALOG_WEIGHTS_LOG_PATH)
+            return True
+
+    def delete_weights(self, weight_ids):
+        """删除一批权重（合并增量日志后重写主文件）"""
+        with self._lock:
+            weight_ids = set(weight_ids)
+            dialog_weights = self.load_weights()
+            removed = {k: v for k, v in dialog_weights.items() if k in weight_ids}
+            if not removed:
+                return {"records": 0, "bytes": 0}
+            for weight_id in removed:
+                del dialog_weights[weight_id]
+            if save_json(DIALOG_WEIGHTS_PATH, dialog_weights) and os.path.exists(DIALOG_WEIGHTS_LOG_PATH):
+                os.remove(DIALOG_WEIGHTS_LOG_PATH)
+            self._weight_log_lines = 0
+            return {"records": len(removed), "bytes": encoded_size(removed.items())}
+
+    # ---------- 记忆 ----------
+    def load_memories(self):
+        """读取全部记忆（按类型分组，含timeline；主文件 + 增量日志）"""
+        with self._lock:
+            return apply_memory_deltas(load_json(EXPLORATION_MEMORY_PATH, default_memories()),
+                                       iter_jsonl(EXPLORATION_MEMORY_LOG_PATH))
+
+    def _append_memory_delta(self, delta):
+        """（持有锁）追加一行记忆增量，日志过长时合并回主文件"""
+        ok = append_jsonl(EXPLORATION_MEMORY_LOG_PATH, delta)
+        self._memory_log_lines += 1
+        if self._memory_log_lines >= RECORD_LOG_COMPACT_LINES:
+            self.compact_memories()
+        return ok
+
+    def _save_memories(self, memories):
+        """重写记忆主文件（已合并增量日志）并清空日志"""
+        with self._lock:
+            self._memory_log_lines = 0
+            if not save_json(EXPLORATION_MEMORY_PATH, memories):
+                return False
+            if os.path.exists(EXPLORATION_MEMORY_LOG_PATH):
+                os.remove(EXPLORATION_MEMORY_LOG_PATH)
+            return True
+
+    def compact_memories(self):
+        """把记忆增量日志合并进 exploration_memory.json 并清空日志"""
+        with self._lock:
+            self._memory_log_lines = 0
+            if not os.path.exists(EXPLORATION_MEMORY_LOG_PATH):
+                return True
+            return self._save_memories(self.load_memories())
+
+    def put_memory(self, memory_type, entry):
+        """新增一条记忆（timeline条目也走这里）：只追加一行增量，不重写整个记忆文件"""
+        with self._lock:
+            self.journal.record("memory_put", {"memory_type": memory_type, "entry": entry})
+            return self._append_memory_delta({"op": "put", "memory_type": memory_type, "entry": entry})
+
+    def get_memory(self, memory_id):
+        """按id获取记忆（热数据找不到时查归档）"""
+        for items in self.load_memories().values():
+            if isinstance(items, list):
+                for item in items:
+                    if isinstance(item, dict) and item.get("id") == memory_id:
+                        return item
+        from core.storage.archive import get_archive
+        return get_archive().find("memories", memory_id)
+
+    def update_memories(self, entries):
+        """按id覆盖已存在的记忆（如访问计数变化）：追加一行增量，读取时覆盖"""
+        with self._lock:
+            entries = [entry for entry in entries if entry.get("id")]
+            if not entries:
+                return True
+            return self._append_memory_delta({"op": "update", "entries": entries})
+
+    def trim_timeline(self, max_records=0, max_bytes=0, archive=None):
+        """只保留条数/字节预算内最近的记忆时间线（给了archive时淘汰的部分先归档）"""
+        with self._lock:
+            memories = self.load_memories()
+            timeline = memories.get("timeline", [])
+            evicted = oldest_over_budget(timeline, max_records, max_bytes)
+            if not evicted:
+                return {"records": 0, "bytes": 0}
+            removed = timeline[:evicted]
+            if archive is not None:
+                archive.write_segment("timeline", removed, "memory_id", memory_timestamp)
+            memories["timeline"] = timeline[evicted:]
+            self._save_memories(memories)
+            return {"records": len(removed), "bytes": encoded_size(removed)}
+
+    # ---------- 冷数据归档 ----------
+    def archive_before(self, archive, cutoff_ts):
+        """把cutoff_ts（毫秒）之前的聊天记录、评分和记忆移入归档"""
+        moved = {"chat": 0, "ratings": 0, "memories": 0}
+
+        # 聊天记录：整个分段压缩归档后删除热分段
+        for name in self.chat_log.segments_before(cutoff_ts):
+            records = list(self.chat_log.iter_segment(name))
+            archive.write_segment("chat", records, "dialog_id", chat_timestamp)
+            self.chat_log.drop_segment(name)
+            moved["chat"] += len(records)
+
+        # 评分记录
+        with self._lock:
+            ratings = self._load_ratings()
+            old = [r for r in ratings if (r.get("timestamp") or 0) < cutoff_ts]
+            if old:
+                archive.write_segment("ratings", old, "dialog_id", chat_timestamp)
+                self._save_ratings([r for r in ratings if (r.get("timestamp") or 0) >= cutoff_ts])
+                moved["ratings"] = len(old)
+
+        # 记忆：按最近访问时间判断，timeline单独归档
+        with self._lock:
+            kept, expired = split_memories(self.load_memories(), cutoff_ts)
+            if expired:
+                timeline = expired.pop("timeline", [])
+                archive.write_segment("memories", [m for items in expired.values() for m in items],
+                                      "id", memory_timestamp)
+                archive.write_segment("timeline", timeline, "memory_id", memory_timestamp)
+                self._save_memories(kept)
+                moved["memories"] = sum(len(items) for items in expired.values())
+
+        return moved
+
+    # ---------- 整文档数据（探索历史、用户兴趣等） ----------
+    def load_document(self, file_path, default=None):
+        """读取整文档数据"""
+        return load_json(file_path, default)
+
+    def save_document(self, file_path, data):
+        """保存整文档数据"""
+        return save_json_deferred(file_path, data)
+
+
+_shared_store = None
+
+
+def get_store():
+    """获取进程内共享的存储后端（由设置项 storage_backend 决定）"""
+    global _shared_store
+    if _shared_store is None:
+        from core.config import load_settings
+        backend = load_settings().get("storage_backend", "json")
+        if backend == "sqlite":
+            try:
+                from core.storage.sqlite_store import SQLiteStore
+                _shared_store = SQLiteStore()
+            except Exception as e:
+                print(f"SQLite存储初始化失败，回退到JSON存储：{e}")
+                _shared_store = JsonStore()
+        else:
+            _shared_store = JsonStore()
+        # 重放上次崩溃前遗留的变更
+        recover(_shared_store)
+    return _shared_store
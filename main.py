@@ -13,6 +13,11 @@ def main():
     setup_logger()
     logger = logging.getLogger(__name__)
 
+    # 配置后台延迟写入的合并窗口
+    from core.config import load_settings
+    from utils.file_helper import write_behind
+    write_behind.set_delay(load_settings().get("write_behind_delay", 0.5))
+
     try:
         # 初始化应用
         app = QApplication(sys.argv)
@@ -0,0 +1,133 @@
+"""
+测试夹具：把 data/ 和 resources/ 下的全部路径重定向到临时目录，并重置进程内共享的存储对象
+路径常量被各模块按名字导入（也写进了函数的默认参数），这里逐个模块替换
+"""
+import inspect
+import json
+import os
+import sys
+import threading
+
+import pytest
+
+from core import config
+
+# 先导入会用到数据路径的模块，保证下面能替换到它们
+import core.knowledge.match_engine  # noqa: F401
+import core.knowledge.exploration_engine  # noqa: F401
+import core.knowledge.learning_strategy  # noqa: F401
+import core.memory.memory_network  # noqa: F401
+import core.storage.archive  # noqa: F401
+import core.storage.retention  # noqa: F401
+import core.storage.sqlite_store  # noqa: F401
+
+# 真实的数据/资源目录（替换前记下）
+REAL_ROOTS = (config.DATA_DIR, config.RESOURCES_DIR)
+
+SHARED_OBJECTS = (
+    ("core.storage.store", "_shared_store"),
+    ("core.storage.journal", "_shared_journal"),
+    ("core.storage.chat_log", "_shared_chat_log"),
+    ("core.storage.archive", "_shared_archive"),
+    ("core.knowledge.segmenter", "_shared_segmenter"),
+)
+
+
+class Sandbox:
+    """临时的 data/ 和 resources/ 目录"""
+
+    def __init__(self, tmp_path, monkeypatch):
+        self.monkeypatch = monkeypatch
+        self.data_dir = str(tmp_path / "data")
+        self.resources_dir = str(tmp_path / "resources")
+        os.makedirs(self.data_dir)
+        os.makedirs(self.resources_dir)
+        self.matchers = []
+
+    def redirect(self, value):
+        """真实数据/资源目录下的路径换成临时目录下的路径，其他值返回None"""
+        if isinstance(value, str):
+            for old, new in zip(REAL_ROOTS, (self.data_dir, self.resources_dir)):
+                if value == old or value.startswith(old + os.sep):
+                    return new + value[len(old):]
+        elif isinstance(value, tuple) and value:
+            redirected = tuple(self.redirect(v) for v in value)
+            if any(v is not None for v in redirected):
+                return tuple(v if r is None else r for v, r in zip(value, redirected))
+        return None
+
+    def write(self, path, data):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+
+    def settings(self, **overrides):
+        """写入测试用设置：默认不热重载、不缓存索引、不归档"""
+        settings = {"knowledge_reload_interval": 0, "index_cache": False, "archive_after_days": 0}
+        settings.update(overrides)
+        self.write(config.SETTINGS_PATH, settings)
+
+    def knowledge(self, data):
+        self.write(config.KNOWLEDGE_PATH, data)
+
+    def learned(self, data):
+        self.write(config.LEARNED_PATH, data)
+
+    def stop(self):
+        """停掉已建的匹配器，等后台维护/重建线程跑完（否则它们可能在路径还原后写进真实目录）"""
+        from utils.file_helper import flush_pending_writes
+        for matcher in self.matchers:
+            matcher.knowledge_watcher.stop()
+            matcher.maintenance_thread.join()
+        for thread in threading.enumerate():
+            if thread.name == "index-rebuild":
+                thread.join()
+        flush_pending_writes()
+
+    def restart(self):
+        """模拟重启进程：停掉已建的匹配器，丢弃进程内共享的存储对象（下次获取时重新打开、重放日志）"""
+        self.stop()
+        for module_name, attr in SHARED_OBJECTS:
+            self.monkeypatch.setattr(sys.modules[module_name], attr, None)
+
+    def matcher(self):
+        from core.knowledge.match_engine import LocalKnowledgeMatcher
+        matcher = LocalKnowledgeMatcher()
+        self.matchers.append(matcher)
+        return matcher
+
+
+def _patch_defaults(monkeypatch, sandbox, function):
+    defaults = getattr(function, "__defaults__", None)
+    if defaults:
+        redirected = tuple(sandbox.redirect(v) for v in defaults)
+        if any(v is not None for v in redirected):
+            monkeypatch.setattr(function, "__defaults__",
+                                tuple(v if r is None else r for v, r in zip(defaults, redirected)))
+
+
+@pytest.fixture
+def sandbox(tmp_path, monkeypatch):
+    from utils.file_helper import flush_pending_writes
+
+    flush_pending_writes()
+    box = Sandbox(tmp_path, monkeypatch)
+    for name, module in list(sys.modules.items()):
+        if not name.startswith(("core.", "utils.")) or module is None:
+            continue
+        for attr, value in list(vars(module).items()):
+            redirected = box.redirect(value)
+            if redirected is not None:
+                monkeypatch.setattr(module, attr, redirected)
+            elif inspect.isfunction(value) and value.__module__ == name:
+                _patch_defaults(monkeypatch, box, value)
+            elif inspect.isclass(value) and value.__module__ == name:
+                for member in vars(value).values():
+                    _patch_defaults(monkeypatch, box, getattr(member, "__func__", member))
+    box.restart()
+    assert config.DATA_DIR == box.data_dir
+    box.settings()
+    box.knowledge({"chat": [], "study": {}, "default_answer": ["我还在学习中～"]})
+    box.learned({"new_chat": [], "new_study": {}})
+    yield box
+
+    box.stop()
@@ -0,0 +1,32 @@
+from utils.id_allocator import IdAllocator, EPOCH_MS, id_timestamp, id_sort_key
+
+
+def test_new_ids_sort_by_string():
+    allocator = IdAllocator(node=1)
+    ids = [allocator.next_id("dia") for _ in range(2000)]
+    assert len(set(ids)) == len(ids)
+    assert sorted(ids) == ids
+
+
+def test_id_timestamp_reads_both_formats():
+    assert id_timestamp("dia_1700000000123") == 1700000000123
+    assert id_timestamp("mem_1a2b3c4d_1700000000123") == 1700000000123
+    new = IdAllocator(node=3).next_id("dia")
+    assert id_timestamp(new) > EPOCH_MS
+    assert id_timestamp("dia_not-an-id") is None
+
+
+def test_all_digit_new_id_is_not_read_as_legacy():
+    # 新ID首位是0，即使碰巧全是数字也按Base32解码
+    assert id_timestamp("dia_0000000000000") == EPOCH_MS
+
+
+def test_mixed_legacy_and_new_ids_sort_by_timestamp():
+    new = IdAllocator(node=1).next_id("dia")
+    created = id_timestamp(new)
+    older_legacy = f"dia_{created - 1000}"
+    newer_legacy = f"dia_{created + 1000}"
+    # 字符串顺序下旧格式（以1开头）总排在新ID（以0开头）后面，与时间顺序不符
+    assert sorted([newer_legacy, new, older_legacy]) == [new, older_legacy, newer_legacy]
+    assert sorted([newer_legacy, new, older_legacy], key=id_sort_key) == [older_legacy, new, newer_legacy]
+    assert sorted(["dia_bad", new], key=id_sort_key) == ["dia_bad", new]
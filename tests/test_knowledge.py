@@ -0,0 +1,711 @@
+import hashlib
+import json
+import os
+import random
+from collections import Counter
+
+import pytest
+
+from core.knowledge.chat_resolver import choose_reply
+from core.knowledge.weighted_sampler import AliasTable, WeightedSampler
+
+
+def test_alias_table_follows_weights_and_skips_zero():
+    table = AliasTable([0.0, 1.0, 3.0, 0.0])
+    rng = random.Random(7)
+    counts = Counter(table.sample(rng) for _ in range(8000))
+    assert counts[0] == counts[3] == 0
+    assert 0.2 < counts[1] / 8000 < 0.3
+
+
+def _entry(weights):
+    """同一问题组（“你几岁”）的学习内容候选"""
+    return {"match": "learned", "candidates": [
+        {"source": "learned", "item": {"q": "你几岁", "a": answer, "dialog_id": dialog_id}, "score": 1.0,
+         "weight": weights[dialog_id]}
+        for dialog_id, answer in (("dia_1", "我1岁"), ("dia_2", "我2岁"))
+    ]}
+
+
+def _replies(sampler, weights, n=300, seed=1):
+    rng = random.Random(seed)
+    return Counter(choose_reply(_entry(weights), ["我还在学习中～"], rng, sampler)[0] for _ in range(n))
+
+
+def test_low_weight_answer_is_skipped_but_stays_in_group():
+    sampler = WeightedSampler()
+    replies = _replies(sampler, {"dia_1": 0.2, "dia_2": 1.0})
+    assert replies == Counter({"我2岁": 300})
+    # 低权重回答也登记在组里，它的权重变化能让这张表失效
+    assert ("chat", "你几岁") in sampler.members["dia_1"]
+
+
+def test_rerating_invalidates_group_table():
+    sampler = WeightedSampler()
+    weights = {"dia_1": 0.2, "dia_2": 1.0}
+    _replies(sampler, weights)
+
+    # 低评分后又评了高分：权重回到2.0，缓存的表必须重建
+    weights["dia_1"] = 2.0
+    sampler.invalidate_weight("dia_1")
+    replies = _replies(sampler, weights, n=3000)
+    assert 0.6 < replies["我1岁"] / 3000 < 0.73
+
+
+def test_stale_table_is_reused_until_invalidated():
+    sampler = WeightedSampler()
+    _replies(sampler, {"dia_1": 1.0, "dia_2": 0.2})
+    # 没有通知失效时沿用缓存的表（不重新读权重）
+    assert _replies(sampler, {"dia_1": 0.2, "dia_2": 1.0}) == Counter({"我1岁": 300})
+    sampler.invalidate_weight("dia_2")
+    assert _replies(sampler, {"dia_1": 0.2, "dia_2": 1.0}) == Counter({"我2岁": 300})
+
+
+def test_all_low_weight_falls_back_to_default():
+    reply, related, source, _ = choose_reply(_entry({"dia_1": 0.2, "dia_2": 0.5}), ["我还在学习中～"],
+                                             random.Random(0), WeightedSampler())
+    assert (reply, related, source) == ("我还在学习中～", "", "default")
+
+
+def test_study_category_weight_ids_survive_weight_invalidation():
+    sampler = WeightedSampler()
+    items = ["apple - 苹果", "pear - 梨", "peach - 桃"]
+    weights = {"w_apple - 苹果": 1.0, "w_pear - 梨": 0.0, "w_peach - 桃": 0.0}
+    calls = {"ids": 0, "weights": 0}
+
+    def weight_ids_of(items):
+        calls["ids"] += 1
+        return [f"w_{item}" for item in items]
+
+    def weights_of(weight_ids):
+        calls["weights"] += 1
+        return [weights[weight_id] for weight_id in weight_ids]
+
+    def choose():
+        index = sampler.sample_cached(("study", "单词", "knowledge"), lambda: items, weight_ids_of, weights_of,
+                                      random.Random(0))
+        return items[index]
+
+    assert {choose() for _ in range(20)} == {"apple - 苹果"}
+    assert calls == {"ids": 1, "weights": 1}
+
+    # 评分只让表失效：重新读权重，不重算权重ID
+    weights["w_apple - 苹果"], weights["w_pear - 梨"] = 0.0, 1.0
+    sampler.invalidate_weight("w_pear - 梨")
+    assert choose() == "pear - 梨"
+    assert calls == {"ids": 1, "weights": 2}
+
+    # 类别成员变化（学习新内容）时权重ID列表也重算
+    items.append("plum - 李子")
+    weights["w_plum - 李子"] = 0.0
+    sampler.invalidate(("study", "单词", "knowledge"))
+    choose()
+    assert calls == {"ids": 2, "weights": 3}
+    # 表里只有下标，不保存类别条目的副本
+    assert sampler.tables[("study", "单词", "knowledge")][0] is None
+
+
+def test_paged_study_sampling_keeps_only_resident_pages(tmp_path):
+    from core.knowledge.study_pages import StudyPages, build_pages
+
+    knowledge = {"study": {f"类别{k}": [f"{k}-{i}" for i in range(50)] for k in range(6)}}
+    index = build_pages(knowledge, str(tmp_path / "pages"))
+    study = StudyPages(str(tmp_path / "pages"), index["sizes"], index["files"], max_resident=2)
+    sampler = WeightedSampler()
+
+    for round_ in range(2):
+        for k, study_type in enumerate(study):
+            i = sampler.sample_cached(("study", study_type, "knowledge"), lambda: study[study_type],
+                                      lambda items: [f"w_{item}" for item in items],
+                                      lambda weight_ids: [1.0] * len(weight_ids), random.Random(k))
+            assert study[study_type][i].startswith(f"{k}-")
+
+    # 抽样表不持有页的副本，常驻的页数仍由页缓存的上限决定
+    assert len(study.resident()) <= 2
+    assert all(items is None for items, _ in sampler.tables.values())
+
+
+def test_index_cache_without_current_fields_is_rebuilt(tmp_path):
+    import pickle
+
+    from core.knowledge.index_cache import CACHE_VERSION, load_index_cache
+    from core.knowledge.knowledge_state import KnowledgeState
+
+    # 模拟新增字段前写下的缓存：版本号相同，但状态里没有 lazy_study
+    old_state = object.__new__(KnowledgeState)
+    old_state.__dict__.update({name: None for name in KnowledgeState.CACHED_FIELDS if name != "lazy_study"})
+    path = tmp_path / "match_index.cache"
+    with open(path, "wb") as f:
+        pickle.dump(((CACHE_VERSION,), old_state), f)
+
+    assert load_index_cache(str(path)) == (None, None)
+
+
+def test_cached_state_picks_up_newly_taught_content():
+    import pickle
+
+    from core.knowledge.knowledge_state import KnowledgeState
+
+    knowledge = {"chat": [{"question": ["你好"], "answer": ["你好呀"]}], "study": {"单词": ["apple - 苹果"]}}
+    learned = {"new_chat": [{"q": "你是谁", "a": "我是小桌", "dialog_id": "dia_1"}], "new_study": {}}
+    cached = pickle.loads(pickle.dumps(KnowledgeState(knowledge, learned, fuzzy=False)))
+
+    # 缓存写入后又教了新内容：下次启动把追加的部分补进缓存的索引
+    taught = {"new_chat": learned["new_chat"] + [{"q": "今天天气", "a": "晴天", "dialog_id": "dia_2"}],
+              "new_study": {"成语": ["画蛇添足"]}}
+    assert cached.extend_learned(taught)
+    assert [item["a"] for item in cached.chat_index.match("今天天气怎么样")[0]] == ["晴天"]
+    assert cached.reply_for("dia_2") == "晴天"
+    assert cached.study_trigger("来个成语") == "成语"
+
+    # 已有内容被删改时不能增量补，交给整体重建
+    assert not cached.extend_learned({"new_chat": taught["new_chat"][1:], "new_study": {}})
+
+
+# ---------- 启动顺序：先重放变更日志再读学习内容 ----------
+def _journal_learned_chat(item):
+    """只写进变更日志的学习内容（模拟写 learned.json 之前崩溃）"""
+    import json
+    from core.config import JOURNAL_PATH
+
+    with open(JOURNAL_PATH, "a", encoding="utf-8") as f:
+        f.write(json.dumps({"seq": 1, "op": "learned_add", "data": {"kind": "chat", "item": item}},
+                           ensure_ascii=False) + "\n")
+
+
+def test_replayed_learned_chat_is_matched_at_startup(sandbox):
+    _journal_learned_chat({"q": "喜欢什么颜色", "a": "喜欢蓝色", "dialog_id": "dia_color"})
+
+    matcher = sandbox.matcher()
+
+    assert [item["q"] for item in matcher.learned_chat] == ["喜欢什么颜色"]
+    assert matcher.match_chat("你喜欢什么颜色")[0] == "喜欢蓝色"
+
+
+def test_replayed_learned_chat_reaches_cached_index(sandbox):
+    sandbox.settings(index_cache=True)
+    assert sandbox.matcher().match_chat("你喜欢什么颜色")[0] == "我还在学习中～"
+
+    # 上次运行学了新内容但没来得及写 learned.json：重放后缓存键不一致，新内容补进缓存的索引
+    sandbox.restart()
+    _journal_learned_chat({"q": "喜欢什么颜色", "a": "喜欢蓝色", "dialog_id": "dia_color"})
+    matcher = sandbox.matcher()
+    assert matcher.match_chat("你喜欢什么颜色")[0] == "喜欢蓝色"
+
+
+
+def test_rebuilt_index_after_external_edit_keeps_knowledge_pack(sandbox):
+    import os
+
+    from core.knowledge.knowledge_pack import compile_pack
+
+    knowledge = {"chat": [{"question": ["天气"], "answer": ["今天晴天"]}], "study": {},
+                 "default_answer": ["我还在学习中～"]}
+    compile_pack(knowledge, os.path.join(sandbox.resources_dir, "knowledge.pack"))
+    sandbox.settings(knowledge_pack="knowledge.pack")
+    matcher = sandbox.matcher()
+    assert matcher.state.packed
+
+    # learned.json 被外部改动（条数和索引对不上）后再教一句，走整体重建索引
+    sandbox.learned({"new_chat": [{"q": "早上好", "a": "早安", "dialog_id": "dia_ext"}], "new_study": {}})
+    matcher.learn_from_user("问 晚安 -> 答 做个好梦")
+
+    assert matcher.chat_index.packed is not None
+    assert matcher.match_chat("天气怎么样")[0] == "今天晴天"
+    assert matcher.match_chat("晚安")[0] == "做个好梦"
+    assert matcher.match_chat("早上好")[0] == "早安"
+
+
+# ---------- 模糊匹配 ----------
+def test_fuzzy_index_ranks_by_similarity_and_applies_threshold():
+    from core.knowledge.fuzzy_index import FuzzyIndex
+
+    index = FuzzyIndex([("早上好", "morning"), ("早上好呀", "morning"), ("你叫什么名字", "name"),
+                        ("今天天气怎么样", "weather")])
+    hits = index.search("你叫啥名字", top_k=5, threshold=0.1)
+    assert hits[0][0] == "name"
+    assert all(payload != "weather" for payload, _ in hits)
+
+    # 同一payload只保留最高分；分数从高到低
+    hits = index.search("早上好呀呀", top_k=5, threshold=0.1)
+    assert [payload for payload, _ in hits] == ["morning"]
+    scores = [score for _, score in index.search("早上好天气", top_k=5, threshold=0.0)]
+    assert scores == sorted(scores, reverse=True)
+
+    assert index.search("你叫啥名字", threshold=0.99) == []
+    assert index.search("早上好天气", top_k=1, threshold=0.0)[0][0] == "morning"
+    # 批量查询与逐条查询一致，增量区的文档也参与打分
+    index.add("晚安", "night")
+    texts = ["你叫啥名字", "晚安啦", "完全无关"]
+    assert index.search_many(texts, 3, 0.1) == [index.search(t, 3, 0.1) for t in texts]
+    assert index.search("晚安啦", threshold=0.1)[0][0] == "night"
+
+
+def test_fuzzy_index_with_empty_corpus_or_query():
+    from core.knowledge.fuzzy_index import FuzzyIndex
+
+    index = FuzzyIndex([])
+    assert len(index) == 0
+    assert index.search("你好") == []
+    assert index.search_many(["你好", ""]) == [[], []]
+    assert FuzzyIndex([("你好", 1)]).search("  ") == []
+    index.add("你好呀", "hello")
+    assert index.search("你好", threshold=0.1)[0][0] == "hello"
+
+
+def test_fuzzy_search_stays_under_a_millisecond_at_100k_questions():
+    import statistics
+    import time
+
+    from core.knowledge.fuzzy_index import FuzzyIndex
+
+    rng = random.Random(3)
+    chars = [chr(c) for c in range(0x4e00, 0x4e00 + 300)]
+    index = FuzzyIndex(("".join(rng.choice(chars) for _ in range(rng.randint(3, 8))), i) for i in range(100000))
+    timings = []
+    for _ in range(200):
+        text = "".join(rng.choice(chars) for _ in range(6))
+        start = time.perf_counter()
+        index.search(text, top_k=5, threshold=0.35)
+        timings.append(time.perf_counter() - start)
+    assert statistics.median(timings) < 0.001
+
+
+def test_missing_fuzzy_dependency_is_reported_once(monkeypatch, capsys):
+    from core.knowledge import chat_index
+
+    monkeypatch.setattr(chat_index, "FuzzyIndex", None)
+    monkeypatch.setattr(chat_index, "FUZZY_IMPORT_ERROR", ImportError("No module named 'numpy'"))
+    monkeypatch.setattr(chat_index, "_fuzzy_warned", False)
+    index = chat_index.ChatIndex([], [{"question": ["你好"], "answer": ["你好呀"]}], fuzzy=True)
+    chat_index.ChatIndex([], [], fuzzy=True)
+    chat_index.ChatIndex([], [], fuzzy=False)
+
+    assert capsys.readouterr().out.count("模糊匹配不可用") == 1
+    assert index.fuzzy_match("你好啊") == []
+
+
+# ---------- 分词 ----------
+def test_shared_segmenter_takes_the_latest_vocabulary(sandbox):
+    from core.knowledge.segmenter import get_segmenter
+
+    # 记忆检索等模块先按知识文件建立了共享分词器
+    first = get_segmenter()
+    assert "机器学习" not in first.segment("机器学习")
+
+    assert get_segmenter(["机器学习"]) is first
+    assert first.segment("机器学习") == ["机器学习"]
+    assert get_segmenter().segment("机器学习") == ["机器学习"]
+
+
+def test_reloaded_knowledge_words_are_segmented(sandbox):
+    from core.knowledge.segmenter import get_segmenter
+
+    matcher = sandbox.matcher()
+    assert "光合作用" not in matcher.segment("什么是光合作用")
+
+    # 外部改了 learned.json（热重载），新问题进入共享分词器的词典
+    sandbox.learned({"new_chat": [{"q": "光合作用", "a": "植物用阳光制造养分", "dialog_id": "dia_1"}],
+                     "new_study": {}})
+    assert matcher.reload_knowledge()
+    assert "光合作用" in matcher.segment("什么是光合作用")
+    assert "光合作用" in get_segmenter().segment("什么是光合作用")
+
+
+def test_default_study_content_follows_the_seeded_rng(sandbox):
+    sandbox.knowledge({"chat": [], "study": {"单词": [f"word_{i}" for i in range(50)]},
+                       "default_answer": ["我还在学习中～"]})
+    matcher = sandbox.matcher()
+
+    # 全局随机状态不同，固定的种子仍给出同样的推送
+    picks = []
+    for global_seed in (99, 100):
+        matcher.set_seed(11)
+        random.seed(global_seed)
+        picks.append([matcher.get_active_content() for _ in range(10)])
+    assert picks[0] == picks[1]
+    assert len(set(picks[0])) > 1
+
+
+# ---------- 回复候选缓存 ----------
+def test_rating_keeps_cached_candidates_and_refreshes_weights(sandbox):
+    sandbox.learned({"new_chat": [{"q": "你好", "a": "你好呀", "dialog_id": "dia_hello"},
+                                  {"q": "再见", "a": "拜拜", "dialog_id": "dia_bye"}], "new_study": {}})
+    matcher = sandbox.matcher()
+    assert matcher.match_chat("你好")[0] == "你好呀"
+    matcher.match_chat("再见")
+
+    # 给“你好”打低分：别的输入的缓存条目不受影响
+    _, dialog_id = matcher.match_chat("你好")
+    matcher.weight_manager.update_dialog_weight(dialog_id, 1)
+    assert matcher.match_chat("再见")[0] == "拜拜"
+    # 命中缓存的“你好”按新权重选择：低权重回答不再被选中
+    assert matcher.match_chat("你好")[0] == "我还在学习中～"
+
+    stats = matcher.get_response_cache_stats()
+    assert stats["stale"] == 0 and stats["hits"] == 3
+
+
+def test_merged_duplicate_answers_keep_their_dialog_weights(sandbox):
+    sandbox.learned({"new_chat": [{"q": "你几岁", "a": "我3岁", "dialog_id": "dia_a"},
+                                  {"q": "你几岁呀", "a": "我3岁", "dialog_id": "dia_b"}], "new_study": {}})
+    matcher = sandbox.matcher()
+    assert matcher.chat_index.weight_ids(matcher.chat_index.learned[0]) == ["dia_a", "dia_b"]
+
+    # 保留的条目被打低分，重复条目的权重仍然算在这个回答上
+    matcher.weight_manager.update_dialog_weight("dia_a", 1)
+    assert matcher.match_chat("你几岁")[0] == "我3岁"
+    # 对重复条目的评分也能作用到合并后的回答（并让缓存的别名表失效）
+    matcher.weight_manager.update_dialog_weight("dia_b", 1)
+    assert matcher.match_chat("你几岁")[0] == "我还在学习中～"
+
+    result = matcher.match_chat_many(["你几岁"])[0]
+    assert result["candidates"][0]["weight_ids"] == ["dia_a", "dia_b"]
+    assert result["candidates"][0]["weight"] == 0.2
+
+
+# ---------- 问题索引：Aho-Corasick 自动机 ----------
+def test_automaton_finds_overlapping_patterns_in_one_pass():
+    from core.knowledge.chat_index import AhoCorasick
+
+    automaton = AhoCorasick()
+    for pattern, payload in (("he", 1), ("she", 2), ("hers", 3), ("", 4), ("his", 5)):
+        automaton.add(pattern, payload)
+    assert automaton.find_all("ushers") == [2, 1, 3]
+    assert automaton.find_all("xyz") == []
+    # 建好后再加模式：下次查询前补建失配链接
+    automaton.add("us", 6)
+    assert automaton.find_all("ushers") == [6, 2, 1, 3]
+    assert [end for end, _ in automaton.iter_matches("hehe")] == [1, 3]
+
+
+def test_chat_index_keeps_learned_before_knowledge_priority():
+    from core.knowledge.chat_index import ChatIndex
+
+    knowledge = [{"question": ["天气"], "answer": ["晴"]}, {"question": ["今天天气"], "answer": ["多云"]}]
+    learned = [{"q": "早上好", "a": "早", "dialog_id": "dia_1"}, {"q": "早上好呀", "a": "早安", "dialog_id": "dia_2"}]
+    index = ChatIndex(learned, knowledge, fuzzy=False)
+
+    # 同一规范问题只有一个模式，命中后带出全部回答
+    learned_hits, knowledge_hit = index.match("早上好，今天天气怎么样")
+    assert [item["a"] for item in learned_hits] == ["早", "早安"]
+    # 多个知识库问题命中时取排在前面的条目
+    assert knowledge_hit["answer"] == ["晴"]
+    assert index.match("随便说说") == ([], None)
+
+    # 增量加入的学习内容立即可匹配；重复条目合并掉
+    index.add_learned({"q": "晚安", "a": "好梦", "dialog_id": "dia_3"})
+    index.add_learned({"q": "晚安啦", "a": "好梦", "dialog_id": "dia_4"})
+    assert [item["dialog_id"] for item in index.match("晚安")[0]] == ["dia_3"]
+    assert index.source_count == 4 and len(index.learned) == 3
+
+
+# ---------- 批量匹配 ----------
+def test_match_chat_many_is_side_effect_free_and_aligned(sandbox):
+    from core.storage.store import get_store
+
+    sandbox.knowledge({"chat": [{"question": ["天气"], "answer": ["今天晴天"]}], "study": {},
+                       "default_answer": ["我还在学习中～"]})
+    sandbox.learned({"new_chat": [{"q": "你好", "a": "你好呀", "dialog_id": "dia_hello"}], "new_study": {}})
+    matcher = sandbox.matcher()
+    lines = get_store().chat_log.stats()["lines"]
+
+    inputs = ["你好", "天气怎么样", "你好呀呀", "完全无关的话", ""]
+    results = matcher.match_chat_many(inputs, seed=1)
+
+    assert [r["input"] for r in results] == ["你好", "天气怎么样", "你好呀呀", "完全无关的话", ""]
+    assert [r["source"] for r in results] == ["learned", "knowledge", "learned", "default", "default"]
+    assert results[0]["related_dialog_id"] == "dia_hello" and results[0]["score"] == 1.0
+    assert results[3]["reply"] == "我还在学习中～" and results[3]["candidates"] == []
+    assert matcher.match_chat_many(inputs, seed=1) == results
+    assert matcher.match_chat_many([]) == []
+    # 不写聊天记录
+    assert get_store().chat_log.stats()["lines"] == lines
+
+
+def test_match_chat_many_process_pool_matches_sequential(sandbox):
+    sandbox.learned({"new_chat": [{"q": "你好", "a": "你好呀", "dialog_id": "dia_hello"},
+                                  {"q": "再见", "a": "拜拜", "dialog_id": "dia_bye"}], "new_study": {}})
+    matcher = sandbox.matcher()
+    inputs = ["你好", "再见", "嗯嗯"] * 4
+
+    parallel = matcher.match_chat_many(inputs, processes=2, chunk_size=5, seed=3)
+    sequential = matcher.match_chat_many(inputs, seed=3)
+    assert [r["reply"] for r in parallel] == [r["reply"] for r in sequential]
+    assert [r["related_dialog_id"] for r in parallel] == ["dia_hello", "dia_bye", ""] * 4
+
+
+# ---------- 复习推送：求和树 ----------
+def test_sum_tree_samples_in_proportion_and_updates():
+    from core.knowledge.sum_tree import SumTree
+
+    tree = SumTree([("a", 1.0), ("b", 3.0), ("c", 0.0), ("d", -2.0)])
+    rng = random.Random(5)
+    counts = Counter(tree.sample(rng) for _ in range(8000))
+    assert counts["c"] == counts["d"] == 0
+    assert 0.7 < counts["b"] / 8000 < 0.8
+
+    # 改权重、加新键（超过容量时重建）都保持总和一致
+    tree.update("b", 0.0)
+    for i in range(10):
+        tree.update(f"k{i}", 0.5)
+    assert tree.total == 6.0 and len(tree) == 14
+    assert "b" not in {tree.sample(rng) for _ in range(500)}
+    assert SumTree().sample(rng) is None
+    assert SumTree([("a", 0.0)]).sample(rng) is None
+
+
+def test_active_content_reviews_only_high_weight_items(sandbox):
+    sandbox.learned({"new_chat": [{"q": "你好", "a": "你好呀", "dialog_id": "dia_good"},
+                                  {"q": "再见", "a": "拜拜", "dialog_id": "dia_plain"}], "new_study": {}})
+    matcher = sandbox.matcher()
+    matcher.set_seed(2)
+    # 没有高权重内容时推默认学习内容
+    assert matcher.get_active_content() == "记得跟我聊天学习哦～"
+
+    _, dialog_id = matcher.match_chat("你好")
+    matcher.weight_manager.update_dialog_weight(dialog_id, 5)
+    assert {matcher.get_active_content() for _ in range(20)} == {"复习一下：你好呀"}
+
+    # 高权重的普通对话也能直接查到回复
+    matcher.weight_manager.update_dialog_weight("dia_good", 3)
+    _, chat_id = matcher.match_chat("随便说说")
+    matcher.weight_manager.update_dialog_weight(chat_id, 5)
+    assert matcher.get_active_content() == "复习一下：我还在学习中～"
+
+
+# ---------- 知识库热重载 ----------
+def test_edited_knowledge_is_reloaded_and_swapped_in(sandbox):
+    from core import config
+
+    sandbox.knowledge({"chat": [{"question": ["天气"], "answer": ["今天晴天"]}], "study": {},
+                       "default_answer": ["我还在学习中～"]})
+    matcher = sandbox.matcher()
+    old_state = matcher.state
+
+    sandbox.knowledge({"chat": [{"question": ["天气"], "answer": ["今天下雨"]},
+                                {"question": ["周末"], "answer": ["去公园"]}],
+                       "study": {}, "default_answer": ["我还在学习中～"]})
+    assert matcher.knowledge_watcher.check() == [config.KNOWLEDGE_PATH]
+
+    assert matcher.state is not old_state
+    assert matcher.match_chat("天气")[0] == "今天下雨"
+    assert matcher.match_chat("周末干嘛")[0] == "去公园"
+    assert matcher.exploration_engine.knowledge is matcher.knowledge
+    # 旧状态保持完整，正在用它的匹配不受影响
+    assert old_state.chat_index.match("天气")[1]["answer"] == ["今天晴天"]
+    # 自己写的 learned.json 不触发重载
+    matcher.learn_from_user("问 早 -> 答 早呀")
+    assert matcher.knowledge_watcher.check() == []
+
+
+def test_broken_knowledge_edit_keeps_the_previous_state(sandbox, capsys):
+    from core import config
+
+    sandbox.knowledge({"chat": [{"question": ["天气"], "answer": ["今天晴天"]}], "study": {},
+                       "default_answer": ["我还在学习中～"]})
+    matcher = sandbox.matcher()
+    state = matcher.state
+
+    with open(config.KNOWLEDGE_PATH, "w", encoding="utf-8") as f:
+        f.write('{"chat": [{"question": ["天')
+    matcher.knowledge_watcher.check()
+
+    assert "继续使用旧版本" in capsys.readouterr().out
+    assert matcher.state is state
+    assert matcher.match_chat("天气")[0] == "今天晴天"
+
+
+# ---------- 词典模式：有序键数组 + 二分 ----------
+def test_study_dictionary_exact_and_prefix_lookups():
+    from core.knowledge.study_dictionary import StudyDictionary
+
+    dictionary = StudyDictionary(["apple - n. 苹果；苹果树", "application：应用", "apply = 申请", "没有释义的一句话"])
+    # 不是"词 - 释义"格式的内容不进词典
+    assert len(dictionary) == 3
+    assert dictionary.exact("Apple") == ["apple - n. 苹果；苹果树"]
+    assert dictionary.exact("苹果树") == ["apple - n. 苹果；苹果树"]
+    assert dictionary.prefix("appl") == ["apple - n. 苹果；苹果树", "application：应用", "apply = 申请"]
+    assert dictionary.prefix("appl", limit=1) == ["apple - n. 苹果；苹果树"]
+    assert dictionary.prefix("  ") == [] and dictionary.exact("banana") == []
+    # 先精确命中再补前缀命中，不重复
+    assert dictionary.lookup("apply") == ["apply = 申请"]
+    assert dictionary.lookup("苹果") == ["apple - n. 苹果；苹果树"]
+
+    # 逐条插入后键数组保持有序
+    assert dictionary.add("apt - 恰当的") and not dictionary.add("随便说说")
+    assert dictionary.head_keys == sorted(dictionary.head_keys)
+    assert dictionary.gloss_keys == sorted(dictionary.gloss_keys)
+    assert dictionary.prefix("ap")[-1] == "apt - 恰当的"
+
+
+def test_study_dictionary_reuses_and_rebuilds_disk_cache(tmp_path, monkeypatch, capsys):
+    from core.knowledge.study_dictionary import StudyDictionary, cache_path_for
+
+    cache_path = cache_path_for(str(tmp_path / "knowledge.json"), "单词")
+    entries = ["cat - 猫", "dog - 狗"]
+    StudyDictionary.load(entries, cache_path)
+    assert os.path.exists(cache_path)
+
+    # 内容不变时直接读缓存，不再编译
+    with monkeypatch.context() as patch:
+        patch.setattr(StudyDictionary, "_compile", lambda self, items: items and pytest.fail("不应重新编译"))
+        assert StudyDictionary.load(entries, cache_path).exact("狗") == ["dog - 狗"]
+
+    # 词表变了，缓存作废重新编译
+    assert StudyDictionary.load(entries + ["cow - 牛"], cache_path).exact("cow") == ["cow - 牛"]
+
+    # 缓存损坏时提示并重新编译，写回一份好的缓存
+    with open(cache_path, "wb") as f:
+        f.write(b"not a pickle")
+    dictionary = StudyDictionary.load(entries, cache_path)
+    assert "读取词典缓存失败" in capsys.readouterr().out
+    assert dictionary.exact("cat") == ["cat - 猫"]
+    assert StudyDictionary.load(entries, cache_path).exact("cat") == ["cat - 猫"]
+    assert capsys.readouterr().out == ""
+
+
+def test_lookup_query_searches_knowledge_and_learned_words(sandbox):
+    sandbox.settings(dictionary_types=["单词"], dictionary_max_results=2)
+    sandbox.knowledge({"chat": [], "study": {"单词": ["book - 书", "bookshelf - 书架", "bookmark - 书签"]},
+                       "default_answer": ["我还在学习中～"]})
+    sandbox.learned({"new_chat": [], "new_study": {"单词": ["boot - 靴子"]}})
+    matcher = sandbox.matcher()
+
+    assert matcher.get_lookup_query("查 book") == "book"
+    assert matcher.get_lookup_query("查") is None and matcher.get_lookup_query("你好") is None
+    assert matcher.lookup_study("靴子")[0] == "boot - 靴子"
+    # 结果条数受 dictionary_max_results 限制
+    assert matcher.lookup_study("book")[0].split("\n") == ["book - 书", "bookmark - 书签"]
+    assert matcher.lookup_study("banana")[0].startswith("词典里没有找到【banana】")
+
+
+# ---------- 知识包 ----------
+PACK_KNOWLEDGE = {
+    "chat": [{"question": ["天气", "下雨"], "answer": ["今天晴天"]},
+             {"question": ["天气预报"], "answer": ["明天多云", "后天有雨"]}],
+    "study": {"单词": ["apple - 苹果", "apply - 申请", "说明文字"], "古诗": ["床前明月光"]},
+    "default_answer": ["我还在学习中～"]
+}
+
+
+def test_knowledge_pack_round_trip(tmp_path):
+    import pickle
+
+    from core.knowledge.knowledge_pack import KnowledgePack, compile_pack
+    from core.knowledge.weight_manager import study_weight_id
+
+    path = str(tmp_path / "knowledge.pack")
+    counts = compile_pack(PACK_KNOWLEDGE, path)
+    assert counts["chat"] == 2 and counts["study"] == 4 and counts["dictionaries"] == 1
+
+    pack = KnowledgePack(path)
+    assert list(pack["chat"]) == PACK_KNOWLEDGE["chat"]
+    assert {t: list(items) for t, items in pack["study"].items()} == PACK_KNOWLEDGE["study"]
+    assert list(pack["default_answer"]) == ["我还在学习中～"]
+    assert KnowledgePack.read_digest(path) == pack.digest.hex()
+
+    # 自动机返回最早加入的命中条目，和未编译时的优先级一致
+    assert pack.first_chat_match("看看天气预报") == 0
+    assert pack.first_chat_match("外面在下雨吗") == 0
+    assert pack.first_chat_match("你好") is None
+
+    assert pack.study_item(study_weight_id("古诗", "床前明月光")) == "床前明月光"
+    assert pack.study_item(study_weight_id("古诗", "不在包里")) is None
+    assert pack.study_item("dia_123") is None and pack.study_item("stu_xyz") is None
+
+    dictionary = pack.dictionary("单词")
+    assert dictionary.lookup("appl") == ["apple - 苹果", "apply - 申请"]
+    assert dictionary.exact("申请") == ["apply - 申请"]
+    assert pack.dictionary("古诗") is None
+    # 包上的词典只读，新学的词条进叠加词典
+    assert dictionary.add("apt - 恰当的") and dictionary.lookup("ap")[0] == "apt - 恰当的"
+
+    # 进程池传参按路径重新打开
+    assert list(pickle.loads(pickle.dumps(pack))["chat"]) == PACK_KNOWLEDGE["chat"]
+
+
+def test_empty_knowledge_compiles_to_a_usable_pack(tmp_path):
+    from core.knowledge.knowledge_pack import KnowledgePack, compile_pack
+
+    path = str(tmp_path / "empty.pack")
+    assert compile_pack({}, path)["chat"] == 0
+    pack = KnowledgePack(path)
+    assert len(pack["chat"]) == 0 and len(pack["study"]) == 0 and list(pack["default_answer"]) == []
+    assert pack.first_chat_match("天气") is None
+    assert pack.dictionary("单词") is None
+    with pytest.raises(IndexError):
+        pack["chat"][0]
+
+
+def test_invalid_or_missing_knowledge_pack_is_rejected(tmp_path, sandbox):
+    from core.knowledge.knowledge_pack import KnowledgePack, compile_pack
+    from core.knowledge.knowledge_state import load_knowledge
+
+    path = str(tmp_path / "broken.pack")
+    compile_pack(PACK_KNOWLEDGE, path)
+    with open(path, "r+b") as f:
+        f.write(b"NOTAPACK")
+    with pytest.raises(ValueError):
+        KnowledgePack(path)
+    assert KnowledgePack.read_digest(path) is None
+    with open(path, "wb") as f:
+        f.write(b"PET")
+    assert KnowledgePack.read_digest(path) is None
+
+    with pytest.raises(FileNotFoundError):
+        load_knowledge(os.path.join(sandbox.resources_dir, "missing.pack"))
+    sandbox.settings(knowledge_pack="missing.pack")
+    with pytest.raises(FileNotFoundError):
+        sandbox.matcher()
+
+
+def test_knowledge_pack_command_line(tmp_path, capsys):
+    from core.knowledge.knowledge_pack import KnowledgePack, main
+
+    source, output = tmp_path / "knowledge.json", str(tmp_path / "knowledge.pack")
+    source.write_text(json.dumps(PACK_KNOWLEDGE, ensure_ascii=False), encoding="utf-8")
+    assert main([str(source), output, "--dictionary", "古诗"]) == 0
+    assert "已生成知识包" in capsys.readouterr().out
+
+    pack = KnowledgePack(output)
+    # 摘要取自源文件原始字节，--dictionary 替换默认的词典类别
+    assert pack.digest == hashlib.sha1(source.read_bytes()).digest()
+    assert pack.dictionary("单词") is None and pack.dictionary("古诗") is not None
+
+
+# ---------- 学习触发关键词 ----------
+def test_study_trigger_takes_earliest_then_longest_category(sandbox):
+    sandbox.knowledge({"chat": [], "study": {"英语": ["hello"], "英语单词": ["apple - 苹果"], "古诗": ["静夜思"]},
+                       "default_answer": ["我还在学习中～"]})
+    sandbox.learned({"new_chat": [], "new_study": {"单词": ["pear - 梨"]}})
+    matcher = sandbox.matcher()
+
+    assert matcher.get_study_trigger("我想学古诗和英语") == "古诗"
+    # 同一位置开始的取最长的类别名
+    assert matcher.get_study_trigger("来点英语单词") == "英语单词"
+    assert matcher.get_study_trigger("背单词") == "单词"
+    assert matcher.get_study_trigger("今天天气不错") is None
+    assert matcher.get_study_trigger("") is None
+
+
+def test_taught_study_type_becomes_a_trigger(sandbox):
+    sandbox.settings(index_cache=True)
+    matcher = sandbox.matcher()
+    assert matcher.get_study_trigger("来个成语") is None
+
+    matcher.learn_from_user("加 成语 画蛇添足")
+    assert matcher.get_study_trigger("来个成语") == "成语"
+    # 同类别再教一条不重复加关键词
+    matcher.learn_from_user("加 成语 守株待兔")
+    assert matcher.get_study_trigger("成语接龙") == "成语"
+
+    # 重启后从缓存的索引补上新类别
+    sandbox.restart()
+    assert sandbox.matcher().get_study_trigger("来个成语") == "成语"
+
+
+def test_study_trigger_error_returns_none(sandbox, capsys):
+    matcher = sandbox.matcher()
+    assert matcher.get_study_trigger(None) is None
+    assert "检测学习关键词异常" in capsys.readouterr().out
@@ -0,0 +1,740 @@
+import json
+import os
+
+from core.storage.chat_log import ChatLog, encode_record
+from utils.file_helper import flush_pending_writes, iter_jsonl
+
+
+def _record(dialog_id, timestamp, user_input="你好"):
+    return {
+        "dialog_id": dialog_id,
+        "user_input": user_input,
+        "pet_reply": "你好呀",
+        "related_dialog_id": "",
+        "timestamp": timestamp,
+        "rating": None,
+        "weight": 1.0
+    }
+
+
+def _open_log(tmp_path):
+    return ChatLog(str(tmp_path / "chat_history"), legacy_paths=())
+
+
+# ---------- 聊天记录：定宽字段原地更新 ----------
+def test_rating_update_rewrites_line_in_place(tmp_path):
+    log = _open_log(tmp_path)
+    for i in range(3):
+        log.append(_record(f"dia_{i}", 1700000000000 + i))
+    name, offset, length = log.index["dia_1"]
+    size = os.path.getsize(os.path.join(log.log_dir, name))
+
+    updated = log.update("dia_1", rating=5, weight=2.0)
+
+    assert updated["rating"] == 5
+    # 行长度不变：原地覆盖，不追加新版本，索引也不用改
+    assert log.index["dia_1"] == (name, offset, length)
+    assert os.path.getsize(os.path.join(log.log_dir, name)) == size
+    assert log.find("dia_1")["weight"] == 2.0
+    assert [r["dialog_id"] for r in log.iter_records()] == ["dia_0", "dia_1", "dia_2"]
+
+
+def test_rating_update_survives_reopen(tmp_path):
+    log = _open_log(tmp_path)
+    for i in range(3):
+        log.append(_record(f"dia_{i}", 1700000000000 + i))
+    log.update("dia_2", rating=1, weight=0.2)
+    flush_pending_writes()
+
+    # 重新打开：只读清单和偏移索引，直接定位到被覆盖的那一行
+    reopened = _open_log(tmp_path)
+    assert reopened.index == log.index
+    record = reopened.find("dia_2")
+    assert (record["rating"], record["weight"]) == (1, 0.2)
+    assert reopened.find("dia_0")["rating"] is None
+
+
+def test_variable_width_update_appends_new_version(tmp_path):
+    log = _open_log(tmp_path)
+    log.append(_record("dia_0", 1700000000000))
+    log.append(_record("dia_1", 1700000000001))
+    old_location = log.index["dia_0"]
+
+    log.update("dia_0", user_input="一句更长的输入")
+
+    # 长度变化时追加新版本并改指索引，旧行在读取时被跳过
+    assert log.index["dia_0"] != old_location
+    assert log.find("dia_0")["user_input"] == "一句更长的输入"
+    records = list(log.iter_records())
+    assert [r["dialog_id"] for r in records] == ["dia_1", "dia_0"]
+    flush_pending_writes()
+    assert _open_log(tmp_path).find("dia_0")["user_input"] == "一句更长的输入"
+
+
+# ---------- 预写日志：崩溃后重放 ----------
+class _JournaledStore:
+    """最小的存储：聊天记录用真实的 ChatLog，其余放内存；和 JsonStore 一样先记日志再修改"""
+
+    def __init__(self, journal, chat_dir):
+        self.journal = journal
+        self.chat_log = ChatLog(chat_dir, legacy_paths=())
+        self.weights = {}
+        self.ratings = []
+        self.memories = {}
+
+    def append_chat(self, record):
+        self.journal.record("chat_append", record)
+        return self.chat_log.append(record)
+
+    def get_chat(self, dialog_id):
+        return self.chat_log.find(dialog_id)
+
+    def update_chat(self, dialog_id, **fields):
+        self.journal.record("chat_update", {"dialog_id": dialog_id, "fields": fields})
+        return self.chat_log.update(dialog_id, **fields)
+
+    def set_weight(self, weight_id, weight):
+        self.journal.record("weight_set", {"weight_id": weight_id, "weight": weight})
+        self.weights[weight_id] = weight
+
+    def append_rating(self, record):
+        self.journal.record("rating_append", record)
+        self.ratings.append(record)
+
+    def iter_ratings(self):
+        return iter(self.ratings)
+
+    def load_memories(self):
+        return self.memories
+
+    def get_memory(self, memory_id):
+        for items in self.memories.values():
+            for item in items:
+                if item.get("id") == memory_id:
+                    return item
+        return None
+
+    def put_memory(self, memory_type, entry):
+        self.journal.record("memory_put", {"memory_type": memory_type, "entry": entry})
+        self.memories.setdefault(memory_type, []).append(entry)
+
+
+def _record_session(journal):
+    """一次会话的变更只写进日志（模拟存储还没落盘就崩溃）"""
+    journal.record("chat_append", _record("dia_a", 1700000000000))
+    journal.record("chat_append", _record("dia_b", 1700000000001))
+    journal.record("chat_update", {"dialog_id": "dia_a", "fields": {"rating": 5, "weight": 2.0}})
+    journal.record("weight_set", {"weight_id": "dia_a", "weight": 2.0})
+    journal.record("rating_append", {"dialog_id": "dia_a", "rating": 5, "timestamp": 1700000000100})
+    journal.record("memory_put", {"memory_type": "facts", "entry": {"id": "mem_1", "content": "喜欢猫"}})
+
+
+def _snapshot(store):
+    return (list(store.chat_log.iter_records()), dict(store.weights), list(store.ratings),
+            {k: list(v) for k, v in store.memories.items()})
+
+
+def test_journal_replay_restores_and_is_idempotent(tmp_path):
+    from core.storage.journal import Journal
+
+    path = str(tmp_path / "journal.wal")
+    journal = Journal(path, sync_interval=0.01)
+    _record_session(journal)
+    # 崩溃：进程消失，存储里什么都没有，只留下日志
+    del journal
+
+    reopened = Journal(path)
+    store = _JournaledStore(reopened, str(tmp_path / "chat_history"))
+    assert reopened.replay(store) == 6
+    chats, weights, ratings, memories = _snapshot(store)
+    assert [r["dialog_id"] for r in chats] == ["dia_a", "dia_b"]
+    assert store.get_chat("dia_a")["rating"] == 5
+    assert weights == {"dia_a": 2.0}
+    assert len(ratings) == 1
+    assert memories == {"facts": [{"id": "mem_1", "content": "喜欢猫"}]}
+
+    # 重放期间存储写入不会再记进日志；再次重放（如重放中途又崩溃）不产生重复数据
+    assert sum(1 for _ in reopened.entries()) == 6
+    before = _snapshot(store)
+    reopened.replay(store)
+    assert _snapshot(store) == before
+
+
+def test_recover_replays_then_checkpoints(tmp_path, monkeypatch):
+    from core.storage import journal as journal_module
+
+    path = str(tmp_path / "journal.wal")
+    _record_session(journal_module.Journal(path))
+    journal = journal_module.Journal(path)
+    monkeypatch.setattr(journal_module, "_shared_journal", journal)
+    store = _JournaledStore(journal, str(tmp_path / "chat_history"))
+
+    assert journal_module.recover(store) == 6
+    # 检查点后日志被清空，下次启动没有可重放的内容
+    assert not os.path.exists(path)
+    assert journal_module.recover(store) == 0
+    assert store.get_chat("dia_a")["weight"] == 2.0
+
+
+def test_journal_group_commit_syncs_off_caller_thread(tmp_path):
+    from core.storage.journal import Journal
+
+    journal = Journal(str(tmp_path / "journal.wal"), sync_interval=0.01)
+    for i in range(20):
+        journal.record("weight_set", {"weight_id": f"dia_{i}", "weight": 1.0})
+    # 写入立即对读取可见；fsync 由后台线程合并执行
+    assert sum(1 for _ in journal.entries()) == 20
+    assert journal.flush()
+    assert journal.syncs < 20
+    journal.checkpoint()
+    assert sum(1 for _ in journal.entries()) == 0
+
+
+def test_replay_reads_existing_ratings_once(tmp_path):
+    from core.storage.journal import Journal
+
+    path = str(tmp_path / "journal.wal")
+    journal = Journal(path)
+    for i in range(50):
+        journal.record("rating_append", {"dialog_id": f"dia_{i}", "rating": 5, "timestamp": 1700000000000 + i})
+    store = _JournaledStore(Journal(path), str(tmp_path / "chat_history"))
+    store.ratings.append({"dialog_id": "dia_0", "rating": 5, "timestamp": 1700000000000})
+    scans = []
+    iter_ratings = store.iter_ratings
+    store.iter_ratings = lambda: scans.append(1) or iter_ratings()
+
+    assert store.journal.replay(store) == 50
+    # 查重集合在一次重放内共用：不再每条评分都把已有评分扫一遍
+    assert len(scans) == 1
+    assert len(store.ratings) == 50
+
+
+def test_checkpoint_flushes_outside_journal_lock(tmp_path, monkeypatch):
+    import threading
+
+    from core.storage import journal as journal_module
+
+    journal = journal_module.Journal(str(tmp_path / "journal.wal"), sync=False)
+    journal.record("weight_set", {"weight_id": "dia_0", "weight": 1.0})
+    recorded = threading.Event()
+
+    def slow_flush():
+        # 检查点落盘期间，另一个线程记录变更不用等检查点结束
+        writer = threading.Thread(target=lambda: (journal.record("weight_set", {"weight_id": "dia_1", "weight": 2.0}),
+                                                  recorded.set()))
+        writer.start()
+        writer.join(timeout=2)
+
+    monkeypatch.setattr(journal_module, "flush_pending_writes", slow_flush)
+    journal.checkpoint()
+
+    assert recorded.is_set()
+    # 检查点只清掉改名前的旧日志，期间写入的变更留在新日志里
+    assert [e["data"]["weight_id"] for e in journal.entries()] == ["dia_1"]
+
+
+def test_checkpoint_interrupted_by_crash_is_replayed(tmp_path, monkeypatch):
+    from core.storage import journal as journal_module
+
+    path = str(tmp_path / "journal.wal")
+    journal = journal_module.Journal(path, sync=False)
+    journal.record("weight_set", {"weight_id": "dia_a", "weight": 2.0})
+
+    def crash():
+        raise KeyboardInterrupt
+
+    # 旧日志已改名、延迟写入还没落盘时崩溃
+    monkeypatch.setattr(journal_module, "flush_pending_writes", crash)
+    try:
+        journal.checkpoint()
+    except KeyboardInterrupt:
+        pass
+    journal.record("weight_set", {"weight_id": "dia_b", "weight": 0.2})
+    assert os.path.exists(path + ".1")
+    monkeypatch.undo()
+
+    reopened = journal_module.Journal(path)
+    monkeypatch.setattr(journal_module, "_shared_journal", reopened)
+    store = _JournaledStore(reopened, str(tmp_path / "chat_history"))
+    assert journal_module.recover(store) == 2
+    assert store.weights == {"dia_a": 2.0, "dia_b": 0.2}
+    assert not reopened.has_entries()
+
+
+# ---------- 保留策略：字节预算与淘汰前归档 ----------
+def test_oldest_over_budget_counts_records_and_bytes():
+    from core.storage.store import oldest_over_budget, encoded_size
+
+    records = [{"i": i, "text": "x" * 100} for i in range(10)]
+    size = encoded_size(records[:1])
+    assert oldest_over_budget(records) == 0
+    assert oldest_over_budget(records, max_records=4) == 6
+    assert oldest_over_budget(records, max_bytes=size * 3) == 7
+    # 两个预算同时生效时取更严格的
+    assert oldest_over_budget(records, max_records=8, max_bytes=size * 5) == 5
+
+
+def test_trimmed_explorations_are_archived_before_removal(tmp_path):
+    from core.storage.archive import ColdArchive
+    from core.storage.retention import trim_exploration_history
+
+    archive = ColdArchive(str(tmp_path / "archive"), str(tmp_path / "memory_archive.json"))
+    history = {
+        "explorations": [{"exploration_id": f"exp_{i}", "user_response": "好呀" * 20, "timestamp": 1700000000 + i}
+                         for i in range(20)],
+        "user_responses": {f"exp_{i}": "好" for i in range(5)}
+    }
+    policy = {"exploration_max_records": 100, "exploration_max_bytes": 800, "user_responses_max_records": 2}
+
+    reclaimed = trim_exploration_history(history, policy, archive)
+
+    kept = history["explorations"]
+    assert 0 < len(kept) < 20
+    assert kept[-1]["exploration_id"] == "exp_19"
+    assert reclaimed["records"] == (20 - len(kept)) + 3
+    # 淘汰的探索记录可以在归档里按ID找回
+    assert archive.find("explorations", "exp_0", "exploration_id")["timestamp"] == 1700000000
+    assert archive.stats()["explorations"]["records"] == 20 - len(kept)
+    assert list(history["user_responses"]) == ["exp_3", "exp_4"]
+    assert archive.find("user_responses", "exp_0", "key") == {"key": "exp_0", "value": "好"}
+
+
+def test_archived_user_responses_keep_their_original_time(tmp_path):
+    from core.storage.archive import ColdArchive
+    from core.storage.retention import trim_exploration_history
+
+    archive = ColdArchive(str(tmp_path / "archive"), str(tmp_path / "memory_archive.json"))
+    history = {
+        "explorations": [{"exploration_id": f"exp_{i}", "timestamp": 1700000000 + i} for i in range(3)],
+        "user_responses": {"exp_0": "好", "exp_x": {"text": "不知道", "timestamp": 1600000000},
+                           "exp_2": "嗯"}
+    }
+    trim_exploration_history(history, {"exploration_max_records": 1, "user_responses_max_records": 1}, archive)
+
+    # 时间取自同一ID的探索记录（已被淘汰的也算）或回复自带的时间，而不是归档时的当前时间
+    meta = next(m for m in archive.segments.values() if m["kind"] == "user_responses")
+    assert (meta["first_ts"], meta["last_ts"]) == (1600000000000, 1700000000000)
+    assert [r["key"] for r in archive.iter_records("user_responses", end_ts=1700000000000)] == ["exp_0", "exp_x"]
+
+
+# ---------- 冷数据归档：后台执行，已归档对话的关联保留 ----------
+def test_archived_chat_links_survive_and_backfill(tmp_path):
+    from core.storage.archive import ColdArchive
+
+    manifest = str(tmp_path / "memory_archive.json")
+    archive = ColdArchive(str(tmp_path / "archive"), manifest)
+    records = [dict(_record("dia_0", 1700000000000), related_dialog_id="dia_learned"),
+               _record("dia_1", 1700000000001)]
+    archive.write_segment("chat", records, "dialog_id", lambda r: r["timestamp"])
+    assert archive.links("chat") == {"dia_0": "dia_learned"}
+
+    # 旧版本写的清单没有关联：解压一次补上并写回清单
+    with open(manifest, encoding="utf-8") as f:
+        data = json.load(f)
+    for meta in data["segments"]:
+        del meta["links"]
+    with open(manifest, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    reopened = ColdArchive(str(tmp_path / "archive"), manifest)
+    assert reopened.links("chat") == {"dia_0": "dia_learned"}
+    assert "links" in ColdArchive(str(tmp_path / "archive"), manifest).segments[data["segments"][0]["name"]]
+
+
+def test_rating_archived_dialog_reaches_learned_weight(sandbox):
+    from core.storage.archive import get_archive
+    from core.knowledge.weight_manager import WeightManager
+
+    get_archive().write_segment("chat", [dict(_record("dia_old", 1600000000000), related_dialog_id="dia_learned")],
+                                "dialog_id", lambda r: r["timestamp"])
+    manager = WeightManager()
+
+    assert manager.update_dialog_weight("dia_old", 5) == 2.0
+    assert manager.weights["dia_learned"] == 2.0
+    assert manager.get_dialog_weight("dia_old") == 2.0
+
+
+def test_startup_maintenance_runs_off_the_constructing_thread(sandbox, monkeypatch):
+    import threading
+
+    from core.storage import archive, retention
+
+    threads = []
+    monkeypatch.setattr(archive, "archive_cold_data", lambda store: threads.append(threading.current_thread()))
+    monkeypatch.setattr(retention, "compact_data",
+                        lambda store, **options: threads.append(options.get("steps")))
+
+    matcher = sandbox.matcher()
+    matcher.maintenance_thread.join(timeout=5)
+
+    assert threads[0] is not threading.current_thread()
+    # 探索历史由探索引擎自己裁剪，后台压缩不碰它
+    assert "explorations" not in threads[1] and "weights" in threads[1]
+
+
+def test_exploration_engine_trims_history_at_startup(sandbox):
+    from core.config import EXPLORATION_HISTORY_PATH
+    from core.knowledge.exploration_engine import ExplorationEngine
+    from core.storage.archive import get_archive
+
+    sandbox.settings(archive_after_days=0, retention={"exploration_max_records": 5, "exploration_max_days": 0})
+    sandbox.write(EXPLORATION_HISTORY_PATH, {"explorations": [
+        {"exploration_id": f"exp_{i}", "user_response": "好", "timestamp": 1700000000 + i} for i in range(8)
+    ], "user_responses": {}})
+
+    engine = ExplorationEngine({"chat": [], "study": {}})
+
+    assert [e["exploration_id"] for e in engine.exploration_history["explorations"]] == [
+        f"exp_{i}" for i in range(3, 8)]
+    assert get_archive().find("explorations", "exp_0", "exploration_id") is not None
+    assert len(engine.store.load_document(EXPLORATION_HISTORY_PATH)["explorations"]) == 5
+
+
+
+# ---------- 评分、记忆：追加增量日志 ----------
+def test_ratings_and_memories_append_to_logs(sandbox):
+    from core import config
+    from core.storage.store import JsonStore
+
+    store = JsonStore()
+    sandbox.write(config.RATING_RECORD_PATH, [{"dialog_id": "dia_0", "rating": 3, "timestamp": 1}])
+    before = os.path.getmtime(config.RATING_RECORD_PATH)
+    store.append_rating({"dialog_id": "dia_1", "rating": 5, "timestamp": 2})
+    store.put_memory("facts", {"id": "mem_1", "content": "猫", "access_count": 0})
+    store.update_memories([{"id": "mem_1", "content": "猫", "access_count": 2}])
+    flush_pending_writes()
+
+    # 主文件不重写，变更都在增量日志里
+    assert os.path.getmtime(config.RATING_RECORD_PATH) == before
+    assert not os.path.exists(config.EXPLORATION_MEMORY_PATH)
+    assert [r["dialog_id"] for r in store.iter_ratings()] == ["dia_0", "dia_1"]
+    assert store.get_memory("mem_1")["access_count"] == 2
+
+    # 重启时合并进主文件
+    sandbox.restart()
+    reopened = JsonStore()
+    assert not os.path.exists(config.RATING_RECORD_LOG_PATH)
+    assert not os.path.exists(config.EXPLORATION_MEMORY_LOG_PATH)
+    assert [r["dialog_id"] for r in reopened.iter_ratings()] == ["dia_0", "dia_1"]
+    assert reopened.load_memories()["facts"] == [{"id": "mem_1", "content": "猫", "access_count": 2}]
+
+
+def test_record_logs_compact_at_threshold(sandbox, monkeypatch):
+    from core import config
+    from core.storage import store as store_module
+
+    monkeypatch.setattr(store_module, "RECORD_LOG_COMPACT_LINES", 3)
+    store = store_module.JsonStore()
+    for i in range(3):
+        store.append_rating({"dialog_id": f"dia_{i}", "rating": 4, "timestamp": i})
+    store.put_memory("timeline", {"memory_id": "mem_0"})
+    store.put_memory("timeline", {"memory_id": "mem_1"})
+
+    assert not os.path.exists(config.RATING_RECORD_LOG_PATH)
+    assert len(store.load_document(config.RATING_RECORD_PATH)) == 3
+    assert len(list(store_module.iter_jsonl(config.EXPLORATION_MEMORY_LOG_PATH))) == 2
+
+    # 裁剪也先合并日志再重写
+    assert store.trim_timeline(max_records=1)["records"] == 1
+    assert not os.path.exists(config.EXPLORATION_MEMORY_LOG_PATH)
+    assert store.load_memories()["timeline"] == [{"memory_id": "mem_1"}]
+
+
+def test_interrupted_log_compaction_does_not_duplicate(sandbox):
+    from core import config
+    from core.storage.store import JsonStore
+    from utils.file_helper import append_jsonl
+
+    store = JsonStore()
+    # 主文件已写入、日志还没删除时崩溃：日志里的变更已经在主文件里了
+    rating = {"dialog_id": "dia_0", "rating": 5, "timestamp": 1}
+    sandbox.write(config.RATING_RECORD_PATH, [rating])
+    append_jsonl(config.RATING_RECORD_LOG_PATH, rating)
+    sandbox.write(config.EXPLORATION_MEMORY_PATH, {"facts": [{"id": "mem_0"}], "timeline": [{"memory_id": "t_0"}]})
+    append_jsonl(config.EXPLORATION_MEMORY_LOG_PATH, {"op": "put", "memory_type": "facts", "entry": {"id": "mem_0"}})
+    append_jsonl(config.EXPLORATION_MEMORY_LOG_PATH,
+                 {"op": "put", "memory_type": "timeline", "entry": {"memory_id": "t_0"}})
+    with open(config.EXPLORATION_MEMORY_LOG_PATH, "a", encoding="utf-8") as f:
+        f.write('{"op": "put", "memory_ty')
+
+    assert list(store.iter_ratings()) == [rating]
+    assert store.load_memories() == {"facts": [{"id": "mem_0"}], "timeline": [{"memory_id": "t_0"}]}
+    assert store.compact_ratings() and store.compact_memories()
+    assert store.load_document(config.RATING_RECORD_PATH) == [rating]
+
+
+# ---------- SQLite后端 ----------
+def test_sqlite_byte_budget_counts_only_the_trimmed_table(sandbox):
+    from core.storage import sqlite_store
+    from core.storage.store import encoded_size
+
+    store = sqlite_store.SQLiteStore(os.path.join(sandbox.data_dir, "budget.db"))
+    for i in range(5):
+        store.append_chat(dict(_record(f"dia_{i}", 1700000000000 + i, "你好" * 10), rating=None))
+    # 其他表的大量数据让数据库文件远超预算，但聊天记录本身没超
+    for i in range(300):
+        store.put_memory("facts", {"id": f"mem_{i}", "content": "很长的记忆" * 20})
+    chats = list(store.iter_chats())
+    row_bytes = store.conn.execute(
+        f"SELECT {sqlite_store.row_size_sql(sqlite_store.CHAT_COLUMNS)} FROM chat_records WHERE dialog_id = 'dia_0'"
+    ).fetchone()[0]
+    assert row_bytes == encoded_size([chats[0]])
+    assert os.path.getsize(store.db_path) > encoded_size(chats) * 2
+
+    assert store.evict_chats(max_bytes=encoded_size(chats))["records"] == 0
+    assert store.evict_chats(max_bytes=encoded_size(chats[2:]))["records"] == 2
+    assert [r["dialog_id"] for r in store.iter_chats()] == ["dia_2", "dia_3", "dia_4"]
+    store.close()
+
+
+def test_sqlite_iterates_rows_in_batches(sandbox, monkeypatch):
+    from core.storage import sqlite_store
+
+    monkeypatch.setattr(sqlite_store, "ITER_BATCH_ROWS", 2)
+    store = sqlite_store.SQLiteStore(os.path.join(sandbox.data_dir, "batches.db"))
+    for i in range(5):
+        store.append_chat(_record(f"dia_{i}", 1700000000000 + i))
+        store.append_rating({"dialog_id": f"dia_{i}", "rating": 4, "timestamp": 1700000000000 + i})
+
+    chats = store.iter_chats()
+    assert next(chats)["dialog_id"] == "dia_0"
+    # 两批之间不持有锁，其他写入照常进行
+    store.append_chat(_record("dia_late", 1700000000100))
+    assert [r["dialog_id"] for r in chats][:4] == ["dia_1", "dia_2", "dia_3", "dia_4"]
+    assert [r["dialog_id"] for r in store.iter_chats_between(1700000000001, 1700000000003)] == [
+        "dia_1", "dia_2", "dia_3"]
+    assert len(list(store.iter_ratings())) == 5
+    store.close()
+
+
+# ---------- 聊天记录：追加写入与旧文件迁移 ----------
+def test_legacy_chat_history_is_migrated_once(tmp_path):
+    legacy_json = str(tmp_path / "chat_history.json")
+    legacy_jsonl = str(tmp_path / "chat_log.jsonl")
+    with open(legacy_json, "w", encoding="utf-8") as f:
+        json.dump([_record("dia_0", 1700000000000), "不是记录", _record("dia_1", 1700000000001)], f)
+    with open(legacy_jsonl, "w", encoding="utf-8") as f:
+        f.write(json.dumps(_record("dia_2", 1700000000002)) + "\n")
+        f.write('{"dialog_id": "dia_3", "user_in')  # 崩溃时写了一半的行
+
+    log = ChatLog(str(tmp_path / "chat_history"), legacy_paths=(legacy_jsonl, legacy_json))
+
+    assert sorted(r["dialog_id"] for r in log.iter_records()) == ["dia_0", "dia_1", "dia_2"]
+    assert os.path.exists(legacy_json + ".migrated") and not os.path.exists(legacy_json)
+    assert os.path.exists(legacy_jsonl + ".migrated") and not os.path.exists(legacy_jsonl)
+    flush_pending_writes()
+    reopened = ChatLog(str(tmp_path / "chat_history"), legacy_paths=(legacy_jsonl, legacy_json))
+    assert reopened.stats()["lines"] == 3
+    assert reopened.find("dia_1")["timestamp"] == 1700000000001
+
+
+def test_torn_tail_line_is_dropped_before_next_append(tmp_path):
+    log = _open_log(tmp_path)
+    log.append(_record("dia_0", 1700000000000))
+    flush_pending_writes()
+    name = next(iter(log.segments))
+    with open(os.path.join(log.log_dir, name), "ab") as f:
+        f.write(b'{"dialog_id": "dia_torn", "user_')
+
+    reopened = _open_log(tmp_path)
+    assert reopened.find("dia_torn") is None
+    reopened.append(_record("dia_1", 1700000000001))
+    assert [r["dialog_id"] for r in reopened.iter_records()] == ["dia_0", "dia_1"]
+    with open(os.path.join(log.log_dir, name), "rb") as f:
+        assert b"dia_torn" not in f.read()
+
+
+def test_each_reply_appends_one_chat_line(sandbox):
+    from core.storage.store import get_store
+
+    matcher = sandbox.matcher()
+    chat_log = get_store().chat_log
+    matcher.match_chat("你好")
+    before = chat_log.stats()
+    _, dialog_id = matcher.match_chat("你好")
+    after = chat_log.stats()
+
+    assert after["lines"] == before["lines"] + 1
+    assert after["bytes"] - before["bytes"] == len(encode_record(chat_log.find(dialog_id)))
+    assert [r["dialog_id"] for r in get_store().tail_chats(1)] == [dialog_id]
+
+
+def test_sqlite_store_imports_json_and_round_trips(sandbox):
+    from core import config
+    from core.storage.sqlite_store import SQLiteStore
+    from core.storage.store import JsonStore
+
+    json_store = JsonStore()
+    json_store.append_chat(_record("dia_0", 1700000000000))
+    json_store.append_rating({"dialog_id": "dia_0", "related_dialog_id": "", "weight_id": "dia_0",
+                              "rating": 5, "timestamp": 1700000000001})
+    json_store.set_weight("dia_0", 2.0)
+    json_store.put_memory("facts", {"id": "mem_0", "content": "猫会爬树"})
+    json_store.save_document(config.USER_INTERESTS_PATH, {"猫": 3})
+    flush_pending_writes()
+
+    # 第一次创建数据库时导入现有JSON数据
+    db_path = os.path.join(sandbox.data_dir, "storage.db")
+    store = SQLiteStore(db_path)
+    assert [r["dialog_id"] for r in store.iter_chats()] == ["dia_0"]
+    assert [r["rating"] for r in store.iter_ratings()] == [5]
+    assert store.load_weights() == {"dia_0": 2.0}
+    assert store.get_memory("mem_0")["content"] == "猫会爬树"
+    assert store.load_document(config.USER_INTERESTS_PATH) == {"猫": 3}
+
+    store.update_chat("dia_0", rating=4, weight=1.0)
+    store.update_memories([{"id": "mem_0", "content": "猫会游泳"}])
+    store.close()
+
+    # 重新打开不再重复导入；导出的JSON与数据库内容一致
+    reopened = SQLiteStore(db_path)
+    assert reopened.get_chat("dia_0")["rating"] == 4
+    assert len(list(reopened.iter_ratings())) == 1
+    assert reopened.get_memory("mem_0")["content"] == "猫会游泳"
+    target = reopened.export_json(os.path.join(sandbox.data_dir, "export"))
+    with open(os.path.join(target, "dialog_weights.json"), encoding="utf-8") as f:
+        assert json.load(f) == {"dia_0": 2.0}
+    with open(os.path.join(target, "chat_history.json"), encoding="utf-8") as f:
+        assert json.load(f)[0]["rating"] == 4
+    reopened.close()
+
+
+def test_sqlite_backend_falls_back_to_json_store(sandbox, monkeypatch):
+    import sqlite3
+
+    from core.storage import sqlite_store, store
+
+    sandbox.settings(storage_backend="sqlite")
+
+    def broken(*args, **kwargs):
+        raise sqlite3.DatabaseError("file is not a database")
+    monkeypatch.setattr(sqlite_store, "SQLiteStore", broken)
+
+    assert store.get_store().name == "json"
+
+
+# ---------- load_json 缓存 ----------
+def test_load_json_serves_saved_documents_from_cache(tmp_path, capsys):
+    from utils.file_helper import json_cache, load_json, save_json
+
+    path = str(tmp_path / "weights.json")
+    save_json(path, {"dia_0": 1.0})
+    hits = json_cache.hits
+    data = load_json(path)
+    assert data == {"dia_0": 1.0} and json_cache.hits == hits + 1
+    # 取出的是副本，修改它不会污染缓存
+    data["dia_0"] = 9.0
+    assert load_json(path) == {"dia_0": 1.0}
+
+    # 文件在外部被改写（大小变了）：缓存失效，重新解析
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"dia_0": 2.0, "dia_1": 1.0}, f)
+    misses = json_cache.misses
+    assert load_json(path) == {"dia_0": 2.0, "dia_1": 1.0}
+    assert json_cache.misses == misses + 1
+
+    # 文件损坏时返回默认值
+    with open(path, "w", encoding="utf-8") as f:
+        f.write('{"dia_0": ')
+    assert load_json(path, {"fallback": True}) == {"fallback": True}
+    assert "加载JSON文件失败" in capsys.readouterr().out
+
+
+def test_json_cache_evicts_least_recently_used_over_budget():
+    from utils.file_helper import JsonCache
+
+    cache = JsonCache(max_bytes=200)
+    cache.put("a", (1, 1), "x" * 80)
+    cache.put("b", (1, 1), "y" * 80)
+    assert cache.get("a", (1, 1))[0]
+    cache.put("c", (1, 1), "z" * 80)
+
+    # b 最久未用，先被淘汰；超过整个预算的文档不缓存
+    assert not cache.get("b", (1, 1))[0]
+    assert cache.get("a", (1, 1)) == (True, "x" * 80)
+    cache.put("huge", (1, 1), "h" * 500)
+    assert not cache.get("huge", (1, 1))[0]
+    assert cache.stats()["bytes"] <= 200
+    # 校验键不同（文件变了）视为未命中
+    assert not cache.get("a", (2, 1))[0]
+
+
+# ---------- 权重：常驻内存的权重表，增量持久化 ----------
+def test_weight_table_is_resident_and_persisted_incrementally(sandbox, monkeypatch):
+    from core import config
+    from core.knowledge.weight_manager import WeightManager
+    from core.storage.store import get_store
+
+    get_store().append_chat(dict(_record("dia_0", 1700000000000), related_dialog_id="dia_learned"))
+    manager = WeightManager()
+    # 启动后不再扫描聊天记录
+    monkeypatch.setattr(manager.store, "iter_chats", lambda: iter(()).throw(AssertionError))
+
+    assert manager.update_dialog_weight("dia_0", 5) == manager.HIGH_WEIGHT
+    assert manager.update_dialog_weight("dia_9", 1) == manager.LOW_WEIGHT
+    assert not os.path.exists(config.DIALOG_WEIGHTS_PATH)
+    assert [d["weight_id"] for d in iter_jsonl(config.DIALOG_WEIGHTS_LOG_PATH)] == ["dia_learned", "dia_9"]
+    # 一次批量取多条，顺序与输入一致；没有权重的用默认值
+    assert manager.get_dialog_weights(["dia_9", "dia_0", "dia_learned", "dia_new"]) == [
+        manager.LOW_WEIGHT, manager.HIGH_WEIGHT, manager.HIGH_WEIGHT, manager.DEFAULT_WEIGHT]
+
+    # 重启：增量合并进主文件，损坏的尾行跳过
+    with open(config.DIALOG_WEIGHTS_LOG_PATH, "a", encoding="utf-8") as f:
+        f.write('{"weight_id": "dia_x", "wei')
+    sandbox.restart()
+    reopened = WeightManager()
+    assert reopened.weights == {"dia_learned": manager.HIGH_WEIGHT, "dia_9": manager.LOW_WEIGHT}
+    assert sorted(reopened.store.load_document(config.DIALOG_WEIGHTS_PATH)) == ["dia_9", "dia_learned"]
+    assert reopened.get_dialog_weight("dia_0") == manager.HIGH_WEIGHT
+
+
+def test_rating_thresholds_map_to_weights(sandbox):
+    from core.knowledge.weight_manager import WeightManager
+
+    manager = WeightManager()
+    assert [manager.calculate_weight(rating) for rating in (1, 2, 3, 4, 5)] == [
+        manager.LOW_WEIGHT, manager.LOW_WEIGHT, manager.DEFAULT_WEIGHT, manager.HIGH_WEIGHT, manager.HIGH_WEIGHT]
+
+
+# ---------- 聊天记录：按天分段和时间范围查询 ----------
+DAY_MS = 86400000
+
+
+def test_range_queries_open_only_overlapping_segments(tmp_path, monkeypatch):
+    log = _open_log(tmp_path)
+    for day in range(3):
+        for i in range(2):
+            log.append(_record(f"dia_{day}_{i}", 1700000000000 + day * DAY_MS + i))
+    assert len(log.segments) == 3
+
+    opened = []
+    iter_segment = log.iter_segment
+    monkeypatch.setattr(log, "iter_segment", lambda name: opened.append(name) or iter_segment(name))
+    records = list(log.iter_range(1700000000000 + DAY_MS, 1700000000000 + DAY_MS))
+    assert [r["dialog_id"] for r in records] == ["dia_1_0"]
+    assert opened == [sorted(log.segments)[1]]
+
+    # 最近n条从最新的分段往前读，够数就停
+    opened.clear()
+    assert [r["dialog_id"] for r in log.tail(2)] == ["dia_2_0", "dia_2_1"]
+    assert opened == [sorted(log.segments)[2]]
+    assert log.tail(0) == [] and len(log.tail(100)) == 6
+
+
+def test_segments_roll_over_at_size_limit_and_manifest_is_rebuilt(tmp_path, monkeypatch):
+    from core.storage import chat_log
+
+    monkeypatch.setattr(chat_log, "SEGMENT_MAX_BYTES", 300)
+    log = _open_log(tmp_path)
+    for i in range(6):
+        log.append(_record(f"dia_{i}", 1700000000000 + i))
+    flush_pending_writes()
+    assert len(log.segments) > 1
+    assert len({meta["day"] for meta in log.segments.values()}) == 1
+
+    # 清单和文件对不上（文件被替换过）时从分段文件整体重建
+    with open(log.manifest_path, "w", encoding="utf-8") as f:
+        json.dump({"segments": [dict(meta, bytes=10 ** 6) for meta in log.segments.values()]}, f)
+    reopened = _open_log(tmp_path)
+    assert [r["dialog_id"] for r in reopened.iter_records()] == [f"dia_{i}" for i in range(6)]
+    assert reopened.stats()["lines"] == 6
+    assert reopened.find("dia_5")["timestamp"] == 1700000000005
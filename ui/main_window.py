@@ -375,6 +375,13 @@ class PetWindow(QWidget):
         except Exception as e:
             self.logger.error(f"保存状态失败: {e}")
 
+        # 强制写完所有延迟保存的数据，并清空变更日志（检查点）
+        try:
+            from core.storage.journal import get_journal
+            get_journal().checkpoint()
+        except Exception as e:
+            self.logger.error(f"写入延迟数据失败: {e}")
+
         # 隐藏托盘
         self.tray_icon.hide()
 
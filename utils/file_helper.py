@@ -1,9 +1,14 @@
+import atexit
 import json
 import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
 
 from PyQt5.QtCore import QTimer
 
-from core import DATA_DIR
+from core.config import DATA_DIR
 
 
 class ActivePushTimer:
@@ -20,7 +25,7 @@ class ActivePushTimer:
         """更新间隔"""
         if seconds is None:
             # 从设置加载
-            from core import load_settings
+            from core.config import load_settings
             settings = load_settings()
             seconds = settings.get("active_push_interval", 3600)
 
@@ -44,30 +49,302 @@ def init_data_dir():
     if not os.path.exists(DATA_DIR):
         os.makedirs(DATA_DIR)
 
+class JsonCache:
+    """进程内的JSON解析结果缓存
+    - 按绝对路径存放，用文件的 (mtime, size) 校验是否过期
+    - 存的是解析结果的pickle快照：每次取出都是独立副本，调用方随意修改也不会污染缓存，
+      且反序列化比重新解析JSON快得多
+    - 超出字节预算时按最久未使用淘汰
+    """
+
+    def __init__(self, max_bytes=32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # path -> (stat_key, snapshot)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def stat_key(file_path):
+        """文件的校验键 (mtime_ns, size)，文件不存在返回None"""
+        try:
+            st = os.stat(file_path)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def get(self, file_path, stat_key):
+        """命中返回 (True, 数据副本)，未命中返回 (False, None)"""
+        with self._lock:
+            entry = self._entries.get(file_path)
+            if entry is None or entry[0] != stat_key:
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(file_path)
+            self.hits += 1
+            snapshot = entry[1]
+        return True, pickle.loads(snapshot)
+
+    def put(self, file_path, stat_key, data):
+        """写入缓存（单个文档超过预算时不缓存）"""
+        self.put_snapshot(file_path, stat_key, pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL))
+
+    def put_snapshot(self, file_path, stat_key, snapshot):
+        """直接写入已序列化的快照"""
+        with self._lock:
+            self._discard(file_path)
+            if len(snapshot) > self.max_bytes:
+                return
+            self._entries[file_path] = (stat_key, snapshot)
+            self._bytes += len(snapshot)
+            while self._bytes > self.max_bytes:
+                _, (_, old) = self._entries.popitem(last=False)
+                self._bytes -= len(old)
+
+    def invalidate(self, file_path=None):
+        """让指定文件（或全部）缓存失效"""
+        with self._lock:
+            if file_path is None:
+                self._entries.clear()
+                self._bytes = 0
+            else:
+                self._discard(file_path)
+
+    def _discard(self, file_path):
+        entry = self._entries.pop(file_path, None)
+        if entry is not None:
+            self._bytes -= len(entry[1])
+
+    def stats(self):
+        """缓存统计：命中/未命中次数、命中率、条目数和占用字节"""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes
+        }
+
+
+json_cache = JsonCache()
+
+def get_json_cache_stats():
+    """获取load_json缓存的统计信息"""
+    return json_cache.stats()
+
 def load_json(file_path, default=None):
-    """加载JSON文件，文件不存在返回默认值"""
+    """加载JSON文件，文件不存在返回默认值（文件未变化时直接使用缓存）"""
     if default is None:
         default = {}
-    if not os.path.exists(file_path):
+    cache_path = os.path.abspath(file_path)
+    stat_key = JsonCache.stat_key(cache_path)
+    # 还在等待后台写入的数据优先（保证写后立即可读）
+    hit, data = write_behind.get_pending(cache_path)
+    if hit:
+        return data
+    if stat_key is None:
         return default
+
+    hit, data = json_cache.get(cache_path, stat_key)
+    if hit:
+        return data
     try:
         with open(file_path, "r", encoding="utf-8") as f:
-            return json.load(f)
+            data = json.load(f)
     except Exception as e:
         print(f"加载JSON文件失败 {file_path}：{e}")
         return default
+    json_cache.put(cache_path, stat_key, data)
+    return data
+
+def _atomic_write_json(file_path, data):
+    """先写临时文件再改名替换，崩溃时不会留下写了一半的文件"""
+    tmp_path = f"{file_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=4)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, file_path)
 
 def save_json(file_path, data):
-    """保存数据到JSON文件"""
+    """保存数据到JSON文件（同时刷新缓存，下次读取无需重新解析）"""
+    cache_path = os.path.abspath(file_path)
+    # 同步写入会覆盖同一文件尚未落盘的延迟写入
+    write_behind.discard(cache_path)
     try:
-        with open(file_path, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=4)
+        with write_behind.io_lock:
+            _atomic_write_json(cache_path, data)
+        json_cache.put(cache_path, JsonCache.stat_key(cache_path), data)
         return True
     except Exception as e:
+        json_cache.invalidate(cache_path)
         print(f"保存JSON文件失败 {file_path}：{e}")
         return False
 
+class WriteBehindWriter:
+    """延迟合并的后台写入器
+    - save_json_deferred 只把文档标记为脏（保存一份快照），立即返回
+    - 同一文件在合并窗口内的多次写入只落盘最后一次
+    - 由后台线程负责写盘（临时文件+改名），退出时 flush() 强制同步写完
+    """
+
+    def __init__(self, delay=0.5):
+        self.delay = delay  # 合并窗口（秒）
+        self._dirty = {}  # path -> (deadline, snapshot)
+        self._writing = {}  # 正在写盘的快照，写完前仍对读取可见
+        self._cond = threading.Condition()
+        self.io_lock = threading.Lock()  # 串行化所有写盘操作
+        self._thread = None
+        self.writes_requested = 0
+        self.writes_done = 0
+
+    def set_delay(self, delay):
+        """设置合并窗口（秒）"""
+        with self._cond:
+            self.delay = max(0.0, float(delay))
+            self._cond.notify_all()
+
+    def mark_dirty(self, file_path, data):
+        """标记文档待写入（保存调用时刻的快照）"""
+        snapshot = pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._cond:
+            self.writes_requested += 1
+            # 保留首次标记的截止时间，窗口内的后续写入直接合并
+            deadline = self._dirty[file_path][0] if file_path in self._dirty else time.monotonic() + self.delay
+            self._dirty[file_path] = (deadline, snapshot)
+            self._ensure_thread()
+            self._cond.notify_all()
+
+    def get_pending(self, file_path):
+        """读取尚未落盘的数据，没有返回 (False, None)"""
+        with self._cond:
+            if file_path in self._dirty:
+                snapshot = self._dirty[file_path][1]
+            elif file_path in self._writing:
+                snapshot = self._writing[file_path]
+            else:
+                return False, None
+        return True, pickle.loads(snapshot)
+
+    def discard(self, file_path):
+        """丢弃某文件尚未落盘的数据（被同步写入覆盖时）"""
+        with self._cond:
+            self._dirty.pop(file_path, None)
+            self._writing.pop(file_path, None)
+            self._cond.notify_all()
+
+    def has_pending(self):
+        """是否还有未落盘的数据"""
+        with self._cond:
+            return bool(self._dirty or self._writing)
+
+    def flush(self):
+        """同步写完所有脏文档（退出程序前、日志检查点前调用）
+        返回时后台线程已经取走、正在写的快照也都已落盘"""
+        with self._cond:
+            due = {path: snapshot for path, (_, snapshot) in self._dirty.items()}
+            self._dirty.clear()
+            self._writing.update(due)
+        self._write(due)
+        with self._cond:
+            while self._writing:
+                self._cond.wait()
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="json-write-behind", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._dirty:
+                        wait = min(d for d, _ in self._dirty.values()) - time.monotonic()
+                        if wait <= 0:
+                            break
+                        self._cond.wait(wait)
+                    else:
+                        self._cond.wait()
+                now = time.monotonic()
+                due = {path: snapshot for path, (deadline, snapshot) in self._dirty.items()
+                       if deadline <= now}
+                for path in due:
+                    del self._dirty[path]
+                self._writing.update(due)
+            self._write(due)
+
+    def _write(self, due):
+        with self.io_lock:
+            for path, snapshot in due.items():
+                with self._cond:
+                    # 已被更新的快照或同步写入取代，不能用旧数据覆盖
+                    if self._writing.get(path) is not snapshot:
+                        continue
+                try:
+                    _atomic_write_json(path, pickle.loads(snapshot))
+                    json_cache.put_snapshot(path, JsonCache.stat_key(path), snapshot)
+                    self.writes_done += 1
+                except Exception as e:
+                    print(f"后台保存JSON文件失败 {path}：{e}")
+                finally:
+                    with self._cond:
+                        if self._writing.get(path) is snapshot:
+                            del self._writing[path]
+                        # 唤醒等待落盘的 flush()
+                        self._cond.notify_all()
+
+    def stats(self):
+        """写入统计：请求次数、实际落盘次数、待写文档数"""
+        with self._cond:
+            return {
+                "writes_requested": self.writes_requested,
+                "writes_done": self.writes_done,
+                "pending": len(self._dirty) + len(self._writing),
+                "delay": self.delay
+            }
+
+
+write_behind = WriteBehindWriter()
+atexit.register(write_behind.flush)
+
+def save_json_deferred(file_path, data):
+    """延迟保存：标记为脏后立即返回，由后台线程合并写盘"""
+    write_behind.mark_dirty(os.path.abspath(file_path), data)
+    return True
+
+def flush_pending_writes():
+    """同步写完所有延迟保存的数据"""
+    write_behind.flush()
+
+def append_jsonl(file_path, record):
+    """追加一条记录到JSON Lines文件（每行一条，不重写整个文件）"""
+    try:
+        with open(file_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        return True
+    except Exception as e:
+        print(f"追加JSONL记录失败 {file_path}：{e}")
+        return False
+
+def iter_jsonl(file_path):
+    """逐行流式读取JSON Lines文件，跳过损坏的行（如崩溃时写了一半的最后一行）"""
+    if not os.path.exists(file_path):
+        return
+    with open(file_path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                print(f"跳过损坏的JSONL行 {file_path}:{line_no}")
+
 def generate_dialog_id():
-    """生成唯一对话ID"""
-    import time
-    return f"dia_{int(time.time() * 1000)}"
\ No newline at end of file
+    """生成唯一对话ID（时间有序，同一毫秒内也不会重复）"""
+    from utils.id_allocator import new_id
+    return new_id("dia")
\ No newline at end of file
@@ -0,0 +1,48 @@
+"""
+文件变化监视：后台线程定时比较文件的 (mtime, size)，发现变化时在该线程里回调
+不依赖外部服务或系统通知，适合监视少量配置/知识文件
+"""
+import threading
+
+from utils.file_helper import JsonCache
+
+
+class FileWatcher:
+    """轮询监视一组文件，变化时调用 callback(变化的路径列表)"""
+
+    def __init__(self, paths, callback, interval=2.0):
+        self.paths = list(paths)
+        self.callback = callback
+        self.interval = interval
+        self.known = {path: JsonCache.stat_key(path) for path in self.paths}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """启动后台轮询线程"""
+        if self._thread is None and self.interval and self.interval > 0:
+            self._thread = threading.Thread(target=self._run, name="file-watcher", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def acknowledge(self, path, stat_key=None):
+        """把文件的某个状态记为已知（自己写的文件不触发回调），默认取当前状态"""
+        self.known[path] = JsonCache.stat_key(path) if stat_key is None else stat_key
+
+    def check(self):
+        """轮询一次，有变化时回调并返回变化的路径"""
+        changed = [path for path in self.paths if JsonCache.stat_key(path) != self.known.get(path)]
+        if changed:
+            for path in changed:
+                self.acknowledge(path)
+            try:
+                self.callback(changed)
+            except Exception as e:
+                print(f"处理文件变化失败 {changed}：{e}")
+        return changed
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.check()
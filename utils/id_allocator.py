@@ -0,0 +1,95 @@
+"""
+ID分配器：按时间单调递增、不会重复的ID（对话、记忆、探索共用）
+64位整数 = 41位毫秒时间戳（自2024-01-01起） | 10位节点号 | 12位序号
+对外用定长13位Crockford Base32编码，新ID之间字符串顺序与生成顺序一致，可直接排序、二分查找
+旧格式ID（dia_<毫秒>、mem_<hex>_<毫秒>）和新ID混在一起时字符串顺序不代表时间顺序，
+要按 id_sort_key（取ID中记录的时间戳）排序
+"""
+import os
+import threading
+import time
+
+EPOCH_MS = 1704067200000  # 2024-01-01 00:00:00 UTC
+NODE_BITS = 10
+SEQUENCE_BITS = 12
+MAX_NODE = (1 << NODE_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+
+ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"  # Crockford Base32，去掉易混淆的 I L O U
+ENCODED_LENGTH = 13  # 13 * 5 = 65位，足够放下64位整数
+_DECODE_MAP = {c: i for i, c in enumerate(ALPHABET)}
+
+
+def encode_id(value):
+    """把64位整数编码成定长Base32字符串"""
+    chars = []
+    for _ in range(ENCODED_LENGTH):
+        chars.append(ALPHABET[value & 0x1F])
+        value >>= 5
+    return "".join(reversed(chars))
+
+
+def decode_id(text):
+    """把Base32字符串解码回整数"""
+    value = 0
+    for c in text.upper():
+        value = (value << 5) | _DECODE_MAP[c]
+    return value
+
+
+class IdAllocator:
+    """线程安全的时间有序ID分配器"""
+
+    def __init__(self, node=None):
+        if node is None:
+            node = os.getpid()  # 默认用进程号区分同时运行的多个进程
+        self.node = node & MAX_NODE
+        self._lock = threading.Lock()
+        self._last_ms = 0
+        self._sequence = 0
+
+    def next_int(self):
+        """分配下一个整数ID"""
+        with self._lock:
+            now = int(time.time() * 1000) - EPOCH_MS
+            if now > self._last_ms:
+                self._last_ms = now
+                self._sequence = 0
+            else:
+                # 同一毫秒（或系统时钟回拨）时递增序号，序号用完就借用下一毫秒
+                self._sequence += 1
+                if self._sequence > MAX_SEQUENCE:
+                    self._last_ms += 1
+                    self._sequence = 0
+            return (self._last_ms << (NODE_BITS + SEQUENCE_BITS)) | (self.node << SEQUENCE_BITS) | self._sequence
+
+    def next_id(self, prefix):
+        """分配带前缀的字符串ID，如 dia_01HZX3K5Q0A00"""
+        return f"{prefix}_{encode_id(self.next_int())}"
+
+
+def id_timestamp(id_text):
+    """从ID中取出毫秒时间戳，兼容旧格式（dia_<毫秒>、mem_<hex>_<毫秒>），无法解析返回None"""
+    body = str(id_text).split("_", 1)[-1]
+    if "_" in body:
+        body = body.rsplit("_", 1)[-1]  # 旧格式 mem_<hex>_<毫秒>
+    if body.isdigit() and not body.startswith("0"):
+        # 旧格式的毫秒时间戳不以0开头；新ID在2^60毫秒前首位都是0，可能碰巧全是数字
+        return int(body)
+    if len(body) == ENCODED_LENGTH and all(c in _DECODE_MAP for c in body.upper()):
+        return (decode_id(body) >> (NODE_BITS + SEQUENCE_BITS)) + EPOCH_MS
+    return None
+
+
+def id_sort_key(id_text):
+    """新旧格式混合时按时间排序用的键：(时间戳, ID)；无法解析时间的ID排在最前"""
+    timestamp = id_timestamp(id_text)
+    return (timestamp if timestamp is not None else -1), str(id_text)
+
+
+_allocator = IdAllocator()
+
+
+def new_id(prefix):
+    """从进程共享的分配器获取一个新ID"""
+    return _allocator.next_id(prefix)